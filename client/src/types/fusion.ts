@@ -1,4 +1,4 @@
-export type FuseboxTransformSource = 'helper-generated' | 'helper-cache' | 'helper-regenerated' | 'matrix-fallback' | 'matrix-validated';
+export type FuseboxTransformSource = 'helper-generated' | 'helper-cache' | 'helper-regenerated' | 'matrix-fallback' | 'matrix-validated' | 'reg-inprocess';
 
 export interface RegistrationTransformCandidate {
   id: string;
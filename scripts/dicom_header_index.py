@@ -0,0 +1,286 @@
+#!/usr/bin/env python3
+"""Persistent DICOM header index shared by the fusebox and DSC scripts.
+
+Sorting a series used to open every file with a fresh reader on every run,
+and fusion_dsc_test.py re-read the same headers with pydicom several times.
+This module parses the few geometry tags each script needs exactly once per
+file (header only, thread pool) and keeps them in a sidecar SQLite database
+keyed by path + mtime + size, so later runs skip the parse altogether.
+
+    from dicom_header_index import default_index
+
+    index = default_index()
+    headers = index.headers(paths)          # same order as paths
+    ordered = index.sorted_paths(paths)     # along the slice normal
+
+Sidecar location: $DICOM_HEADER_INDEX, default <repo>/tmp/dicom_header_index.sqlite.
+Set DICOM_HEADER_INDEX=off to keep the index in memory only.
+
+CLI: python dicom_header_index.py <files or dirs...> prints the sorted series as JSON.
+"""
+from __future__ import annotations
+
+import argparse
+import json
+import os
+import sqlite3
+import sys
+import threading
+from concurrent.futures import ThreadPoolExecutor
+from pathlib import Path
+from typing import Any, Dict, List, Optional, Sequence
+
+import numpy as np
+import pydicom
+
+SCRIPT_DIR = Path(__file__).resolve().parent
+DEFAULT_INDEX_PATH = SCRIPT_DIR.parent / "tmp" / "dicom_header_index.sqlite"
+DEFAULT_WORKERS = int(os.environ.get("DICOM_HEADER_WORKERS", "8"))
+
+# Bump when the stored header fields change so stale rows are re-parsed
+INDEX_VERSION = 1
+
+HEADER_TAGS = [
+    "SOPInstanceUID",
+    "SOPClassUID",
+    "Modality",
+    "SeriesInstanceUID",
+    "SeriesDescription",
+    "FrameOfReferenceUID",
+    "InstanceNumber",
+    "ImagePositionPatient",
+    "ImageOrientationPatient",
+    "PixelSpacing",
+    "SliceThickness",
+    "Rows",
+    "Columns",
+]
+
+
+def _floats(value: Any) -> Optional[List[float]]:
+    if value is None:
+        return None
+    try:
+        return [float(v) for v in value]
+    except (TypeError, ValueError):
+        return None
+
+
+def parse_header(path: str) -> Dict[str, Any]:
+    """Read the indexed tags of one file without touching pixel data."""
+    ds = pydicom.dcmread(path, stop_before_pixels=True, specific_tags=HEADER_TAGS, force=True)
+    return header_from_dataset(ds, path)
+
+
+def header_from_dataset(ds: pydicom.Dataset, path: str) -> Dict[str, Any]:
+    """The indexed header fields of an already-read dataset."""
+
+    def text(keyword: str) -> Optional[str]:
+        value = getattr(ds, keyword, None)
+        return str(value).strip() if value is not None else None
+
+    def number(keyword: str, cast=float):
+        value = getattr(ds, keyword, None)
+        try:
+            return cast(value) if value is not None and value != "" else None
+        except (TypeError, ValueError):
+            return None
+
+    ipp = _floats(getattr(ds, "ImagePositionPatient", None))
+    iop = _floats(getattr(ds, "ImageOrientationPatient", None))
+    header: Dict[str, Any] = {
+        "path": path,
+        "sopInstanceUID": text("SOPInstanceUID"),
+        "sopClassUID": text("SOPClassUID"),
+        "modality": text("Modality"),
+        "seriesInstanceUID": text("SeriesInstanceUID"),
+        "seriesDescription": text("SeriesDescription"),
+        "frameOfReferenceUID": text("FrameOfReferenceUID"),
+        "instanceNumber": number("InstanceNumber", int),
+        "ipp": ipp,
+        "iop": iop,
+        "pixelSpacing": _floats(getattr(ds, "PixelSpacing", None)),
+        "sliceThickness": number("SliceThickness"),
+        "rows": number("Rows", int),
+        "columns": number("Columns", int),
+        "normal": None,
+        "position": None,
+    }
+    if ipp is not None and iop is not None and len(iop) >= 6 and len(ipp) >= 3:
+        normal = np.cross(iop[:3], iop[3:6])
+        norm = float(np.linalg.norm(normal))
+        if norm > 0:
+            normal = normal / norm
+            header["normal"] = [float(v) for v in normal]
+            # Signed distance of the slice plane along its own normal
+            header["position"] = float(np.dot(ipp[:3], normal))
+    return header
+
+
+class HeaderIndex:
+    """Header cache: in-memory dict in front of an optional SQLite sidecar."""
+
+    def __init__(self, index_path: Optional[Path] = None, max_workers: int = DEFAULT_WORKERS):
+        self.max_workers = max(1, max_workers)
+        self._memory: Dict[str, tuple] = {}  # path -> (mtime_ns, size, header)
+        self._lock = threading.Lock()
+        self._db: Optional[sqlite3.Connection] = None
+        self.hits = 0
+        self.misses = 0
+        if index_path is not None:
+            try:
+                index_path.parent.mkdir(parents=True, exist_ok=True)
+                self._db = sqlite3.connect(str(index_path), check_same_thread=False)
+                self._db.execute(
+                    "CREATE TABLE IF NOT EXISTS headers ("
+                    " path TEXT PRIMARY KEY, mtime_ns INTEGER, size INTEGER, version INTEGER, header TEXT)"
+                )
+                self._db.commit()
+            except sqlite3.Error as exc:
+                print(f"🐟 FUSION: Header index unavailable at {index_path}, using memory only: {exc}", file=sys.stderr)
+                self._db = None
+
+    @staticmethod
+    def _stat(path: str) -> Optional[tuple]:
+        try:
+            st = os.stat(path)
+        except OSError:
+            return None
+        return st.st_mtime_ns, st.st_size
+
+    def _lookup(self, paths: Sequence[str], stats: Dict[str, Optional[tuple]]) -> Dict[str, Dict[str, Any]]:
+        found: Dict[str, Dict[str, Any]] = {}
+        with self._lock:
+            for path in paths:
+                entry = self._memory.get(path)
+                if entry is not None and stats[path] == entry[:2]:
+                    found[path] = entry[2]
+
+            remaining = [p for p in paths if p not in found and stats[p] is not None]
+            if self._db is not None and remaining:
+                # SQLite caps host parameters; query in chunks
+                for start in range(0, len(remaining), 500):
+                    chunk = remaining[start:start + 500]
+                    rows = self._db.execute(
+                        f"SELECT path, mtime_ns, size, version, header FROM headers WHERE path IN ({','.join('?' * len(chunk))})",
+                        chunk,
+                    ).fetchall()
+                    for path, mtime_ns, size, version, header_json in rows:
+                        if version == INDEX_VERSION and stats[path] == (mtime_ns, size):
+                            header = json.loads(header_json)
+                            found[path] = header
+                            self._memory[path] = (mtime_ns, size, header)
+        return found
+
+    def _store(self, parsed: Dict[str, Dict[str, Any]], stats: Dict[str, Optional[tuple]]) -> None:
+        with self._lock:
+            rows = []
+            for path, header in parsed.items():
+                mtime_ns, size = stats[path]
+                self._memory[path] = (mtime_ns, size, header)
+                rows.append((path, mtime_ns, size, INDEX_VERSION, json.dumps(header)))
+            if self._db is not None and rows:
+                try:
+                    self._db.executemany(
+                        "INSERT OR REPLACE INTO headers (path, mtime_ns, size, version, header) VALUES (?, ?, ?, ?, ?)",
+                        rows,
+                    )
+                    self._db.commit()
+                except sqlite3.Error as exc:
+                    print(f"🐟 FUSION: Failed to persist header index: {exc}", file=sys.stderr)
+
+    def add(self, headers: Sequence[Dict[str, Any]]) -> int:
+        """Seed the index with headers parsed elsewhere (e.g. the study indexer); returns how many were stored."""
+        stats = {h["path"]: self._stat(h["path"]) for h in headers}
+        parsed = {h["path"]: h for h in headers if stats[h["path"]] is not None}
+        if parsed:
+            self._store(parsed, stats)
+        return len(parsed)
+
+    def headers(self, paths: Sequence[str]) -> List[Dict[str, Any]]:
+        """Headers for paths, in the same order; unreadable files raise."""
+        paths = [str(p) for p in paths]
+        stats = {p: self._stat(p) for p in paths}
+        missing = [p for p, st in stats.items() if st is None]
+        if missing:
+            raise FileNotFoundError(f"DICOM file not found: {missing[0]}")
+
+        found = self._lookup(paths, stats)
+        to_parse = list(dict.fromkeys(p for p in paths if p not in found))
+        self.hits += len(paths) - len(to_parse)
+        self.misses += len(to_parse)
+
+        if to_parse:
+            if len(to_parse) == 1 or self.max_workers == 1:
+                parsed_list = [parse_header(p) for p in to_parse]
+            else:
+                with ThreadPoolExecutor(max_workers=min(self.max_workers, len(to_parse))) as pool:
+                    parsed_list = list(pool.map(parse_header, to_parse))
+            parsed = dict(zip(to_parse, parsed_list))
+            self._store(parsed, stats)
+            found.update(parsed)
+
+        return [found[p] for p in paths]
+
+    def header(self, path: str) -> Dict[str, Any]:
+        return self.headers([path])[0]
+
+    def sorted_headers(self, paths: Sequence[str]) -> List[Dict[str, Any]]:
+        """Headers ordered along the slice normal (files without geometry sort as 0.0)."""
+        headers = self.headers(paths)
+        for header in headers:
+            if header.get("position") is None:
+                print(f"🐟 FUSION: Unable to compute slice ordering for {header['path']}: missing IPP/IOP", file=sys.stderr)
+        return sorted(headers, key=lambda h: h["position"] if h.get("position") is not None else 0.0)
+
+    def sorted_paths(self, paths: Sequence[str]) -> List[str]:
+        if len(paths) <= 1:
+            return [str(p) for p in paths]
+        return [h["path"] for h in self.sorted_headers(paths)]
+
+    def stats(self) -> Dict[str, Any]:
+        return {"hits": self.hits, "misses": self.misses, "memoryEntries": len(self._memory), "persistent": self._db is not None}
+
+
+_default_index: Optional[HeaderIndex] = None
+_default_lock = threading.Lock()
+
+
+def default_index() -> HeaderIndex:
+    """Process-wide index using the configured sidecar."""
+    global _default_index
+    with _default_lock:
+        if _default_index is None:
+            configured = os.environ.get("DICOM_HEADER_INDEX")
+            if configured and configured.lower() in ("off", "none", "0", "memory"):
+                index_path = None
+            else:
+                index_path = Path(configured) if configured else DEFAULT_INDEX_PATH
+            _default_index = HeaderIndex(index_path)
+        return _default_index
+
+
+def main(argv: List[str]) -> int:
+    parser = argparse.ArgumentParser(description="Index DICOM headers and print the series sorted along its normal")
+    parser.add_argument("paths", nargs="+", help="DICOM files or directories of them")
+    args = parser.parse_args(argv)
+
+    try:
+        files: List[str] = []
+        for arg in args.paths:
+            path = Path(arg)
+            if path.is_dir():
+                files.extend(str(p) for p in sorted(path.iterdir()) if p.is_file())
+            else:
+                files.append(str(path))
+        index = default_index()
+        headers = index.sorted_headers(files)
+    except Exception as exc:
+        print(json.dumps({"error": str(exc)}))
+        return 1
+    print(json.dumps({"headers": headers, "stats": index.stats()}))
+    return 0
+
+
+if __name__ == "__main__":
+    sys.exit(main(sys.argv[1:]))
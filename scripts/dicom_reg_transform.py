@@ -0,0 +1,387 @@
+#!/usr/bin/env python3
+"""In-process DICOM REG → SimpleITK transform conversion.
+
+Fusebox turned registrations into transforms by running the external
+dicom_reg_to_h5 helper and reading its HDF5 output back, while
+fusion_dsc_test.py and verify_fusebox_transform.py each parsed the same
+matrices with their own pydicom loops. This module converts REG objects
+directly:
+
+  - Spatial Registration: MatrixRegistrationSequence matrices per frame of
+    reference (the MatrixSequence items of one frame are applied in order)
+  - Deformable Spatial Registration: pre-deformation matrix, displacement
+    grid (DeformableRegistrationGridSequence), post-deformation matrix
+
+Results follow the helper's convention, registration(moving) ∘
+registration(fixed)⁻¹ (pre-deformation matrix, then displacement, then
+post-deformation matrix for a deformable moving frame), so they drop in
+wherever the helper's .h5 was used. Affine results come back as a single
+AffineTransform, which the fusebox scripts invert before resampling;
+deformable results are a CompositeTransform, which SimpleITK cannot invert
+and which the scripts therefore resample with as-is, just like a deformable
+helper file.
+
+    from dicom_reg_transform import registration_transform
+
+    xform, kind = registration_transform(reg_path, fixed_for, moving_for)  # kind: 'affine' | 'deformable'
+
+Results are memoized on disk by SOP Instance UID and frame-of-reference pair
+in $DICOM_REG_TRANSFORM_CACHE (default <repo>/tmp/fusebox-transforms/registrations),
+plus in memory for long-lived processes. DICOM_REG_TRANSFORM_CACHE=off keeps
+the memo in memory only.
+
+CLI (same arguments as dicom_reg_to_h5):
+    python dicom_reg_transform.py --input reg.dcm --output out.h5 [--fixed FoR] [--moving FoR]
+"""
+from __future__ import annotations
+
+import argparse
+import hashlib
+import json
+import os
+import shutil
+import sys
+import threading
+from pathlib import Path
+from typing import Any, Dict, List, Optional, Sequence, Tuple
+
+import numpy as np
+import pydicom
+import SimpleITK as sitk
+
+SCRIPT_DIR = Path(__file__).resolve().parent
+DEFAULT_CACHE_ROOT = SCRIPT_DIR.parent / "tmp" / "fusebox-transforms" / "registrations"
+
+# Bump when conversion results change for the same REG object
+CONVERTER_VERSION = 1
+
+def read_registration(reg_path: str) -> pydicom.Dataset:
+    dataset = pydicom.dcmread(str(reg_path), force=True)
+    if not hasattr(dataset, "RegistrationSequence") and not hasattr(dataset, "DeformableRegistrationSequence"):
+        raise ValueError(f"{reg_path} is not a DICOM registration (no Registration/DeformableRegistration sequence)")
+    return dataset
+
+
+def _matrix(item: Any) -> Optional[np.ndarray]:
+    values = getattr(item, "FrameOfReferenceTransformationMatrix", None)
+    if values is None or len(values) != 16:
+        return None
+    return np.array([float(v) for v in values], dtype=float).reshape(4, 4)
+
+
+def matrix_candidates(dataset: pydicom.Dataset) -> List[np.ndarray]:
+    """Every MatrixRegistrationSequence matrix in file order."""
+    candidates: List[np.ndarray] = []
+    for registration in getattr(dataset, "RegistrationSequence", []):
+        for matrix_reg in getattr(registration, "MatrixRegistrationSequence", []):
+            for item in getattr(matrix_reg, "MatrixSequence", []):
+                matrix = _matrix(item)
+                if matrix is not None:
+                    candidates.append(matrix)
+    return candidates
+
+
+def registration_matrix(reg_path: str, prefer_non_identity: bool = True) -> np.ndarray:
+    """The matrix the viewer's REG parser picks: the last (non-identity) candidate."""
+    candidates = matrix_candidates(read_registration(reg_path))
+    if not candidates:
+        raise ValueError(f"No transformation matrices found in {reg_path}")
+    if prefer_non_identity:
+        for matrix in reversed(candidates):
+            if not np.allclose(matrix, np.eye(4)):
+                return matrix
+    return candidates[-1]
+
+
+def _compose(matrices: Sequence[np.ndarray]) -> np.ndarray:
+    """Matrices applied in the order listed."""
+    combined = np.eye(4)
+    for matrix in matrices:
+        combined = matrix @ combined
+    return combined
+
+
+def _affine(matrix: np.ndarray) -> sitk.AffineTransform:
+    affine = sitk.AffineTransform(3)
+    affine.SetMatrix([float(v) for v in matrix[:3, :3].ravel()])
+    affine.SetTranslation([float(v) for v in matrix[:3, 3]])
+    return affine
+
+
+def _frame_matrices(dataset: pydicom.Dataset) -> Dict[str, np.ndarray]:
+    frames: Dict[str, np.ndarray] = {}
+    for registration in getattr(dataset, "RegistrationSequence", []):
+        frame = str(getattr(registration, "FrameOfReferenceUID", "") or "")
+        matrices = [
+            m
+            for matrix_reg in getattr(registration, "MatrixRegistrationSequence", [])
+            for m in (_matrix(item) for item in getattr(matrix_reg, "MatrixSequence", []))
+            if m is not None
+        ]
+        if frame:
+            frames[frame] = _compose(matrices)
+    return frames
+
+
+def _displacement_field(grid: Any) -> sitk.Image:
+    """DeformableRegistrationGridSequence item → vector image of float64 displacements."""
+    dims = [int(v) for v in grid.GridDimensions]
+    vectors = grid.VectorGridData
+    if isinstance(vectors, (bytes, bytearray)):
+        data = np.frombuffer(vectors, dtype="<f4")
+    else:
+        data = np.asarray(vectors, dtype=np.float32)
+    expected = dims[0] * dims[1] * dims[2] * 3
+    if data.size != expected:
+        raise ValueError(f"VectorGridData holds {data.size} values, grid {dims} needs {expected}")
+
+    field = sitk.GetImageFromArray(data.reshape(dims[2], dims[1], dims[0], 3).astype(np.float64), isVector=True)
+    iop = np.array([float(v) for v in grid.ImageOrientationPatient], dtype=float)
+    row, col = iop[:3], iop[3:6]
+    normal = np.cross(row, col)
+    field.SetOrigin([float(v) for v in grid.ImagePositionPatient])
+    field.SetSpacing([float(v) for v in grid.GridResolution])
+    field.SetDirection([float(v) for v in np.column_stack([row, col, normal]).ravel()])
+    return field
+
+
+def _deformable_frames(dataset: pydicom.Dataset) -> Dict[str, Dict[str, Any]]:
+    frames: Dict[str, Dict[str, Any]] = {}
+    for registration in getattr(dataset, "DeformableRegistrationSequence", []):
+        frame = str(getattr(registration, "SourceFrameOfReferenceUID", "") or "")
+        if not frame:
+            continue
+
+        def matrix_of(keyword: str) -> np.ndarray:
+            items = getattr(registration, keyword, None)
+            matrix = _matrix(items[0]) if items else None
+            return matrix if matrix is not None else np.eye(4)
+
+        grids = getattr(registration, "DeformableRegistrationGridSequence", None)
+        frames[frame] = {
+            "pre": matrix_of("PreDeformationMatrixRegistrationSequence"),
+            "post": matrix_of("PostDeformationMatrixRegistrationSequence"),
+            "grid": grids[0] if grids else None,
+        }
+    return frames
+
+
+def build_registration_transform(
+    dataset: pydicom.Dataset,
+    fixed_for: Optional[str] = None,
+    moving_for: Optional[str] = None,
+) -> Tuple[sitk.Transform, str]:
+    """Convert a parsed REG for one fixed/moving frame-of-reference pair.
+
+    fixed_for defaults to the REG's own frame of reference, moving_for to the
+    first other frame it registers. Returns (transform, kind); see the module
+    docstring for the orientation of each kind.
+    """
+    registered_for = str(getattr(dataset, "FrameOfReferenceUID", "") or "")
+    matrices = _frame_matrices(dataset)
+    deformable = _deformable_frames(dataset)
+    known = list(dict.fromkeys([*matrices, *deformable]))
+
+    fixed_for = fixed_for or registered_for
+    if not moving_for:
+        others = [frame for frame in known if frame != fixed_for]
+        if not others:
+            raise ValueError("REG registers no frame of reference other than the fixed one")
+        moving_for = others[0]
+
+    def frame_matrix(frame: str) -> np.ndarray:
+        if frame in matrices:
+            return matrices[frame]
+        if frame in deformable and deformable[frame]["grid"] is None:
+            return deformable[frame]["post"] @ deformable[frame]["pre"]
+        if frame == registered_for:
+            return np.eye(4)
+        raise ValueError(f"REG has no registration for frame of reference {frame}")
+
+    if fixed_for in deformable and deformable[fixed_for]["grid"] is not None:
+        raise ValueError("Deformable registration of the fixed frame of reference is not supported")
+
+    moving_deformable = deformable.get(moving_for)
+    if moving_deformable is None or moving_deformable["grid"] is None:
+        return _affine(frame_matrix(moving_for) @ np.linalg.inv(frame_matrix(fixed_for))), "affine"
+
+    composite = sitk.CompositeTransform(3)
+
+    def add_affine(matrix: np.ndarray) -> None:
+        if not np.allclose(matrix, np.eye(4)):
+            composite.AddTransform(_affine(matrix))
+
+    # CompositeTransform applies the last added transform first:
+    # post ∘ (x + D(x)) ∘ pre ∘ registration(fixed)⁻¹
+    add_affine(moving_deformable["post"])
+    composite.AddTransform(sitk.DisplacementFieldTransform(_displacement_field(moving_deformable["grid"])))
+    add_affine(moving_deformable["pre"])
+    add_affine(np.linalg.inv(frame_matrix(fixed_for)))
+    return composite, "deformable"
+
+
+def registration_uid(reg_path: str) -> str:
+    dataset = pydicom.dcmread(str(reg_path), stop_before_pixels=True, specific_tags=["SOPInstanceUID"], force=True)
+    uid = str(getattr(dataset, "SOPInstanceUID", "") or "")
+    if not uid:
+        raise ValueError(f"{reg_path} has no SOPInstanceUID")
+    return uid
+
+
+class RegistrationTransformCache:
+    """Converted transforms keyed by REG SOP Instance UID + frame-of-reference pair.
+
+    In-memory dict in front of an optional directory of <key>.h5 transforms
+    with <key>.json sidecars recording the kind.
+    """
+
+    def __init__(self, root: Optional[Path]):
+        self.root = root
+        self._memory: Dict[str, Tuple[sitk.Transform, str]] = {}
+        self._lock = threading.Lock()
+        self.hits = 0
+        self.conversions = 0
+
+    @classmethod
+    def from_environment(cls) -> "RegistrationTransformCache":
+        configured = os.environ.get("DICOM_REG_TRANSFORM_CACHE")
+        if configured and configured.lower() in ("off", "none", "0", "memory"):
+            return cls(None)
+        return cls(Path(configured) if configured else DEFAULT_CACHE_ROOT)
+
+    @staticmethod
+    def key(sop_uid: str, fixed_for: Optional[str], moving_for: Optional[str]) -> str:
+        raw = f"{CONVERTER_VERSION}\0{sop_uid}\0{fixed_for or ''}\0{moving_for or ''}".encode()
+        return hashlib.blake2b(raw, digest_size=20).hexdigest()
+
+    def path(self, key: str) -> Optional[Path]:
+        return self.root / f"{key}.h5" if self.root is not None else None
+
+    def load(self, key: str) -> Optional[Tuple[sitk.Transform, str]]:
+        with self._lock:
+            cached = self._memory.get(key)
+        if cached is not None:
+            return cached
+        if self.root is None:
+            return None
+        try:
+            meta = json.loads((self.root / f"{key}.json").read_text(encoding="utf-8"))
+            transform = sitk.ReadTransform(str(self.root / f"{key}.h5"))
+        except (OSError, ValueError, RuntimeError):
+            return None
+        if isinstance(transform, sitk.CompositeTransform) and meta.get("kind") == "affine":
+            transform = transform.GetNthTransform(0)  # ReadTransform wraps single transforms
+        entry = (transform, str(meta.get("kind", "affine")))
+        with self._lock:
+            self._memory[key] = entry
+        return entry
+
+    def store(self, key: str, transform: sitk.Transform, kind: str, meta: Dict[str, Any]) -> None:
+        with self._lock:
+            self._memory[key] = (transform, kind)
+        if self.root is None:
+            return
+        staging = self.root / f".{key}.{os.getpid()}.{threading.get_ident()}.h5"
+        try:
+            self.root.mkdir(parents=True, exist_ok=True)
+            sitk.WriteTransform(transform, str(staging))
+            os.replace(staging, self.root / f"{key}.h5")
+            (self.root / f"{key}.json").write_text(json.dumps({**meta, "kind": kind, "version": CONVERTER_VERSION}), encoding="utf-8")
+        except (OSError, RuntimeError) as exc:
+            print(f"🐟 FUSION: Failed to persist converted registration {key}: {exc}", file=sys.stderr)
+            staging.unlink(missing_ok=True)
+
+    def stats(self) -> Dict[str, Any]:
+        return {
+            "root": str(self.root) if self.root is not None else None,
+            "memoryEntries": len(self._memory),
+            "hits": self.hits,
+            "conversions": self.conversions,
+        }
+
+
+_default_cache: Optional[RegistrationTransformCache] = None
+_default_lock = threading.Lock()
+
+
+def default_cache() -> RegistrationTransformCache:
+    """Process-wide memo using the configured directory."""
+    global _default_cache
+    with _default_lock:
+        if _default_cache is None:
+            _default_cache = RegistrationTransformCache.from_environment()
+        return _default_cache
+
+
+def registration_transform(
+    reg_path: str,
+    fixed_for: Optional[str] = None,
+    moving_for: Optional[str] = None,
+    cache: Optional[RegistrationTransformCache] = None,
+) -> Tuple[sitk.Transform, str]:
+    """Memoized conversion of one REG file; returns (transform, kind)."""
+    cache = cache or default_cache()
+    sop_uid = registration_uid(reg_path)
+    key = cache.key(sop_uid, fixed_for, moving_for)
+    cached = cache.load(key)
+    if cached is not None:
+        cache.hits += 1
+        return cached
+
+    transform, kind = build_registration_transform(read_registration(reg_path), fixed_for, moving_for)
+    cache.conversions += 1
+    print(f"🐟 FUSION: Converted {kind} registration {sop_uid} in-process", file=sys.stderr)
+    cache.store(key, transform, kind, {"sopInstanceUID": sop_uid, "fixed": fixed_for, "moving": moving_for})
+    return transform, kind
+
+
+def frame_of_reference(files: Optional[Sequence[str]]) -> Optional[str]:
+    """FrameOfReferenceUID of a series' first file, via the shared header index."""
+    if not files:
+        return None
+    from dicom_header_index import default_index
+
+    return default_index().header(str(files[0])).get("frameOfReferenceUID")
+
+
+def registration_frames(cfg: Dict[str, Any]) -> Tuple[Optional[str], Optional[str]]:
+    """Fixed/moving FrameOfReferenceUIDs a fusebox config's registrationFile is resolved for.
+
+    The frames default to the series' own FrameOfReferenceUIDs; override with
+    fixedFrameOfReferenceUID / movingFrameOfReferenceUID.
+    """
+    fixed_for = cfg.get("fixedFrameOfReferenceUID") or frame_of_reference(cfg.get("primary"))
+    moving_for = cfg.get("movingFrameOfReferenceUID") or frame_of_reference(cfg.get("secondary"))
+    return fixed_for, moving_for
+
+
+def registration_transform_from_config(cfg: Dict[str, Any]) -> Tuple[sitk.Transform, str]:
+    """Resolve a fusebox config's registrationFile for its primary/secondary series (see registration_frames)."""
+    fixed_for, moving_for = registration_frames(cfg)
+    return registration_transform(str(cfg["registrationFile"]), fixed_for, moving_for)
+
+
+def main(argv: Optional[Sequence[str]] = None) -> int:
+    parser = argparse.ArgumentParser(description="Convert a DICOM REG to an ITK transform file")
+    parser.add_argument("--input", required=True, help="REG DICOM file")
+    parser.add_argument("--output", required=True, help="Transform file to write (.h5 or .tfm)")
+    parser.add_argument("--fixed", help="Fixed FrameOfReferenceUID (default: the REG's own)")
+    parser.add_argument("--moving", help="Moving FrameOfReferenceUID (default: the first other frame)")
+    args = parser.parse_args(argv)
+
+    try:
+        transform, kind = registration_transform(args.input, args.fixed, args.moving)
+        cached = default_cache().path(default_cache().key(registration_uid(args.input), args.fixed, args.moving))
+        if cached is not None and cached.exists() and Path(args.output).suffix == ".h5":
+            shutil.copyfile(cached, args.output)
+        else:
+            sitk.WriteTransform(transform, args.output)
+    except Exception as exc:
+        print(json.dumps({"ok": False, "error": str(exc)}))
+        return 1
+    print(json.dumps({"ok": True, "output": args.output, "kind": kind}))
+    return 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
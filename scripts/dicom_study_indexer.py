@@ -0,0 +1,514 @@
+#!/usr/bin/env python3
+"""Header-only DICOM study indexer for archive directories and zip uploads.
+
+The one-off analysis scripts walked a directory with os.listdir and read every
+file serially (some with pixel data, just for metadata); zip uploads were
+extracted first. This indexer reads headers only (stop_before_pixels plus
+specific_tags) in a thread pool, straight from directories or from zip
+members without extracting them, and writes one JSON index:
+
+  studies            StudyInstanceUID -> patient, date, description, series UIDs
+  series             SeriesInstanceUID -> modality, frame of reference, geometry
+                     and files ordered along the slice normal
+  frameOfReference   FrameOfReferenceUID -> series UIDs
+  dependencies       one entry per REG / RTSTRUCT / RTDOSE instance with the
+                     series it registers, contours or covers
+  duplicates         files whose SOPInstanceUID was already indexed (the first
+                     path is kept), next to the unreadable files in errors
+  pairs              fixed/moving image series for every REG, in the shape the
+                     fusebox (primary/secondary/registrationFile) and
+                     fusion_dsc_test --batch (primaryFiles/secondaryFiles/reg/
+                     rtstruct) configs take
+
+Zip members are addressed as "<archive>::<member>"; materialize() extracts
+just the series a caller needs. Headers of files on disk are also added to
+the shared dicom_header_index, so later fusebox/DSC runs skip parsing them.
+
+    python dicom_study_indexer.py <dirs, zips or files...> --output index.json
+        [--workers N] [--processes N] [--pairs pairs.json] [--no-header-index]
+
+Threads: $DICOM_INDEXER_WORKERS (default 16; header reads wait on I/O).
+Processes: $DICOM_INDEXER_PROCESSES (default min(8, CPUs)) for large inputs,
+since decoding header values is CPU-bound.
+"""
+from __future__ import annotations
+
+import argparse
+import json
+import os
+import sys
+import threading
+import time
+import zipfile
+from collections import defaultdict
+from concurrent.futures import ProcessPoolExecutor, ThreadPoolExecutor
+from pathlib import Path
+from typing import Any, Dict, Iterable, List, Optional, Sequence, Tuple
+
+import pydicom
+
+SCRIPT_DIR = Path(__file__).resolve().parent
+if str(SCRIPT_DIR) not in sys.path:
+    sys.path.insert(0, str(SCRIPT_DIR))
+
+from dicom_header_index import HEADER_TAGS, default_index, header_from_dataset  # noqa: E402
+
+INDEX_VERSION = 1
+DEFAULT_WORKERS = int(os.environ.get("DICOM_INDEXER_WORKERS", "16"))
+DEFAULT_PROCESSES = int(os.environ.get("DICOM_INDEXER_PROCESSES", str(min(8, os.cpu_count() or 1))))
+# Below this many files per process, process start-up costs more than it saves
+PROCESS_CHUNK = 500
+ZIP_SEPARATOR = "::"
+
+STUDY_TAGS = HEADER_TAGS + [
+    "StudyInstanceUID",
+    "StudyDate",
+    "StudyDescription",
+    "PatientID",
+    "PatientName",
+    "SeriesNumber",
+    # REG
+    "RegistrationSequence",
+    "DeformableRegistrationSequence",
+    "ReferencedSeriesSequence",
+    "StudiesContainingOtherReferencedInstancesSequence",
+    # RTSTRUCT
+    "ReferencedFrameOfReferenceSequence",
+    # RTDOSE
+    "ReferencedRTPlanSequence",
+    "ReferencedStructureSetSequence",
+    "NumberOfFrames",
+    "GridFrameOffsetVector",
+    "DoseGridScaling",
+    "DoseUnits",
+    "DoseType",
+    "DoseSummationType",
+]
+
+DEPENDENT_MODALITIES = ("REG", "RTSTRUCT", "RTDOSE")
+NON_IMAGE_MODALITIES = {"REG", "RTSTRUCT", "RTDOSE", "RTPLAN", "RTRECORD", "SR", "KO", "PR", "SEG", "RAW"}
+
+
+def _text(value: Any) -> Optional[str]:
+    return str(value).strip() if value is not None else None
+
+
+def _uids(items: Iterable[Any], keyword: str) -> List[str]:
+    return [str(getattr(item, keyword)) for item in items or [] if getattr(item, keyword, None)]
+
+
+def split_path(path: str) -> Tuple[Optional[str], str]:
+    """'<archive>::<member>' -> (archive, member); plain paths -> (None, path)."""
+    if ZIP_SEPARATOR in path:
+        archive, member = path.split(ZIP_SEPARATOR, 1)
+        return archive, member
+    return None, path
+
+
+def collect_sources(inputs: Sequence[str]) -> List[str]:
+    """Every candidate file: directory trees walked with scandir, zip members listed from the central directory."""
+    found: List[str] = []
+
+    def add_zip(archive: str) -> None:
+        with zipfile.ZipFile(archive) as zf:
+            found.extend(
+                f"{archive}{ZIP_SEPARATOR}{info.filename}"
+                for info in zf.infolist()
+                if not info.is_dir() and not Path(info.filename).name.startswith(".")
+            )
+
+    def walk(directory: str) -> None:
+        with os.scandir(directory) as entries:
+            for entry in entries:
+                if entry.name.startswith("."):
+                    continue
+                if entry.is_dir(follow_symlinks=False):
+                    walk(entry.path)
+                elif entry.is_file():
+                    if zipfile.is_zipfile(entry.path) and entry.name.lower().endswith(".zip"):
+                        add_zip(entry.path)
+                    else:
+                        found.append(entry.path)
+
+    for raw in inputs:
+        path = str(Path(raw))
+        if os.path.isdir(path):
+            walk(path)
+        elif path.lower().endswith(".zip") and zipfile.is_zipfile(path):
+            add_zip(path)
+        elif os.path.isfile(path):
+            found.append(path)
+    return found
+
+
+class _ZipHandles:
+    """One ZipFile per archive per thread; a shared handle would serialize member reads."""
+
+    def __init__(self):
+        self._local = threading.local()
+        self._opened: List[zipfile.ZipFile] = []
+        self._lock = threading.Lock()
+
+    def open(self, archive: str, member: str):
+        handles = getattr(self._local, "handles", None)
+        if handles is None:
+            handles = self._local.handles = {}
+        zf = handles.get(archive)
+        if zf is None:
+            zf = handles[archive] = zipfile.ZipFile(archive)
+            with self._lock:
+                self._opened.append(zf)
+        return zf.open(member)
+
+    def close(self) -> None:
+        with self._lock:
+            for zf in self._opened:
+                zf.close()
+            self._opened.clear()
+
+
+def dependency_fields(ds: pydicom.Dataset, modality: Optional[str]) -> Dict[str, Any]:
+    """What a REG / RTSTRUCT / RTDOSE instance refers to, as stored in its header."""
+    if modality == "REG":
+        own = _text(getattr(ds, "FrameOfReferenceUID", None))
+        frames = _uids(getattr(ds, "RegistrationSequence", None), "FrameOfReferenceUID")
+        frames += _uids(getattr(ds, "DeformableRegistrationSequence", None), "SourceFrameOfReferenceUID")
+        series = _uids(getattr(ds, "ReferencedSeriesSequence", None), "SeriesInstanceUID")
+        for study in getattr(ds, "StudiesContainingOtherReferencedInstancesSequence", None) or []:
+            series += _uids(getattr(study, "ReferencedSeriesSequence", None), "SeriesInstanceUID")
+        return {
+            "fixedFrameOfReferenceUID": own,
+            "movingFrameOfReferenceUIDs": sorted({f for f in frames if f != own}),
+            "referencedSeries": sorted(set(series)),
+        }
+    if modality == "RTSTRUCT":
+        frames: List[str] = []
+        series: List[str] = []
+        for ref_frame in getattr(ds, "ReferencedFrameOfReferenceSequence", None) or []:
+            if getattr(ref_frame, "FrameOfReferenceUID", None):
+                frames.append(str(ref_frame.FrameOfReferenceUID))
+            for study in getattr(ref_frame, "RTReferencedStudySequence", None) or []:
+                series += _uids(getattr(study, "RTReferencedSeriesSequence", None), "SeriesInstanceUID")
+        return {"referencedFrameOfReferenceUIDs": sorted(set(frames)), "referencedSeries": sorted(set(series))}
+    if modality == "RTDOSE":
+        offsets = getattr(ds, "GridFrameOffsetVector", None)
+        return {
+            "referencedPlans": _uids(getattr(ds, "ReferencedRTPlanSequence", None), "ReferencedSOPInstanceUID"),
+            "referencedStructureSets": _uids(getattr(ds, "ReferencedStructureSetSequence", None), "ReferencedSOPInstanceUID"),
+            "numberOfFrames": int(ds.NumberOfFrames) if getattr(ds, "NumberOfFrames", None) else None,
+            "gridFrames": len(offsets) if offsets is not None else None,
+            "doseGridScaling": float(ds.DoseGridScaling) if getattr(ds, "DoseGridScaling", None) is not None else None,
+            "doseUnits": _text(getattr(ds, "DoseUnits", None)),
+            "doseType": _text(getattr(ds, "DoseType", None)),
+            "doseSummationType": _text(getattr(ds, "DoseSummationType", None)),
+        }
+    return {}
+
+
+def read_record(path: str, zips: _ZipHandles) -> Dict[str, Any]:
+    """Header record of one file or zip member; raises for unreadable / non-DICOM input."""
+    archive, member = split_path(path)
+    if archive is None:
+        ds = pydicom.dcmread(path, stop_before_pixels=True, specific_tags=STUDY_TAGS, force=True)
+    else:
+        with zips.open(archive, member) as fh:
+            # Members are streamed; decompression stops where the header does
+            ds = pydicom.dcmread(fh, stop_before_pixels=True, specific_tags=STUDY_TAGS, force=True)
+    if not getattr(ds, "SOPInstanceUID", None) or not getattr(ds, "SOPClassUID", None):
+        raise ValueError("not a DICOM instance")
+    header = header_from_dataset(ds, path)
+    modality = header.get("modality")
+    return {
+        "header": header,
+        "studyInstanceUID": _text(getattr(ds, "StudyInstanceUID", None)),
+        "studyDate": _text(getattr(ds, "StudyDate", None)),
+        "studyDescription": _text(getattr(ds, "StudyDescription", None)),
+        "patientId": _text(getattr(ds, "PatientID", None)),
+        "patientName": _text(getattr(ds, "PatientName", None)),
+        "seriesNumber": _text(getattr(ds, "SeriesNumber", None)),
+        "dependency": dependency_fields(ds, modality) if modality in DEPENDENT_MODALITIES else None,
+    }
+
+
+def _read_chunk(paths: Sequence[str], workers: int) -> Tuple[List[Dict[str, Any]], List[Dict[str, str]]]:
+    """Read one chunk of paths with a thread pool (runs in a worker process for large inputs)."""
+    zips = _ZipHandles()
+
+    def read(path: str):
+        try:
+            return read_record(path, zips), None
+        except Exception as exc:
+            return None, {"path": path, "error": str(exc)}
+
+    try:
+        if workers <= 1 or len(paths) <= 1:
+            results = [read(p) for p in paths]
+        else:
+            with ThreadPoolExecutor(max_workers=min(workers, len(paths))) as pool:
+                results = list(pool.map(read, paths))
+    finally:
+        zips.close()
+    records = [r for r, _ in results if r is not None]
+    errors = [e for _, e in results if e is not None]
+    return records, errors
+
+
+def read_records(
+    paths: Sequence[str],
+    workers: int = DEFAULT_WORKERS,
+    processes: int = DEFAULT_PROCESSES,
+) -> Tuple[List[Dict[str, Any]], List[Dict[str, str]]]:
+    """Header records for paths, in order, plus the files that were skipped.
+
+    Threads hide I/O latency; decoding the header values is CPU-bound under the
+    GIL, so inputs larger than PROCESS_CHUNK are also split across processes.
+    """
+    processes = max(1, min(processes, (len(paths) + PROCESS_CHUNK - 1) // PROCESS_CHUNK))
+    if processes == 1:
+        return _read_chunk(paths, workers)
+    step = (len(paths) + processes - 1) // processes
+    chunks = [paths[i:i + step] for i in range(0, len(paths), step)]
+    threads = max(1, workers // processes)
+    records: List[Dict[str, Any]] = []
+    errors: List[Dict[str, str]] = []
+    with ProcessPoolExecutor(max_workers=processes) as pool:
+        for chunk_records, chunk_errors in pool.map(_read_chunk, chunks, [threads] * len(chunks)):
+            records.extend(chunk_records)
+            errors.extend(chunk_errors)
+    return records, errors
+
+
+def _slice_key(header: Dict[str, Any]) -> Tuple[float, int]:
+    position = header.get("position")
+    return (position if position is not None else 0.0, header.get("instanceNumber") or 0)
+
+
+def deduplicate(records: Sequence[Dict[str, Any]]) -> Tuple[List[Dict[str, Any]], List[Dict[str, str]]]:
+    """Keep the first record per SOPInstanceUID (a directory indexed with its own zip, overlapping inputs)."""
+    first: Dict[str, str] = {}
+    unique: List[Dict[str, Any]] = []
+    duplicates: List[Dict[str, str]] = []
+    for record in records:
+        header = record["header"]
+        sop_uid = header.get("sopInstanceUID")
+        if sop_uid in first:
+            duplicates.append({"path": header["path"], "sopInstanceUID": sop_uid, "duplicateOf": first[sop_uid]})
+            continue
+        first[sop_uid] = header["path"]
+        unique.append(record)
+    return unique, duplicates
+
+
+def build_index(records: Sequence[Dict[str, Any]]) -> Dict[str, Any]:
+    """Group records by study / series / frame of reference and resolve dependencies.
+
+    Repeated SOPInstanceUIDs are dropped (first one wins) and listed under duplicates.
+    """
+    records, duplicates = deduplicate(records)
+    studies: Dict[str, Dict[str, Any]] = {}
+    series: Dict[str, Dict[str, Any]] = {}
+    members: Dict[str, List[Dict[str, Any]]] = defaultdict(list)
+    sop_to_series: Dict[str, str] = {}
+
+    for record in records:
+        header = record["header"]
+        series_uid = header.get("seriesInstanceUID") or f"unknown-series:{header['path']}"
+        study_uid = record.get("studyInstanceUID") or "unknown-study"
+        members[series_uid].append(record)
+        if header.get("sopInstanceUID"):
+            sop_to_series[header["sopInstanceUID"]] = series_uid
+        study = studies.setdefault(study_uid, {
+            "studyInstanceUID": study_uid,
+            "patientId": record.get("patientId"),
+            "patientName": record.get("patientName"),
+            "studyDate": record.get("studyDate"),
+            "description": record.get("studyDescription"),
+            "series": [],
+        })
+        if series_uid not in series:
+            study["series"].append(series_uid)
+            series[series_uid] = {
+                "seriesInstanceUID": series_uid,
+                "studyInstanceUID": study_uid,
+                "modality": header.get("modality"),
+                "description": header.get("seriesDescription"),
+                "seriesNumber": record.get("seriesNumber"),
+                "frameOfReferenceUID": header.get("frameOfReferenceUID"),
+            }
+
+    frames: Dict[str, List[str]] = defaultdict(list)
+    for series_uid, entry in series.items():
+        ordered = sorted(members[series_uid], key=lambda r: _slice_key(r["header"]))
+        first = ordered[0]["header"]
+        entry.update({
+            "instances": len(ordered),
+            "rows": first.get("rows"),
+            "columns": first.get("columns"),
+            "pixelSpacing": first.get("pixelSpacing"),
+            "imageOrientationPatient": first.get("iop"),
+            "files": [r["header"]["path"] for r in ordered],
+        })
+        if entry["frameOfReferenceUID"]:
+            frames[entry["frameOfReferenceUID"]].append(series_uid)
+
+    def image_series(frame: Optional[str]) -> List[str]:
+        return [uid for uid in frames.get(frame or "", []) if (series[uid]["modality"] or "") not in NON_IMAGE_MODALITIES]
+
+    dependencies: List[Dict[str, Any]] = []
+    for record in records:
+        fields = record.get("dependency")
+        if fields is None:
+            continue
+        header = record["header"]
+        modality = header.get("modality")
+        entry = {
+            "type": modality,
+            "path": header["path"],
+            "sopInstanceUID": header.get("sopInstanceUID"),
+            "seriesInstanceUID": header.get("seriesInstanceUID"),
+            "studyInstanceUID": record.get("studyInstanceUID"),
+            "frameOfReferenceUID": header.get("frameOfReferenceUID"),
+            **fields,
+        }
+        if modality == "REG":
+            entry["fixedSeries"] = image_series(fields["fixedFrameOfReferenceUID"])
+            entry["movingSeries"] = sorted({uid for frame in fields["movingFrameOfReferenceUIDs"] for uid in image_series(frame)})
+        elif modality == "RTSTRUCT":
+            known = [uid for uid in fields["referencedSeries"] if uid in series]
+            entry["imageSeries"] = known or sorted({uid for frame in fields["referencedFrameOfReferenceUIDs"] for uid in image_series(frame)})
+        else:  # RTDOSE
+            entry["imageSeries"] = image_series(header.get("frameOfReferenceUID"))
+            entry["structureSetSeries"] = sorted({sop_to_series[uid] for uid in fields["referencedStructureSets"] if uid in sop_to_series})
+        dependencies.append(entry)
+
+    return {
+        "duplicates": duplicates,
+        "studies": studies,
+        "series": series,
+        "frameOfReference": dict(frames),
+        "dependencies": dependencies,
+        "pairs": registration_pairs(series, dependencies),
+    }
+
+
+def registration_pairs(series: Dict[str, Dict[str, Any]], dependencies: Sequence[Dict[str, Any]]) -> List[Dict[str, Any]]:
+    """Fixed/moving image series for every REG, with the RTSTRUCTs drawn on either side."""
+    structures: Dict[str, List[str]] = defaultdict(list)
+    for dep in dependencies:
+        if dep["type"] == "RTSTRUCT":
+            for uid in dep["imageSeries"]:
+                structures[uid].append(dep["path"])
+    pairs = []
+    for dep in dependencies:
+        if dep["type"] != "REG":
+            continue
+        for fixed in dep["fixedSeries"]:
+            for moving in dep["movingSeries"]:
+                pairs.append({
+                    "study": dep["studyInstanceUID"],
+                    "primary": fixed,
+                    "secondary": moving,
+                    "reg": dep["path"],
+                    "rtstruct": sorted(set(structures[fixed] + structures[moving])),
+                    "primaryFiles": series[fixed]["files"],
+                    "secondaryFiles": series[moving]["files"],
+                })
+    return pairs
+
+
+def index_sources(
+    inputs: Sequence[str],
+    workers: int = DEFAULT_WORKERS,
+    processes: int = DEFAULT_PROCESSES,
+    seed_header_index: bool = True,
+) -> Dict[str, Any]:
+    started = time.perf_counter()
+    paths = collect_sources(inputs)
+    records, errors = read_records(paths, workers, processes)
+    grouped = build_index(records)
+    duplicates = grouped["duplicates"]
+    index = {
+        "version": INDEX_VERSION,
+        "createdAt": time.strftime("%Y-%m-%dT%H:%M:%SZ", time.gmtime()),
+        "sources": [str(Path(p).resolve()) for p in inputs],
+        "files": len(paths),
+        "instances": len(records) - len(duplicates),
+        "errors": errors,
+        **grouped,
+    }
+    if seed_header_index:
+        on_disk = [r["header"] for r in records if split_path(r["header"]["path"])[0] is None]
+        if on_disk:
+            default_index().add(on_disk)
+    index["seconds"] = round(time.perf_counter() - started, 3)
+    print(
+        f"🐟 FUSION: Indexed {index['instances']} instance(s) in {len(index['series'])} series from {len(paths)} file(s) "
+        f"in {index['seconds']:.2f}s ({len(errors)} skipped, {len(duplicates)} duplicate(s))",
+        file=sys.stderr,
+    )
+    return index
+
+
+def load_index(path: str) -> Dict[str, Any]:
+    with open(path, "r", encoding="utf-8") as f:
+        index = json.load(f)
+    if index.get("version") != INDEX_VERSION:
+        raise ValueError(f"unsupported study index version {index.get('version')!r}")
+    return index
+
+
+def series_files(index: Dict[str, Any], series_uid: str) -> List[str]:
+    """Files of a series in slice order (zip members keep their '<archive>::<member>' form)."""
+    return list(index["series"][series_uid]["files"])
+
+
+def materialize(index: Dict[str, Any], series_uid: str, destination: str) -> List[str]:
+    """On-disk paths for a series, extracting only its zip members into destination."""
+    out: List[str] = []
+    dest = Path(destination)
+    handles: Dict[str, zipfile.ZipFile] = {}
+    try:
+        for path in series_files(index, series_uid):
+            archive, member = split_path(path)
+            if archive is None:
+                out.append(path)
+                continue
+            zf = handles.get(archive) or handles.setdefault(archive, zipfile.ZipFile(archive))
+            target = dest / series_uid / Path(member).name
+            if not target.exists():
+                target.parent.mkdir(parents=True, exist_ok=True)
+                with zf.open(member) as src, open(target, "wb") as dst:
+                    dst.write(src.read())
+            out.append(str(target))
+    finally:
+        for zf in handles.values():
+            zf.close()
+    return out
+
+
+def main(argv: Optional[List[str]] = None) -> int:
+    parser = argparse.ArgumentParser(description="Header-only DICOM study indexer (directories and zip archives)")
+    parser.add_argument("inputs", nargs="+", help="Directories, zip archives or files")
+    parser.add_argument("--output", help="Index JSON path (default: stdout)")
+    parser.add_argument("--pairs", help="Also write the REG pairs list (fusion_dsc_test --batch input)")
+    parser.add_argument("--workers", type=int, default=DEFAULT_WORKERS, help="Reader threads")
+    parser.add_argument("--processes", type=int, default=DEFAULT_PROCESSES, help="Reader processes for large inputs")
+    parser.add_argument("--no-header-index", action="store_true", help="Do not seed the shared dicom_header_index")
+    args = parser.parse_args(argv)
+
+    index = index_sources(args.inputs, workers=args.workers, processes=args.processes, seed_header_index=not args.no_header_index)
+    if args.pairs:
+        with open(args.pairs, "w", encoding="utf-8") as f:
+            json.dump(index["pairs"], f, indent=2)
+    if args.output:
+        Path(args.output).parent.mkdir(parents=True, exist_ok=True)
+        with open(args.output, "w", encoding="utf-8") as f:
+            json.dump(index, f)
+        print(json.dumps({"ok": True, "index": args.output, "series": len(index["series"]), "seconds": index["seconds"]}))
+    else:
+        print(json.dumps(index))
+    return 0
+
+
+if __name__ == "__main__":
+    sys.exit(main(sys.argv[1:]))
@@ -0,0 +1,60 @@
+#!/usr/bin/env python3
+"""Plumbing shared by the fusebox on-disk caches (volume results, transforms, fields).
+
+  - file_digest: blake2b of a file's bytes, memoized per (path, mtime, size)
+  - evict_lru: drop the least-recently-used entries (mtime is the LRU clock)
+    until a cache directory fits its byte budget
+"""
+from __future__ import annotations
+
+import hashlib
+import os
+import threading
+from pathlib import Path
+from typing import Callable, Dict, Iterable, List, Optional, Tuple
+
+_digests: Dict[Tuple[str, int, int], str] = {}
+_digests_lock = threading.Lock()
+
+
+def file_digest(path: str) -> str:
+    """blake2b of a file's bytes, memoized per (path, mtime, size)."""
+    st = os.stat(path)
+    stamp = (os.path.abspath(path), st.st_mtime_ns, st.st_size)
+    with _digests_lock:
+        cached = _digests.get(stamp)
+    if cached is not None:
+        return cached
+    digest = hashlib.blake2b(digest_size=16)
+    with open(path, "rb") as f:
+        for block in iter(lambda: f.read(1 << 20), b""):
+            digest.update(block)
+    value = digest.hexdigest()
+    with _digests_lock:
+        _digests[stamp] = value
+    return value
+
+
+def evict_lru(
+    entries: Iterable[Tuple[float, Path, int]],
+    budget_bytes: int,
+    remove: Callable[[Path], None],
+    keep: Optional[Path] = None,
+) -> Tuple[List[Path], int]:
+    """Remove (mtime, path, bytes) entries oldest first until the total fits budget_bytes.
+
+    keep (the entry just written) is never removed. Returns the removed paths
+    and the bytes that remain.
+    """
+    entries = list(entries)
+    total = sum(size for _, _, size in entries)
+    evicted: List[Path] = []
+    for _, path, size in sorted(entries, key=lambda e: e[0]):
+        if total <= budget_bytes:
+            break
+        if keep is not None and path == keep:
+            continue
+        remove(path)
+        total -= size
+        evicted.append(path)
+    return evicted, total
@@ -0,0 +1,132 @@
+#!/usr/bin/env python3
+"""RTDOSE grids as SimpleITK volumes for the fusebox resampler.
+
+ImageSeriesReader only handles one image per slice file; an RTDOSE is a single
+multi-frame instance whose frames sit at GridFrameOffsetVector along the slice
+normal and whose stored integers become dose through DoseGridScaling. This
+module reads it into a float32 sitk.Image in dose units:
+
+  - frame k lies at ImagePositionPatient + normal * (offset[k] - offset[0]),
+    which covers both relative (offset[0] == 0) and absolute offset vectors
+  - decreasing offsets are flipped so the image spacing stays positive
+  - non-uniform offsets (some TPS exports) are linearly re-gridded along the
+    normal at the smallest frame step, since ITK images need one spacing
+  - several RTDOSE files on the same grid (e.g. one per beam) are summed
+
+    from fusebox_dose import is_rtdose, read_rtdose
+
+    if is_rtdose(files):
+        dose, info = read_rtdose(files)   # info: units, type, scaling, frames, ...
+"""
+from __future__ import annotations
+
+import sys
+from typing import Any, Dict, Sequence, Tuple
+
+import numpy as np
+import pydicom
+import SimpleITK as sitk
+
+RTDOSE_SOP_CLASS = "1.2.840.10008.5.1.4.1.1.481.2"
+# Frame offsets closer than this (mm) count as one uniform step
+OFFSET_TOLERANCE = 1e-3
+
+
+def is_rtdose(files: Sequence[str]) -> bool:
+    """True when the first file is an RTDOSE instance (header-only read)."""
+    if not files:
+        return False
+    try:
+        ds = pydicom.dcmread(files[0], stop_before_pixels=True, specific_tags=["Modality", "SOPClassUID"], force=True)
+    except Exception:
+        return False
+    return str(getattr(ds, "Modality", "")).upper() == "RTDOSE" or str(getattr(ds, "SOPClassUID", "")) == RTDOSE_SOP_CLASS
+
+
+def frame_offsets(ds: pydicom.Dataset, frames: int) -> np.ndarray:
+    """Frame positions (mm) along the normal relative to ImagePositionPatient."""
+    offsets = getattr(ds, "GridFrameOffsetVector", None)
+    if offsets is None or len(offsets) == 0:
+        if frames > 1:
+            raise ValueError("multi-frame RTDOSE without GridFrameOffsetVector")
+        return np.zeros(1)
+    offsets = np.asarray([float(v) for v in offsets])
+    if len(offsets) != frames:
+        raise ValueError(f"GridFrameOffsetVector has {len(offsets)} entries for {frames} frames")
+    return offsets - offsets[0]
+
+
+def regrid_frames(frames: np.ndarray, offsets: np.ndarray) -> Tuple[np.ndarray, float]:
+    """Linearly resample (z, y, x) frames at increasing offsets onto a uniform step."""
+    steps = np.diff(offsets)
+    if not len(steps):
+        return frames, 1.0
+    step = float(steps.min())
+    if step <= 0:
+        raise ValueError("RTDOSE frame offsets repeat")
+    if float(steps.max()) - step <= OFFSET_TOLERANCE:
+        return frames, float(steps.mean())
+    count = int(round((offsets[-1] - offsets[0]) / step)) + 1
+    targets = offsets[0] + step * np.arange(count)
+    upper = np.clip(np.searchsorted(offsets, targets, side="right"), 1, len(offsets) - 1)
+    lower = upper - 1
+    weight = np.clip((targets - offsets[lower]) / (offsets[upper] - offsets[lower]), 0.0, 1.0).astype(np.float32)
+    regridded = frames[lower] * (1.0 - weight)[:, None, None] + frames[upper] * weight[:, None, None]
+    print(f"🐟 FUSION: RTDOSE frame offsets are non-uniform; re-gridded {len(offsets)} frames to {count} at {step:.3f} mm", file=sys.stderr)
+    return regridded.astype(np.float32), step
+
+
+def _read_one(path: str) -> Tuple[np.ndarray, np.ndarray, np.ndarray, Tuple[float, float], pydicom.Dataset]:
+    ds = pydicom.dcmread(path, force=True)
+    if getattr(ds, "DoseGridScaling", None) is None:
+        raise ValueError(f"RTDOSE without DoseGridScaling: {path}")
+    frames = int(getattr(ds, "NumberOfFrames", 1) or 1)
+    pixels = ds.pixel_array.reshape(frames, int(ds.Rows), int(ds.Columns))
+    dose = pixels.astype(np.float32) * np.float32(float(ds.DoseGridScaling))
+    offsets = frame_offsets(ds, frames)
+    iop = np.asarray([float(v) for v in ds.ImageOrientationPatient])
+    ipp = np.asarray([float(v) for v in ds.ImagePositionPatient])
+    row_spacing, col_spacing = (float(v) for v in ds.PixelSpacing)
+    return dose, offsets, np.concatenate([ipp, iop]), (row_spacing, col_spacing), ds
+
+
+def read_rtdose(files: Sequence[str]) -> Tuple[sitk.Image, Dict[str, Any]]:
+    """float32 dose volume plus the RTDOSE attributes the manifest reports."""
+    if not files:
+        raise ValueError("no RTDOSE files")
+    dose, offsets, geometry, pixel_spacing, ds = _read_one(files[0])
+    for path in files[1:]:
+        other, other_offsets, other_geometry, other_spacing, _ = _read_one(path)
+        if (
+            other.shape != dose.shape
+            or not np.allclose(other_offsets, offsets, atol=OFFSET_TOLERANCE)
+            or not np.allclose(other_geometry, geometry, atol=OFFSET_TOLERANCE)
+            or not np.allclose(other_spacing, pixel_spacing, atol=OFFSET_TOLERANCE)
+        ):
+            raise ValueError(f"RTDOSE grids differ and cannot be summed: {files[0]} vs {path}")
+        dose += other
+
+    ipp, row_dir, col_dir = geometry[:3], geometry[3:6], geometry[6:9]
+    normal = np.cross(row_dir, col_dir)
+    if len(offsets) > 1 and offsets[-1] < offsets[0]:
+        dose, offsets = dose[::-1], offsets[::-1]
+    dose, step = regrid_frames(dose, offsets)
+
+    image = sitk.GetImageFromArray(np.ascontiguousarray(dose, dtype=np.float32))
+    image.SetOrigin([float(v) for v in ipp + normal * float(offsets[0])])
+    image.SetSpacing([pixel_spacing[1], pixel_spacing[0], step])
+    image.SetDirection([float(v) for v in np.column_stack([row_dir, col_dir, normal]).ravel()])
+
+    info: Dict[str, Any] = {
+        "doseUnits": str(getattr(ds, "DoseUnits", "") or "") or None,
+        "doseType": str(getattr(ds, "DoseType", "") or "") or None,
+        "doseSummationType": str(getattr(ds, "DoseSummationType", "") or "") or None,
+        "doseGridScaling": float(ds.DoseGridScaling),
+        "frameOfReferenceUID": str(getattr(ds, "FrameOfReferenceUID", "") or "") or None,
+        "sourceFrames": int(len(offsets)),
+        "gridSize": list(image.GetSize()),
+        "gridSpacing": list(image.GetSpacing()),
+        "summedFiles": len(files),
+    }
+    return image, info
+
@@ -0,0 +1,112 @@
+#!/usr/bin/env python3
+"""Wire encodings for fusebox slice payloads.
+
+encode_slice/encode_stack always produced base64 float32 inside JSON. The
+config can now choose a more compact form:
+
+  encoding:    'float32' (default, lossless) | 'float16' | 'uint16'
+               uint16 maps each slice's [min, max] window linearly onto
+               0..65535; decode with value = q * slope + intercept.
+  compression: null (default) | 'deflate' | 'zstd' (needs the optional
+               zstandard package; falls back to deflate without it)
+  binary:      false (default) | true — payloads are not base64'd; each one
+               records offset/length into a single blob that is written
+               after the JSON header (see fusebox_resample.write_response).
+
+Every payload reports its encoding, compression and maxError, the largest
+absolute round-trip error of the decoded pixels (0.0 for float32). All
+multi-byte values are little-endian.
+"""
+from __future__ import annotations
+
+import base64
+import sys
+import zlib
+from typing import Any, Dict, List, Optional, Tuple
+
+import numpy as np
+
+try:
+    import zstandard
+except ImportError:  # optional; deflate is used instead
+    zstandard = None
+
+ENCODINGS = ("float32", "float16", "uint16")
+COMPRESSIONS = ("deflate", "zstd")
+UINT16_LEVELS = 65535
+FLOAT16_MAX = float(np.finfo(np.float16).max)
+
+
+class PayloadEncoder:
+    """Encodes clean float32 frames per the configured encoding/compression."""
+
+    def __init__(self, encoding: str = "float32", compression: Optional[str] = None, binary: bool = False, level: Optional[int] = None):
+        encoding = (encoding or "float32").lower()
+        if encoding not in ENCODINGS:
+            raise ValueError(f"unsupported encoding {encoding!r}; expected one of {', '.join(ENCODINGS)}")
+        if compression:
+            compression = compression.lower()
+            if compression not in COMPRESSIONS:
+                raise ValueError(f"unsupported compression {compression!r}; expected one of {', '.join(COMPRESSIONS)}")
+            if compression == "zstd" and zstandard is None:
+                print("🐟 FUSION: zstandard not installed, using deflate compression", file=sys.stderr)
+                compression = "deflate"
+        self.encoding = encoding
+        self.compression = compression or None
+        self.binary = bool(binary)
+        self.level = level
+        self._chunks: List[bytes] = []
+        self._offset = 0
+
+    @classmethod
+    def from_config(cls, cfg: dict) -> "PayloadEncoder":
+        level = cfg.get("compressionLevel")
+        return cls(
+            encoding=cfg.get("encoding", "float32"),
+            compression=cfg.get("compression"),
+            binary=bool(cfg.get("binary")),
+            level=int(level) if level is not None else None,
+        )
+
+    def quantize(self, frame: np.ndarray, min_val: float, max_val: float) -> Tuple[np.ndarray, Dict[str, Any]]:
+        """Encode one clean float32 frame; returns (encoded array, per-frame metadata)."""
+        if self.encoding == "float32":
+            return frame.astype("<f4", copy=False), {"maxError": 0.0}
+
+        if self.encoding == "float16":
+            if max(abs(min_val), abs(max_val)) > FLOAT16_MAX:
+                raise ValueError(f"float16 cannot represent values beyond ±{FLOAT16_MAX:g}; use uint16")
+            encoded = frame.astype("<f2")
+            error = float(np.abs(encoded.astype(np.float32) - frame).max()) if frame.size else 0.0
+            return encoded, {"maxError": error}
+
+        # uint16: the window is already widened to span >= 1.0 by finite_window
+        slope = (max_val - min_val) / UINT16_LEVELS
+        intercept = min_val
+        quantized = np.rint((frame.astype(np.float64) - intercept) / slope)
+        encoded = np.clip(quantized, 0, UINT16_LEVELS).astype("<u2")
+        decoded = encoded.astype(np.float64) * slope + intercept
+        error = float(np.abs(decoded - frame).max()) if frame.size else 0.0
+        return encoded, {"slope": slope, "intercept": intercept, "maxError": error}
+
+    def pack(self, raw: bytes) -> Dict[str, Any]:
+        """Compress and place one payload (base64 inline, or a slice of the binary blob)."""
+        fields: Dict[str, Any] = {"encoding": self.encoding}
+        if self.compression == "deflate":
+            raw = zlib.compress(raw, self.level if self.level is not None else 1)
+        elif self.compression == "zstd":
+            raw = zstandard.ZstdCompressor(level=self.level if self.level is not None else 3).compress(raw)
+        if self.compression:
+            fields["compression"] = self.compression
+        if self.binary:
+            fields["offset"] = self._offset
+            fields["length"] = len(raw)
+            self._chunks.append(raw)
+            self._offset += len(raw)
+        else:
+            fields["data"] = base64.b64encode(raw).decode("ascii")
+        return fields
+
+    def blob(self) -> bytes:
+        """All binary-mode payloads, in the order they were packed."""
+        return b"".join(self._chunks)
@@ -0,0 +1,235 @@
+#!/usr/bin/env python3
+"""Fusebox auto-registration: rigid/affine alignment when a study has no REG.
+
+Fusebox could only apply transforms from a DICOM REG or a supplied matrix.
+This script registers the secondary onto the primary with SimpleITK's
+ImageRegistrationMethod and writes the transform in the format the
+resamplers already consume (fixed→moving, like dicom_reg_to_h5 output), so the
+result is passed on as transformFile.
+
+Reads a JSON config via --config with keys:
+  primary: list[str]            fixed series (CT)
+  secondary: list[str]          moving series (CT / MR / PET)
+  outputFile: str               transform file to write (.h5 or .tfm)
+  transformType: 'rigid' | 'affine' (default 'rigid'; affine starts from a rigid fit)
+  shrinkFactors: list[int]      pyramid, coarse to fine (default [8, 4, 2, 1])
+  smoothingSigmas: list[float]  per level, in mm (default [3, 2, 1, 0])
+  samplingPercentage: float     random metric sample per level (default 0.05)
+  histogramBins: int            Mattes mutual information bins (default 50)
+  iterations: int               optimizer iterations per level (default 200)
+  learningRate: float           initial step, in mm of physical shift (default 2.0)
+  minimumStep: float            regular-step optimizer stops below this (default 0.001)
+  initialization: 'geometry' | 'moments' (default 'geometry')
+  threads: int                  metric threads (default $FUSEBOX_REGISTER_THREADS or CPUs)
+  seed: int                     sampling seed, for reproducible runs (default 42)
+
+Outputs JSON with the transform file, its row-major 4x4 matrix (fixed→moving),
+the final metric value, the optimizer stop condition and per-level timings.
+"""
+from __future__ import annotations
+
+import argparse
+import json
+import os
+import sys
+import time
+from pathlib import Path
+from typing import Any, Dict, List, Optional, Sequence
+
+import numpy as np
+import SimpleITK as sitk
+
+SCRIPT_DIR = Path(__file__).resolve().parent
+if str(SCRIPT_DIR) not in sys.path:
+    sys.path.insert(0, str(SCRIPT_DIR))
+
+from fusebox_resample import read_series, sort_series_by_position  # noqa: E402
+
+DEFAULT_SHRINK_FACTORS = [8, 4, 2, 1]
+DEFAULT_SMOOTHING_SIGMAS = [3.0, 2.0, 1.0, 0.0]
+DEFAULT_THREADS = int(os.environ.get("FUSEBOX_REGISTER_THREADS", str(os.cpu_count() or 1)))
+
+
+def load_volume(files: Sequence[str]) -> sitk.Image:
+    ordered = sort_series_by_position([str(Path(p)) for p in files])
+    if not ordered:
+        raise ValueError("series file list is empty")
+    return sitk.Cast(read_series(ordered), sitk.sitkFloat32)
+
+
+def initial_transform(fixed: sitk.Image, moving: sitk.Image, transform_type: str, initialization: str) -> sitk.Transform:
+    mode = (
+        sitk.CenteredTransformInitializerFilter.MOMENTS
+        if initialization == "moments"
+        else sitk.CenteredTransformInitializerFilter.GEOMETRY
+    )
+    base = sitk.Euler3DTransform() if transform_type == "rigid" else sitk.AffineTransform(3)
+    return sitk.CenteredTransformInitializer(fixed, moving, base, mode)
+
+
+def affine_from_transform(transform: sitk.Transform) -> sitk.AffineTransform:
+    """Collapse a (possibly wrapped) rigid/affine result into one AffineTransform."""
+    if isinstance(transform, sitk.CompositeTransform):
+        transform.FlattenTransform()
+        if transform.GetNumberOfTransforms() == 1:
+            transform = transform.GetNthTransform(0)
+    affine = sitk.AffineTransform(3)
+    if hasattr(transform, "GetMatrix"):
+        affine.SetCenter(transform.GetCenter())
+        affine.SetMatrix(transform.GetMatrix())
+        affine.SetTranslation(transform.GetTranslation())
+        return affine
+    # Generic chain of linear transforms: recover the affine from point images
+    origin = np.array(transform.TransformPoint((0.0, 0.0, 0.0)))
+    columns = [np.array(transform.TransformPoint(tuple(axis))) - origin for axis in np.eye(3)]
+    affine.SetMatrix([float(v) for v in np.column_stack(columns).ravel()])
+    affine.SetTranslation([float(v) for v in origin])
+    return affine
+
+
+def row_major_matrix(affine: sitk.AffineTransform) -> List[float]:
+    origin = np.array(affine.TransformPoint((0.0, 0.0, 0.0)))
+    matrix = np.eye(4)
+    matrix[:3, :3] = np.array(affine.GetMatrix()).reshape(3, 3)
+    matrix[:3, 3] = origin
+    return [float(v) for v in matrix.ravel()]
+
+
+def register_level_set(
+    fixed: sitk.Image,
+    moving: sitk.Image,
+    initial: sitk.Transform,
+    cfg: Dict[str, Any],
+    stage: str,
+) -> Dict[str, Any]:
+    """One pyramid run; returns the optimized transform plus per-level timings."""
+    shrink_factors = [int(v) for v in cfg.get("shrinkFactors", DEFAULT_SHRINK_FACTORS)]
+    smoothing_sigmas = [float(v) for v in cfg.get("smoothingSigmas", DEFAULT_SMOOTHING_SIGMAS[-len(shrink_factors):])]
+    if len(smoothing_sigmas) != len(shrink_factors):
+        raise ValueError("smoothingSigmas must have one entry per shrinkFactors level")
+
+    registration = sitk.ImageRegistrationMethod()
+    registration.SetMetricAsMattesMutualInformation(numberOfHistogramBins=int(cfg.get("histogramBins", 50)))
+    registration.SetMetricSamplingStrategy(registration.RANDOM)
+    registration.SetMetricSamplingPercentage(float(cfg.get("samplingPercentage", 0.05)), int(cfg.get("seed", 42)))
+    registration.SetInterpolator(sitk.sitkLinear)
+    registration.SetOptimizerAsRegularStepGradientDescent(
+        learningRate=float(cfg.get("learningRate", 2.0)),
+        minStep=float(cfg.get("minimumStep", 1e-3)),
+        numberOfIterations=int(cfg.get("iterations", 200)),
+        relaxationFactor=0.5,
+    )
+    registration.SetOptimizerScalesFromPhysicalShift()
+    registration.SetShrinkFactorsPerLevel(shrink_factors)
+    registration.SetSmoothingSigmasPerLevel(smoothing_sigmas)
+    registration.SmoothingSigmasAreSpecifiedInPhysicalUnitsOn()
+    registration.SetInitialTransform(initial, inPlace=False)
+    registration.SetNumberOfThreads(int(cfg.get("threads") or DEFAULT_THREADS))
+
+    levels: List[Dict[str, Any]] = []
+    clock = {"start": time.perf_counter()}
+
+    def close_level() -> None:
+        if levels and levels[-1]["seconds"] is None:
+            levels[-1]["seconds"] = round(time.perf_counter() - clock["start"], 3)
+
+    def on_level() -> None:
+        close_level()
+        index = len(levels)
+        clock["start"] = time.perf_counter()
+        levels.append({
+            "stage": stage,
+            "level": index,
+            "shrinkFactor": shrink_factors[index] if index < len(shrink_factors) else None,
+            "smoothingSigma": smoothing_sigmas[index] if index < len(smoothing_sigmas) else None,
+            "iterations": 0,
+            "metric": None,
+            "seconds": None,
+        })
+
+    def on_iteration() -> None:
+        if levels:
+            levels[-1]["iterations"] += 1
+            levels[-1]["metric"] = float(registration.GetMetricValue())
+
+    registration.AddCommand(sitk.sitkMultiResolutionIterationEvent, on_level)
+    registration.AddCommand(sitk.sitkIterationEvent, on_iteration)
+
+    transform = registration.Execute(fixed, moving)
+    close_level()
+    return {
+        "transform": transform,
+        "metric": float(registration.GetMetricValue()),
+        "stopCondition": registration.GetOptimizerStopConditionDescription(),
+        "levels": levels,
+    }
+
+
+def run_from_config(cfg: Dict[str, Any]) -> Dict[str, Any]:
+    transform_type = str(cfg.get("transformType", "rigid")).lower()
+    if transform_type not in ("rigid", "affine"):
+        raise ValueError(f"unsupported transformType {transform_type!r}; expected 'rigid' or 'affine'")
+    output_file = cfg.get("outputFile")
+    if not output_file:
+        raise ValueError("outputFile is required")
+
+    started = time.perf_counter()
+    fixed = load_volume(cfg.get("primary", []))
+    moving = load_volume(cfg.get("secondary", []))
+    load_seconds = time.perf_counter() - started
+    print(f"🐟 FUSION: Registering {moving.GetSize()} onto {fixed.GetSize()} ({transform_type})", file=sys.stderr)
+
+    initialization = str(cfg.get("initialization", "geometry")).lower()
+    rigid = register_level_set(fixed, moving, initial_transform(fixed, moving, "rigid", initialization), cfg, "rigid")
+    result = rigid
+    levels = list(rigid["levels"])
+    if transform_type == "affine":
+        # Start the affine fit from the rigid solution; a cold affine start drifts easily under MI
+        start = affine_from_transform(rigid["transform"])
+        result = register_level_set(fixed, moving, start, cfg, "affine")
+        levels.extend(result["levels"])
+
+    affine = affine_from_transform(result["transform"])
+    Path(output_file).parent.mkdir(parents=True, exist_ok=True)
+    sitk.WriteTransform(affine, str(output_file))
+    total_seconds = time.perf_counter() - started
+    print(
+        f"🐟 FUSION: Registration finished in {total_seconds:.2f}s, metric {result['metric']:.5f} ({result['stopCondition']})",
+        file=sys.stderr,
+    )
+    return {
+        "ok": True,
+        "transformFile": str(output_file),
+        "transformType": transform_type,
+        "matrix": row_major_matrix(affine),
+        "finalMetric": result["metric"],
+        "stopCondition": result["stopCondition"],
+        "levels": levels,
+        "loadSeconds": round(load_seconds, 3),
+        "totalSeconds": round(total_seconds, 3),
+    }
+
+
+def main(argv: Optional[List[str]] = None) -> int:
+    parser = argparse.ArgumentParser(description="Fusebox rigid/affine auto-registration")
+    parser.add_argument("--config", required=True)
+    args = parser.parse_args(argv)
+
+    config_path = Path(args.config)
+    if not config_path.exists():
+        print(json.dumps({"error": f"config not found: {config_path}"}))
+        return 1
+
+    cfg = json.loads(config_path.read_text())
+    try:
+        payload = run_from_config(cfg)
+    except Exception as exc:
+        print(json.dumps({"error": str(exc)}))
+        return 2
+
+    print(json.dumps(payload))
+    return 0
+
+
+if __name__ == "__main__":
+    sys.exit(main(sys.argv[1:]))
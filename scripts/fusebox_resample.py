@@ -5,20 +5,49 @@ Reads a JSON config via --config with keys:
   primary: list[str]  (CT reference series files)
   secondary: list[str]
   transform: list[16] row-major affine (moving->fixed)
+  registrationFile: optional DICOM REG converted in-process (see
+      dicom_reg_transform); frames default to the series' FrameOfReferenceUIDs,
+      override with fixedFrameOfReferenceUID / movingFrameOfReferenceUID.
+      Falls back to transform/transformFile when conversion fails.
   sliceIndex: int (0-based index into primary array)
+  sliceIndices: optional list[int] | {"start", "stop", "step"} | "all"
   interpolation: 'linear' | 'nearest'
 
 Outputs JSON with width/height/min/max/base64 data for Float32 slice.
+
+With sliceIndices the response carries every requested slice as one stack
+(see encode_stack): a single float32 buffer plus per-slice min/max, so a
+viewer can prefetch a scroll window in one call. With includePrimary, slices
+listed in primaryCached are left out of the primary stack.
+
+Payloads default to base64 float32; the encoding, compression and binary keys
+select float16 / quantized uint16, deflate / zstd and raw binary frames
+(see fusebox_payload).
+
+Only the requested plane is resampled: the primary grid is built from DICOM
+headers, the output is a one-slice reference geometry at sliceIndex, and
+pixels are decoded for that single primary instance (includePrimary) and, for
+linear transforms, just the secondary slab the plane passes through.
+
+Resolved transforms (after flattening, inversion and the orientation probe)
+are cached on disk together with the decision that produced them (see
+fusebox_transform_cache).
+
+With --daemon the script stays alive and answers JSON-lines requests on
+stdin/stdout (see serve_daemon), keeping sorted series, decoded secondaries
+and resolved transforms cached between slices.
 """
 from __future__ import annotations
 
 import argparse
-import base64
 import json
 import math
+import os
 import sys
+import time
+from collections import OrderedDict
 from pathlib import Path
-from typing import List, Sequence, Tuple
+from typing import Any, Callable, Dict, List, Optional, Sequence, Tuple
 
 import numpy as np
 import SimpleITK as sitk
@@ -28,47 +57,17 @@ if str(SCRIPT_DIR) not in sys.path:
     sys.path.insert(0, str(SCRIPT_DIR))
 
 from transform_utils import pick_moving_to_fixed  # noqa: E402
-
-
-def parse_position_and_normal(reader: sitk.ImageFileReader) -> Tuple[np.ndarray, np.ndarray]:
-    """Extract ImagePositionPatient and slice normal from DICOM metadata."""
-    def meta_vec(tag: str) -> np.ndarray:
-        if not reader.HasMetaDataKey(tag):
-            raise RuntimeError(f"Missing required DICOM tag {tag}")
-        raw = reader.GetMetaData(tag).strip().replace(',', '\\')
-        return np.array([float(x.strip()) for x in raw.split('\\') if x.strip()], dtype=np.float64)
-
-    ipp = meta_vec("0020|0032")
-    iop = meta_vec("0020|0037")
-    # Direction cosines: first three = row, next three = column
-    normal = np.cross(iop[:3], iop[3:])
-    norm = np.linalg.norm(normal)
-    if norm == 0:
-        raise RuntimeError("Slice normal has zero length")
-    return ipp, normal / norm
+from dicom_header_index import default_index  # noqa: E402
+from fusebox_payload import PayloadEncoder  # noqa: E402
+from dicom_reg_transform import registration_transform_from_config  # noqa: E402
+from fusebox_transform_cache import default_cache as default_transform_cache  # noqa: E402
 
 
 def sort_series_by_position(files: Sequence[str]) -> List[str]:
     """Ensure slices are ordered along the physical slice normal."""
     if len(files) <= 1:
         return list(files)
-
-    ordering: List[Tuple[float, str]] = []
-    for path in files:
-        reader = sitk.ImageFileReader()
-        reader.SetFileName(path)
-        reader.LoadPrivateTagsOn()
-        reader.ReadImageInformation()
-        try:
-            ipp, normal = parse_position_and_normal(reader)
-            distance = float(np.dot(ipp, normal))
-        except Exception as exc:  # pragma: no cover - diagnostic path
-            print(f"🐟 FUSION: Unable to compute slice ordering for {path}: {exc}", file=sys.stderr)
-            distance = 0.0
-        ordering.append((distance, path))
-
-    ordering.sort(key=lambda item: item[0])
-    return [path for _, path in ordering]
+    return default_index().sorted_paths(files)
 
 
 def describe_series(label: str, files: Sequence[str]) -> None:
@@ -77,59 +76,39 @@ def describe_series(label: str, files: Sequence[str]) -> None:
         print(f"🐟 FUSION: {label} series list empty", file=sys.stderr)
         return
 
-    first = files[0]
-    reader = sitk.ImageFileReader()
-    reader.SetFileName(first)
-    reader.LoadPrivateTagsOn()
     try:
-        reader.ReadImageInformation()
+        first = default_index().header(files[0])
     except Exception as exc:  # pragma: no cover - debug aid only
-        print(f"🐟 FUSION: Unable to inspect {label} metadata for {first}: {exc}", file=sys.stderr)
+        print(f"🐟 FUSION: Unable to inspect {label} metadata for {files[0]}: {exc}", file=sys.stderr)
         return
 
-    def meta(key: str) -> str:
-        return reader.GetMetaData(key) if reader.HasMetaDataKey(key) else "unknown"
-
-    modality = meta("0008|0060")
-    description = meta("0008|103e")
-    frame_of_reference = meta("0020|0052")
-    series_uid = meta("0020|000e")
-
-    try:
-        ipp, normal = parse_position_and_normal(reader)
-        top_proj = float(np.dot(ipp, normal))
-    except Exception:
-        normal = None
-        top_proj = float('nan')
+    normal = first.get("normal")
+    top_proj = first["position"] if first.get("position") is not None else float('nan')
 
     bottom_proj = float('nan')
-    if len(files) > 1:
-        tail_reader = sitk.ImageFileReader()
-        tail_reader.SetFileName(files[-1])
-        tail_reader.LoadPrivateTagsOn()
+    if len(files) > 1 and normal is not None:
         try:
-            tail_reader.ReadImageInformation()
-            tail_ipp, _ = parse_position_and_normal(tail_reader)
-            bottom_proj = float(np.dot(tail_ipp, normal)) if normal is not None else float('nan')
+            tail = default_index().header(files[-1])
+            if tail.get("ipp"):
+                bottom_proj = float(np.dot(tail["ipp"][:3], normal))
         except Exception:
             bottom_proj = float('nan')
 
     print(
         "🐟 FUSION: {label} → modality={modality} description={desc} series={series_uid} FoR={for_uid}".format(
             label=label,
-            modality=modality or "unknown",
-            desc=(description or "").strip() or "(no description)",
-            series_uid=series_uid or "unknown",
-            for_uid=frame_of_reference or "unknown",
+            modality=first.get("modality") or "unknown",
+            desc=(first.get("seriesDescription") or "").strip() or "(no description)",
+            series_uid=first.get("seriesInstanceUID") or "unknown",
+            for_uid=first.get("frameOfReferenceUID") or "unknown",
         ),
         file=sys.stderr,
     )
     if normal is not None:
-        normal_list = [float(v) for v in normal]
         print(
             "🐟 FUSION: {label} slice normal {normal} · range [{top_proj:.3f}, {bottom_proj:.3f}]".format(
                 label=label,
-                normal=normal_list,
+                normal=[float(v) for v in normal],
                 top_proj=top_proj,
                 bottom_proj=bottom_proj,
             ),
@@ -137,6 +116,119 @@ def describe_series(label: str, files: Sequence[str]) -> None:
         )
 
 
+class SeriesGeometry:
+    """Image geometry of a position-sorted DICOM series, read from headers only.
+
+    Mirrors what ImageSeriesReader would produce (origin = first slice IPP,
+    direction columns = row/column cosines and slice normal, z spacing = mean
+    IPP step) without decoding any pixel data. Exposes the subset of the
+    sitk.Image API that transform_utils and the slice resampler need.
+    """
+
+    def __init__(self, size: Sequence[int], spacing: Sequence[float], origin: Sequence[float], direction: Sequence[float]):
+        self.size = tuple(int(v) for v in size)
+        self.spacing = tuple(float(v) for v in spacing)
+        self.origin = np.asarray(origin, dtype=np.float64)
+        self.direction = tuple(float(v) for v in direction)
+        self._matrix = np.asarray(self.direction, dtype=np.float64).reshape(3, 3)
+
+    @classmethod
+    def from_files(cls, files: Sequence[str]) -> "SeriesGeometry":
+        if not files:
+            raise ValueError("cannot build geometry for an empty series")
+        index = default_index()
+        first = index.header(files[0])
+        last = index.header(files[-1]) if len(files) > 1 else first
+        return cls.from_headers(first, last, len(files))
+
+    @classmethod
+    def from_headers(cls, first: dict, last: dict, count: int) -> "SeriesGeometry":
+        """Geometry from the first/last slice headers of a sorted series (see dicom_header_index)."""
+        if first.get("ipp") is None or first.get("normal") is None:
+            raise RuntimeError(f"Missing required DICOM geometry (IPP/IOP) in {first.get('path')}")
+        first_ipp = np.asarray(first["ipp"][:3], dtype=np.float64)
+        normal = np.asarray(first["normal"], dtype=np.float64)
+        iop = first["iop"]
+        row_cos, col_cos = np.asarray(iop[:3]), np.asarray(iop[3:6])
+        pixel_spacing = first.get("pixelSpacing") or [1.0, 1.0]
+
+        if count > 1 and last.get("ipp") is not None:
+            last_ipp = np.asarray(last["ipp"][:3], dtype=np.float64)
+            z_spacing = float(np.dot(last_ipp - first_ipp, normal)) / (count - 1)
+        elif first.get("sliceThickness"):
+            z_spacing = float(first["sliceThickness"])
+        else:
+            z_spacing = 1.0
+        if abs(z_spacing) < 1e-6:
+            z_spacing = 1.0
+
+        direction = np.column_stack([row_cos, col_cos, normal]).flatten()
+        # PixelSpacing is (row spacing, column spacing): x steps along a row use the second value
+        return cls(
+            size=(int(first["columns"]), int(first["rows"]), count),
+            spacing=(pixel_spacing[1], pixel_spacing[0], abs(z_spacing)),
+            origin=first_ipp,
+            direction=direction,
+        )
+
+    def GetSize(self) -> Tuple[int, int, int]:
+        return self.size
+
+    def GetSpacing(self) -> Tuple[float, float, float]:
+        return self.spacing
+
+    def GetOrigin(self) -> Tuple[float, float, float]:
+        return tuple(float(v) for v in self.origin)
+
+    def GetDirection(self) -> Tuple[float, ...]:
+        return self.direction
+
+    def GetDimension(self) -> int:
+        return 3
+
+    def TransformIndexToPhysicalPoint(self, index: Sequence[float]) -> Tuple[float, float, float]:
+        scaled = np.asarray(index, dtype=np.float64) * np.asarray(self.spacing)
+        return tuple(float(v) for v in self.origin + self._matrix @ scaled)
+
+    def TransformPhysicalPointToContinuousIndex(self, point: Sequence[float]) -> Tuple[float, float, float]:
+        offset = np.asarray(point, dtype=np.float64) - self.origin
+        return tuple(float(v) for v in (self._matrix.T @ offset) / np.asarray(self.spacing))
+
+    def slice_origin(self, slice_index: int) -> Tuple[float, float, float]:
+        return self.TransformIndexToPhysicalPoint((0, 0, slice_index))
+
+    def slice_corners(self, slice_index: int) -> List[Tuple[float, float, float]]:
+        cols, rows = self.size[0], self.size[1]
+        return [
+            self.TransformIndexToPhysicalPoint((i, j, slice_index))
+            for i in (0, cols - 1)
+            for j in (0, rows - 1)
+        ]
+
+
+def secondary_slab_range(
+    secondary_geometry: SeriesGeometry,
+    xform: sitk.Transform,
+    plane_points: Sequence[Tuple[float, float, float]],
+    margin: int = 1,
+) -> Tuple[int, int]:
+    """Secondary slice range an affine-resampled plane can touch, inclusive.
+
+    Returns (start, stop) with start > stop when the plane misses the series.
+    """
+    depth = secondary_geometry.GetSize()[2]
+    ks = [secondary_geometry.TransformPhysicalPointToContinuousIndex(xform.TransformPoint(p))[2] for p in plane_points]
+    if max(ks) < -0.5 or min(ks) > depth - 0.5:
+        # Entirely beyond the first/last slice's half-voxel: nothing to decode
+        return depth, depth - 1
+    start = max(0, int(math.floor(min(ks))) - margin)
+    stop = min(depth - 1, int(math.ceil(max(ks))) + margin)
+    if stop - start < 1 and depth > 1:
+        # Keep at least two slices so linear interpolation has a neighbour
+        start, stop = max(0, min(start, depth - 2)), min(depth - 1, max(stop, 1))
+    return start, stop
+
+
 def read_series(file_list: List[str]) -> sitk.Image:
     reader = sitk.ImageSeriesReader()
     reader.MetaDataDictionaryArrayUpdateOn()
@@ -252,15 +344,112 @@ def resample(primary: sitk.Image, secondary: sitk.Image, xform: sitk.Transform,
     return resample_filter.Execute(secondary)
 
 
-def select_slice(image: sitk.Image, slice_index: int) -> np.ndarray:
-    array = sitk.GetArrayFromImage(image)  # z, y, x
-    depth = array.shape[0]
-    if slice_index < 0 or slice_index >= depth:
-        raise IndexError(f"sliceIndex {slice_index} not in [0,{depth-1}]")
-    return np.asarray(array[slice_index, :, :], dtype=np.float32)
+def resample_slab(
+    geometry: SeriesGeometry,
+    first_index: int,
+    count: int,
+    secondary: sitk.Image,
+    xform: sitk.Transform,
+    interpolation: str,
+) -> np.ndarray:
+    """Resample the secondary onto `count` consecutive primary slice planes.
+
+    Returns a (count, rows, cols) float32 array.
+    """
+    cols, rows, _ = geometry.GetSize()
+    resample_filter = sitk.ResampleImageFilter()
+    resample_filter.SetSize([cols, rows, count])
+    resample_filter.SetOutputSpacing(geometry.GetSpacing())
+    resample_filter.SetOutputOrigin(geometry.slice_origin(first_index))
+    resample_filter.SetOutputDirection(geometry.GetDirection())
+    resample_filter.SetTransform(xform)
+    if interpolation.lower() == "nearest":
+        resample_filter.SetInterpolator(sitk.sitkNearestNeighbor)
+    else:
+        resample_filter.SetInterpolator(sitk.sitkLinear)
+    # Same outside-of-FOV value as resample()
+    resample_filter.SetDefaultPixelValue(0.0)
+    resample_filter.SetOutputPixelType(sitk.sitkFloat32)
+    slab = resample_filter.Execute(secondary)
+    return np.array(sitk.GetArrayViewFromImage(slab), dtype=np.float32)
+
+
+def resample_slice(
+    geometry: SeriesGeometry,
+    slice_index: int,
+    secondary: sitk.Image,
+    xform: sitk.Transform,
+    interpolation: str,
+) -> np.ndarray:
+    """Resample the secondary onto one primary slice plane only."""
+    return resample_slab(geometry, slice_index, 1, secondary, xform, interpolation)[0]
+
+
+def parse_slice_indices(spec: Any, depth: int) -> List[int]:
+    """Normalise a sliceIndices config value to sorted, unique indices.
+
+    Accepts "all", a list of indices, or a range {"start": 10, "stop": 20, "step": 1}
+    (stop exclusive, step defaults to 1).
+    """
+    if isinstance(spec, str):
+        if spec.lower() != "all":
+            raise ValueError(f"unsupported sliceIndices value: {spec!r}")
+        return list(range(depth))
+    if isinstance(spec, dict):
+        if "start" not in spec or "stop" not in spec:
+            raise ValueError("sliceIndices range needs start and stop")
+        step = int(spec.get("step", 1))
+        if step == 0:
+            raise ValueError("sliceIndices range step must not be 0")
+        indices = list(range(int(spec["start"]), int(spec["stop"]), step))
+    elif isinstance(spec, (list, tuple)):
+        indices = [int(v) for v in spec]
+    else:
+        raise ValueError(f"unsupported sliceIndices value: {spec!r}")
+
+    indices = sorted(set(indices))
+    if not indices:
+        raise ValueError("sliceIndices selects no slices")
+    if indices[0] < 0 or indices[-1] >= depth:
+        bad = indices[0] if indices[0] < 0 else indices[-1]
+        raise IndexError(f"sliceIndex {bad} not in [0,{depth-1}]")
+    return indices
+
+
+def contiguous_runs(indices: Sequence[int]) -> List[Tuple[int, int]]:
+    """Split sorted indices into (first, count) runs of consecutive slices."""
+    runs: List[Tuple[int, int]] = []
+    for index in indices:
+        if runs and runs[-1][0] + runs[-1][1] == index:
+            runs[-1] = (runs[-1][0], runs[-1][1] + 1)
+        else:
+            runs.append((index, 1))
+    return runs
+
+
+def resample_slices(
+    geometry: SeriesGeometry,
+    indices: Sequence[int],
+    secondary: sitk.Image,
+    xform: sitk.Transform,
+    interpolation: str,
+) -> np.ndarray:
+    """Resample several primary planes, one filter pass per consecutive run."""
+    slabs = [
+        resample_slab(geometry, first, count, secondary, xform, interpolation)
+        for first, count in contiguous_runs(indices)
+    ]
+    return slabs[0] if len(slabs) == 1 else np.concatenate(slabs, axis=0)
 
 
-def encode_slice(slice_array: np.ndarray) -> dict:
+def read_primary_slice(files: Sequence[str], slice_index: int) -> np.ndarray:
+    """Decode a single primary instance (rescale slope/intercept applied by GDCM)."""
+    image = sitk.ReadImage(files[slice_index])
+    return np.array(sitk.GetArrayViewFromImage(image)[0], dtype=np.float32)
+
+
+def finite_window(slice_array: np.ndarray) -> Tuple[np.ndarray, float, float]:
+    """Replace non-finite pixels and return (clean float32 slice, min, max)."""
     finite_mask = np.isfinite(slice_array)
     if np.any(finite_mask):
         clean_values = slice_array[finite_mask]
@@ -273,96 +462,481 @@ def encode_slice(slice_array: np.ndarray) -> dict:
         clean = np.zeros_like(slice_array, dtype=np.float32)
         min_val = 0.0
         max_val = 1.0
+    return clean, min_val, max_val
+
 
-    payload = clean.tobytes(order="C")
+def encode_slice(slice_array: np.ndarray, encoder: Optional[PayloadEncoder] = None) -> dict:
+    encoder = encoder or PayloadEncoder()
+    clean, min_val, max_val = finite_window(slice_array)
+    encoded, frame_fields = encoder.quantize(clean, min_val, max_val)
     return {
         "width": int(slice_array.shape[1]),
         "height": int(slice_array.shape[0]),
         "min": min_val,
         "max": max_val,
-        "data": base64.b64encode(payload).decode("ascii"),
+        **frame_fields,
+        **encoder.pack(encoded.tobytes(order="C")),
+    }
+
+
+def encode_stack(stack: np.ndarray, indices: Sequence[int], encoder: Optional[PayloadEncoder] = None) -> dict:
+    """Encode (count, rows, cols) slices as one buffer.
+
+    Slice i of `slices` occupies bytes [i * frame_bytes, (i + 1) * frame_bytes)
+    of the decoded (decompressed) data, frame_bytes being width * height times
+    the encoding's item size, and carries its own display window plus, for
+    uint16, its own slope/intercept.
+    """
+    encoder = encoder or PayloadEncoder()
+    count, rows, cols = stack.shape
+    frames = []
+    slices = []
+    for i, slice_index in enumerate(indices):
+        clean, min_val, max_val = finite_window(stack[i])
+        encoded, frame_fields = encoder.quantize(clean, min_val, max_val)
+        frames.append(encoded.tobytes(order="C"))
+        slices.append({"sliceIndex": int(slice_index), "min": min_val, "max": max_val, **frame_fields})
+    return {
+        "width": int(cols),
+        "height": int(rows),
+        "count": int(count),
+        "slices": slices,
+        "maxError": max((s["maxError"] for s in slices), default=0.0),
+        **encoder.pack(b"".join(frames)),
     }
 
 
-def run_from_config(cfg: dict) -> dict:
-    primary_files = sort_series_by_position([str(Path(p)) for p in cfg.get("primary", [])])
-    secondary_files = sort_series_by_position([str(Path(p)) for p in cfg.get("secondary", [])])
-    print(f"🐟 FUSION: Loading primary files: {primary_files[:2]}... ({len(primary_files)} total)", file=sys.stderr)
-    print(f"🐟 FUSION: Loading secondary files: {secondary_files[:2]}... ({len(secondary_files)} total)", file=sys.stderr)
-    describe_series("Primary", primary_files)
-    describe_series("Secondary", secondary_files)
+def write_response(payload: dict, encoder: PayloadEncoder, stream=None) -> None:
+    """Write one JSON response line; in binary mode the payload blob follows it.
+
+    The JSON carries binaryLength so a reader knows how many raw bytes to
+    consume after the newline before the next message.
+    """
+    stream = stream or sys.stdout
+    blob = encoder.blob() if encoder.binary else b""
+    if encoder.binary:
+        payload = {**payload, "binaryLength": len(blob)}
+    stream.write(json.dumps(payload) + "\n")
+    stream.flush()
+    if blob:
+        stream.buffer.write(blob)
+        stream.buffer.flush()
+
+
+DEFAULT_CACHE_BUDGET_MB = int(os.environ.get("FUSEBOX_CACHE_MB", "2048"))
+MAX_CACHED_SERIES = 64
+MAX_CACHED_TRANSFORMS = 64
+
+
+def file_fingerprint(path: str) -> Tuple[str, int, int]:
+    try:
+        st = os.stat(path)
+        return path, st.st_mtime_ns, st.st_size
+    except OSError:
+        return path, 0, 0
+
+
+def series_cache_key(files: Sequence[str]) -> tuple:
+    """Identity of a file list; first/last stat catches re-exported series."""
+    if not files:
+        return ()
+    return (tuple(files), file_fingerprint(files[0]), file_fingerprint(files[-1]))
+
+
+class ResampleCache:
+    """In-process caches kept across requests by --daemon mode.
+
+    - series: raw file list → (position-sorted files, SeriesGeometry)
+    - images: sorted file list → decoded sitk.Image, LRU under a byte budget
+    - transforms: transform source + both series → resolved moving→fixed transform
+    """
+
+    def __init__(self, budget_bytes: int = DEFAULT_CACHE_BUDGET_MB * 1024 * 1024):
+        self.budget_bytes = budget_bytes
+        self._series: "OrderedDict[tuple, Tuple[List[str], SeriesGeometry]]" = OrderedDict()
+        self._images: "OrderedDict[tuple, Tuple[sitk.Image, int]]" = OrderedDict()
+        self._image_bytes = 0
+        self._transforms: "OrderedDict[tuple, sitk.Transform]" = OrderedDict()
+        self.counters = {name: {"hits": 0, "misses": 0} for name in ("series", "images", "transforms")}
+
+    @staticmethod
+    def _touch(store: OrderedDict, key: tuple) -> Any:
+        value = store.get(key)
+        if value is not None:
+            store.move_to_end(key)
+        return value
+
+    def _count(self, name: str, hit: bool) -> None:
+        self.counters[name]["hits" if hit else "misses"] += 1
+
+    def series(self, key: tuple, build: Callable[[], Tuple[List[str], SeriesGeometry]]) -> Tuple[List[str], SeriesGeometry]:
+        value = self._touch(self._series, key)
+        self._count("series", value is not None)
+        if value is None:
+            value = build()
+            self._series[key] = value
+            while len(self._series) > MAX_CACHED_SERIES:
+                self._series.popitem(last=False)
+        return value
+
+    def image(self, files: Sequence[str]) -> sitk.Image:
+        key = series_cache_key(files)
+        entry = self._touch(self._images, key)
+        self._count("images", entry is not None)
+        if entry is not None:
+            return entry[0]
+
+        image = read_series(list(files))
+        nbytes = image.GetNumberOfPixels() * image.GetNumberOfComponentsPerPixel() * image.GetSizeOfPixelComponent()
+        if nbytes <= self.budget_bytes:
+            while self._images and self._image_bytes + nbytes > self.budget_bytes:
+                _, (_, evicted_bytes) = self._images.popitem(last=False)
+                self._image_bytes -= evicted_bytes
+            self._images[key] = (image, nbytes)
+            self._image_bytes += nbytes
+        else:
+            print(f"🐟 FUSION: Series of {nbytes / 1e6:.0f} MB exceeds cache budget, not cached", file=sys.stderr)
+        return image
+
+    def transform(self, key: tuple, build: Callable[[], sitk.Transform]) -> sitk.Transform:
+        value = self._touch(self._transforms, key)
+        self._count("transforms", value is not None)
+        if value is None:
+            value = build()
+            self._transforms[key] = value
+            while len(self._transforms) > MAX_CACHED_TRANSFORMS:
+                self._transforms.popitem(last=False)
+        return value
+
+    def clear(self) -> None:
+        self._series.clear()
+        self._images.clear()
+        self._image_bytes = 0
+        self._transforms.clear()
+
+    def stats(self) -> Dict[str, Any]:
+        return {
+            "series": len(self._series),
+            "images": len(self._images),
+            "imageBytes": self._image_bytes,
+            "budgetBytes": self.budget_bytes,
+            "transforms": len(self._transforms),
+            "counters": self.counters,
+            "resolvedTransforms": store.stats() if (store := default_transform_cache()) is not None else None,
+        }
+
+
+def load_series_info(label: str, files: Sequence[str]) -> Tuple[List[str], SeriesGeometry]:
+    sorted_files = sort_series_by_position([str(Path(p)) for p in files])
+    print(f"🐟 FUSION: Loading {label.lower()} files: {sorted_files[:2]}... ({len(sorted_files)} total)", file=sys.stderr)
+    describe_series(label, sorted_files)
+    geometry = SeriesGeometry.from_files(sorted_files) if sorted_files else None
+    return sorted_files, geometry
+
+
+def resolve_transform(
+    cfg: dict,
+    primary_geometry: SeriesGeometry,
+    secondary_geometry: SeriesGeometry,
+    decision: Optional[Dict[str, Any]] = None,
+) -> sitk.Transform:
+    """Turn the config's transform source into the moving→fixed transform used for resampling.
+
+    Each step taken (source, flattening, inversion, orientation probe) is
+    recorded in decision when one is given; see fusebox_transform_cache.
+    """
+    decision = decision if decision is not None else {}
     transform = cfg.get("transform", [])
     transform_file = cfg.get("transformFile")
     invert_transform_file = bool(cfg.get("invertTransformFile", True))
-    slice_index = int(cfg.get("sliceIndex", 0))
-    interpolation = cfg.get("interpolation", "linear")
-
-    if not primary_files or not secondary_files:
-        raise ValueError("primary and secondary file lists required")
 
-    primary = read_series(primary_files)
-    secondary = read_series(secondary_files)
+    def invert(xform: sitk.Transform) -> sitk.Transform:
+        inverted = ensure_moving_to_fixed(xform)
+        decision["inverted"] = inverted is not xform
+        return inverted
 
-    if transform_file:
+    registered = None
+    if cfg.get("registrationFile"):
+        try:
+            registered, kind = registration_transform_from_config(cfg)
+            print(f"🐟 FUSION: Using in-process {kind} REG transform", file=sys.stderr)
+            decision.update({"source": "registrationFile", "registrationKind": kind})
+            if kind == "affine":
+                # Same orientation as the helper's transform file
+                registered = invert(registered)
+        except Exception as exc:
+            if not (transform_file or transform):
+                raise
+            decision["registrationFallback"] = str(exc)
+            print(f"🐟 FUSION: REG conversion failed, falling back to transform/transformFile: {exc}", file=sys.stderr)
+
+    if registered is not None:
+        xform = registered
+    elif transform_file:
         raw_xform = sitk.ReadTransform(transform_file)
+        decision.update({"source": "transformFile", "inputTransform": raw_xform.GetName()})
+        if isinstance(raw_xform, sitk.CompositeTransform):
+            decision["inputChildren"] = raw_xform.GetNumberOfTransforms()
         # Flatten pathological CompositeTransform structure using ITK's FlattenTransformQueue
         xform = flatten_composite_transform(raw_xform)
+        decision["flattenedTransform"] = xform.GetName()
         if invert_transform_file:
-            xform = ensure_moving_to_fixed(xform)
+            xform = invert(xform)
     elif transform:
         print(f"🐟 FUSION: Using matrix transform with values: {transform[:4]}...", file=sys.stderr)
+        decision["source"] = "transform"
         raw = affine_from_row_major([float(v) for v in transform])
         print(f"🐟 FUSION: Created AffineTransform: {raw.GetName()}", file=sys.stderr)
         print(f"🐟 FUSION: Matrix: {list(raw.GetMatrix())[:3]}...", file=sys.stderr)
         print(f"🐟 FUSION: Translation: {list(raw.GetTranslation())}", file=sys.stderr)
-        xform = ensure_moving_to_fixed(raw)
+        xform = invert(raw)
         print(f"🐟 FUSION: After inversion: {xform.GetName()}", file=sys.stderr)
         print(f"🐟 FUSION: Inverted translation: {list(xform.GetTranslation())}", file=sys.stderr)
     else:
-        raise ValueError("Either transform or transformFile must be provided")
+        raise ValueError("One of registrationFile, transform or transformFile must be provided")
 
+    orientation: Dict[str, Any] = {}
     try:
-        xform = pick_moving_to_fixed(primary, secondary, xform)
+        xform = pick_moving_to_fixed(primary_geometry, secondary_geometry, xform, orientation)
         print("🐟 FUSION: pick_moving_to_fixed selected moving→fixed orientation", file=sys.stderr)
     except Exception as exc:
+        orientation["error"] = str(exc)
         print(f"🐟 FUSION: pick_moving_to_fixed failed, keeping original orientation: {exc}", file=sys.stderr)
+    decision["orientation"] = orientation
+    decision["resolvedTransform"] = xform.GetName()
+    return xform
 
-    print(f"🐟 FUSION: Starting resampling with {xform.GetName()}", file=sys.stderr)
-    print(f"🐟 FUSION: Primary image size: {primary.GetSize()}", file=sys.stderr)
-    print(f"🐟 FUSION: Secondary image size: {secondary.GetSize()}", file=sys.stderr)
-    
+
+def load_or_resolve_transform(cfg: dict, primary_geometry: SeriesGeometry, secondary_geometry: SeriesGeometry) -> sitk.Transform:
+    """resolve_transform, served from the on-disk resolved-transform cache when possible."""
+    store = default_transform_cache()
+    if store is None:
+        return resolve_transform(cfg, primary_geometry, secondary_geometry)
+
+    key = store.key(cfg, primary_geometry, secondary_geometry)
+    xform = store.load(key)
+    if xform is not None:
+        print(f"🐟 FUSION: Reusing resolved transform {key}", file=sys.stderr)
+        return xform
+
+    decision: Dict[str, Any] = {}
+    xform = resolve_transform(cfg, primary_geometry, secondary_geometry, decision)
+    # A fallback after a failed REG conversion is not what the key describes
+    if "registrationFallback" not in decision:
+        store.store(key, xform, decision)
+    return xform
+
+
+def transform_cache_key(cfg: dict, primary_key: tuple, secondary_key: tuple) -> tuple:
+    transform_file = cfg.get("transformFile")
+    source = file_fingerprint(transform_file) if transform_file else tuple(float(v) for v in cfg.get("transform", []))
+    registration_file = cfg.get("registrationFile")
+    registration = (
+        file_fingerprint(registration_file),
+        cfg.get("fixedFrameOfReferenceUID"),
+        cfg.get("movingFrameOfReferenceUID"),
+    ) if registration_file else None
+    return (source, registration, bool(cfg.get("invertTransformFile", True)), primary_key, secondary_key)
+
+
+def run_from_config(cfg: dict, cache: Optional[ResampleCache] = None, encoder: Optional[PayloadEncoder] = None) -> dict:
+    """Resample one slice, or a stack of slices when sliceIndices is given.
+
+    With a cache (daemon mode) sorted series, decoded secondaries and resolved
+    transforms are reused across calls. Payloads are encoded per the config's
+    encoding/compression/binary keys (see fusebox_payload); pass an encoder to
+    collect the binary blob afterwards.
+    """
+    encoder = encoder or PayloadEncoder.from_config(cfg)
+    raw_primary = [str(Path(p)) for p in cfg.get("primary", [])]
+    raw_secondary = [str(Path(p)) for p in cfg.get("secondary", [])]
+    interpolation = cfg.get("interpolation", "linear")
+
+    if not raw_primary or not raw_secondary:
+        raise ValueError("primary and secondary file lists required")
+
+    # Geometry comes from headers; pixels are only decoded for the requested
+    # primary slices and the secondary slab the output planes actually touch.
+    if cache is not None:
+        primary_key = series_cache_key(raw_primary)
+        secondary_key = series_cache_key(raw_secondary)
+        primary_files, primary_geometry = cache.series(primary_key, lambda: load_series_info("Primary", raw_primary))
+        secondary_files, secondary_geometry = cache.series(secondary_key, lambda: load_series_info("Secondary", raw_secondary))
+    else:
+        primary_files, primary_geometry = load_series_info("Primary", raw_primary)
+        secondary_files, secondary_geometry = load_series_info("Secondary", raw_secondary)
+
+    depth = primary_geometry.GetSize()[2]
+    stacked = cfg.get("sliceIndices") is not None
+    if stacked:
+        indices = parse_slice_indices(cfg["sliceIndices"], depth)
+    else:
+        slice_index = int(cfg.get("sliceIndex", 0))
+        if slice_index < 0 or slice_index >= depth:
+            raise IndexError(f"sliceIndex {slice_index} not in [0,{depth-1}]")
+        indices = [slice_index]
+
+    if cache is not None:
+        xform = cache.transform(
+            transform_cache_key(cfg, primary_key, secondary_key),
+            lambda: load_or_resolve_transform(cfg, primary_geometry, secondary_geometry),
+        )
+    else:
+        xform = load_or_resolve_transform(cfg, primary_geometry, secondary_geometry)
+
+    mode = f"{len(indices)}-slice" if stacked else "single-slice"
+    print(f"🐟 FUSION: Starting {mode} resampling with {xform.GetName()}", file=sys.stderr)
+    print(f"🐟 FUSION: Primary image size: {primary_geometry.GetSize()}", file=sys.stderr)
+    print(f"🐟 FUSION: Secondary image size: {secondary_geometry.GetSize()}", file=sys.stderr)
+
+    cols, rows, _ = primary_geometry.GetSize()
     try:
-        resampled = resample(primary, secondary, xform, interpolation)
-        print(f"🐟 FUSION: Resampling successful, output size: {resampled.GetSize()}", file=sys.stderr)
+        if cache is not None:
+            # Scrolling will touch every slab; decode the whole secondary once
+            secondary = cache.image(secondary_files)
+            resampled = resample_slices(primary_geometry, indices, secondary, xform, interpolation)
+        else:
+            secondary_slab = secondary_files
+            if xform.IsLinear():
+                # The planes between the first and last requested slice bound every plane in between
+                plane_points = primary_geometry.slice_corners(indices[0]) + primary_geometry.slice_corners(indices[-1])
+                start, stop = secondary_slab_range(secondary_geometry, xform, plane_points)
+                secondary_slab = secondary_files[start:stop + 1] if start <= stop else []
+                print(f"🐟 FUSION: Secondary slab [{start}, {stop}] of {len(secondary_files)} slices", file=sys.stderr)
+            if secondary_slab:
+                secondary = read_series(secondary_slab)
+                resampled = resample_slices(primary_geometry, indices, secondary, xform, interpolation)
+            else:
+                print("🐟 FUSION: Slice planes lie outside the secondary volume", file=sys.stderr)
+                resampled = np.zeros((len(indices), rows, cols), dtype=np.float32)
+        print(f"🐟 FUSION: Resampling successful, output {len(indices)} slice(s) {cols}x{rows}", file=sys.stderr)
     except Exception as e:
         print(f"🐟 FUSION: Resampling failed: {e}", file=sys.stderr)
         raise
-    
-    try:
-        resampled_slice = select_slice(resampled, slice_index)
-        print(f"🐟 FUSION: Slice extraction successful", file=sys.stderr)
-    except Exception as e:
-        print(f"🐟 FUSION: Slice extraction failed: {e}", file=sys.stderr)
-        raise
 
+    if stacked:
+        return encode_slice_stack(cfg, primary_files, indices, resampled, encoder)
+
+    resampled_slice = resampled[0]
     if cfg.get("includePrimary"):
-        primary_slice = select_slice(primary, slice_index).astype(np.float32)
+        primary_slice = read_primary_slice(primary_files, slice_index)
         blend_slice = (primary_slice * 0.5) + (resampled_slice * 0.5)
         return {
             "sliceIndex": slice_index,
-            "primary": encode_slice(primary_slice),
-            "secondary": encode_slice(resampled_slice),
-            "blend": encode_slice(blend_slice),
+            "primary": encode_slice(primary_slice, encoder),
+            "secondary": encode_slice(resampled_slice, encoder),
+            "blend": encode_slice(blend_slice, encoder),
         }
 
-    return encode_slice(resampled_slice)
+    return encode_slice(resampled_slice, encoder)
+
+
+def encode_slice_stack(
+    cfg: dict,
+    primary_files: Sequence[str],
+    indices: Sequence[int],
+    resampled: np.ndarray,
+    encoder: PayloadEncoder,
+) -> dict:
+    """Response for a sliceIndices request (see encode_stack for the layout).
+
+    With includePrimary, primaries listed in primaryCached are neither decoded
+    nor sent; a blend stack is only built on request (includeBlend) since it
+    needs every primary and the client can blend the two stacks itself.
+    """
+    result: Dict[str, Any] = {
+        "sliceIndices": list(indices),
+        "secondary": encode_stack(resampled, indices, encoder),
+    }
+    if not cfg.get("includePrimary"):
+        return result
+
+    include_blend = bool(cfg.get("includeBlend"))
+    cached = set() if include_blend else {int(i) for i in cfg.get("primaryCached") or []}
+    primary_indices = [i for i in indices if i not in cached]
+    if primary_indices:
+        primary_stack = np.stack([read_primary_slice(primary_files, i) for i in primary_indices])
+    else:
+        primary_stack = np.zeros((0,) + resampled.shape[1:], dtype=np.float32)
+    print(f"🐟 FUSION: Sending {len(primary_indices)} of {len(indices)} primary slices", file=sys.stderr)
+
+    result["primaryIndices"] = primary_indices
+    result["primary"] = encode_stack(primary_stack, primary_indices, encoder)
+    if include_blend:
+        result["blend"] = encode_stack((primary_stack * 0.5) + (resampled * 0.5), indices, encoder)
+    return result
+
+
+def serve_daemon(cache_budget_mb: int) -> int:
+    """JSON-lines worker: one request per stdin line, one response per stdout line.
+
+    Request:  {"id": 7, "config": {...same keys as --config...}}
+              {"id": 8, "command": "stats" | "clear" | "shutdown"}
+    Response: {"id": 7, "result": {...}, "elapsedMs": 12.3} or {"id": 7, "error": "..."}
+
+    A request whose config sets binary: true is answered with binaryLength in
+    the response line, followed by that many raw payload bytes.
+
+    stdout carries only responses (all logging goes to stderr). A {"ready": true}
+    line is written once at startup.
+    """
+    cache = ResampleCache(cache_budget_mb * 1024 * 1024)
+
+    def respond(message: dict) -> None:
+        sys.stdout.write(json.dumps(message) + "\n")
+        sys.stdout.flush()
+
+    respond({"ready": True, "pid": os.getpid()})
+    print(f"🐟 FUSION: Daemon ready (cache budget {cache_budget_mb} MB)", file=sys.stderr)
+
+    for line in sys.stdin:
+        line = line.strip()
+        if not line:
+            continue
+        try:
+            request = json.loads(line)
+        except json.JSONDecodeError as exc:
+            respond({"id": None, "error": f"invalid request JSON: {exc}"})
+            continue
+
+        request_id = request.get("id")
+        command = request.get("command")
+        started = time.perf_counter()
+        try:
+            if command == "shutdown":
+                respond({"id": request_id, "result": {"shutdown": True}})
+                break
+            if command == "stats":
+                result = cache.stats()
+            elif command == "clear":
+                cache.clear()
+                result = {"cleared": True}
+            else:
+                config = request.get("config", {})
+                encoder = PayloadEncoder.from_config(config)
+                result = run_from_config(config, cache, encoder)
+                write_response({"id": request_id, "result": result, "elapsedMs": round((time.perf_counter() - started) * 1000, 2)}, encoder)
+                continue
+            respond({"id": request_id, "result": result, "elapsedMs": round((time.perf_counter() - started) * 1000, 2)})
+        except Exception as exc:
+            print(f"🐟 FUSION: Daemon request {request_id} failed: {exc}", file=sys.stderr)
+            respond({"id": request_id, "error": str(exc)})
+
+    return 0
 
 
 def main(argv: List[str]) -> int:
     parser = argparse.ArgumentParser(description="Fusebox resampler")
-    parser.add_argument("--config", required=True)
+    parser.add_argument("--config")
+    parser.add_argument("--daemon", action="store_true", help="Serve JSON-lines requests on stdin/stdout")
+    parser.add_argument("--cache-mb", type=int, default=DEFAULT_CACHE_BUDGET_MB, help="Daemon image cache budget")
     args = parser.parse_args(argv)
 
+    if args.daemon:
+        return serve_daemon(args.cache_mb)
+    if not args.config:
+        parser.error("--config is required unless --daemon is given")
+
     config_path = Path(args.config)
     if not config_path.exists():
         print(json.dumps({"error": f"config not found: {config_path}"}))
@@ -370,12 +944,13 @@ def main(argv: List[str]) -> int:
 
     cfg = json.loads(config_path.read_text())
     try:
-        payload = run_from_config(cfg)
+        encoder = PayloadEncoder.from_config(cfg)
+        payload = run_from_config(cfg, encoder=encoder)
     except Exception as exc:  # pragma: no cover
         print(json.dumps({"error": str(exc)}))
         return 2
 
-    print(json.dumps(payload))
+    write_response(payload, encoder)
     return 0
 
 
@@ -6,26 +6,66 @@ Reads a JSON config via --config with keys:
   secondary: list[str]
   transform: list[16] optional
   transformFile: str optional
+  registrationFile: str optional — DICOM REG converted in-process (see
+              dicom_reg_transform); preferred over transform/transformFile,
+              which remain the fallback when conversion fails
   invertTransformFile: bool optional (default True)
   interpolation: 'linear' | 'nearest' (default 'linear')
   outputDirectory: str (destination root)
   metadata: dict with patient/study/series information
-
-Outputs JSON summary describing generated series and instances.
+  writerThreads: int optional (default $FUSEBOX_WRITER_THREADS or min(8, CPUs))
+  cropToSecondary: bool optional — resample only the primary sub-grid the
+              transformed secondary covers; the offset is in the manifest
+              (cropOffset/cropSize, in primary voxel indices)
+  useCache: bool optional (default True) — reuse an identical earlier run
+              from the volume cache (see fusebox_volume_cache)
+  multiFrame: bool optional — write one Enhanced multi-frame instance
+              (implies scaleToUInt16) instead of one file per slice
+  denseField: bool optional — compose a deformable transform chain once into
+              a displacement field on the primary grid and resample with that
+              (cached across runs and secondaries, see fusebox_transform_cache)
+  denseFieldShrink: int optional (default 1) — sample the field every N
+              primary voxels; fields are smooth, 2–4 is usually plenty
+
+When the secondary is an RTDOSE (one multi-frame file, or several on the same
+grid, which are summed; see fusebox_dose) the dose is resampled linearly onto
+the primary grid, cropped to the dose bounding box, and written as a raw
+little-endian float32 volume (dose.f32, z/y/x order, memory-mappable) plus
+manifest.json instead of DICOM slices. Without any transform keys the dose is
+taken to share the primary's frame of reference.
+
+Several secondaries can share one primary: pass secondaries: [{secondary,
+transform/transformFile, interpolation, outputDirectory, metadata, ...}, ...]
+instead of secondary (per-entry keys override the top-level ones). The
+primary is read once, secondaries run in parallel (parallelSecondaries) and
+the output is {"ok", "results": [one summary per secondary]}.
+
+Outputs JSON summary describing generated series and instances. Per-slice
+instances are also streamed to <outputDirectory>/instances.jsonl as each file
+is written.
 """
 from __future__ import annotations
 
 import argparse
+import copy
 import json
 import math
 import os
 import sys
+import threading
 import uuid
+from concurrent.futures import ThreadPoolExecutor
+from datetime import datetime
 from pathlib import Path
-from typing import Any, Dict, List, Tuple
+from typing import Any, Dict, List, Optional, Tuple
 
 import SimpleITK as sitk
 import numpy as np
+import pydicom
+from pydicom.datadict import dictionary_VR
+from pydicom.tag import Tag
+from pydicom.uid import ExplicitVRLittleEndian
+from pydicom.valuerep import DSfloat
 
 # Add parent directory for helper imports
 SCRIPT_DIR = Path(__file__).resolve().parent
@@ -36,6 +76,10 @@ from fusebox_resample import (  # noqa: E402
     read_series,
     affine_from_row_major,
 )
+from fusebox_volume_cache import VolumeResultCache  # noqa: E402
+from fusebox_dose import is_rtdose, read_rtdose  # noqa: E402
+from fusebox_transform_cache import default_field_cache  # noqa: E402
+from dicom_reg_transform import registration_transform_from_config  # noqa: E402
 from transform_utils import (
     flatten_composite_transform,
     ensure_moving_to_fixed,
@@ -43,6 +87,12 @@ from transform_utils import (
 )  # noqa: E402
 
 
+STATS_HISTOGRAM_BINS = 4096
+STATS_CHUNK_SLICES = 16
+DOSE_VOLUME_NAME = "dose.f32"
+DEFAULT_WRITER_THREADS = int(os.environ.get("FUSEBOX_WRITER_THREADS", str(min(8, os.cpu_count() or 1))))
+
+
 def dicom_uid(root: str = "2.25") -> str:
     return f"{root}.{uuid.uuid4().int}"
 
@@ -56,6 +106,16 @@ def load_transform(cfg: Dict[str, Any]) -> sitk.Transform:
     invert_transform_file = bool(cfg.get("invertTransformFile", True))
     transform = cfg.get("transform", []) or None
 
+    if cfg.get("registrationFile"):
+        try:
+            xform, kind = registration_transform_from_config(cfg)
+            # Deformable composites cannot be inverted; they are resampled with as-is
+            return ensure_moving_to_fixed(xform) if kind == "affine" else xform
+        except Exception as exc:
+            if not (transform_file or transform):
+                raise
+            print(f"🐟 FUSION: REG conversion failed, falling back to transform/transformFile: {exc}", file=sys.stderr)
+
     if transform_file:
         raw_xform = sitk.ReadTransform(str(transform_file))
         xform = flatten_composite_transform(raw_xform)
@@ -69,7 +129,7 @@ def load_transform(cfg: Dict[str, Any]) -> sitk.Transform:
         xform = ensure_moving_to_fixed(raw)
         return xform
 
-    raise ValueError("Either transform or transformFile must be provided")
+    raise ValueError("One of registrationFile, transform or transformFile must be provided")
 
 
 def extract_orientation(image: sitk.Image) -> Tuple[List[float], List[float]]:
@@ -138,26 +198,18 @@ def determine_sop_class(modality: str | None) -> str:
     return "1.2.840.10008.5.1.4.1.1.2"
 
 
-def apply_shared_tags(slice_img: sitk.Image, tags: Dict[str, str]) -> None:
-    for key, value in tags.items():
-        normalized = normalize_dicom_value(value)
-        if normalized is None:
-            continue
-        slice_img.SetMetaData(key, normalized)
+def normalize_tags(tags: Dict[str, Any]) -> Dict[str, str]:
+    """Normalize tag values once; entries that normalize to None are dropped."""
+    normalized = {key: normalize_dicom_value(value) for key, value in tags.items()}
+    return {key: value for key, value in normalized.items() if value is not None}
 
 
-def write_dicom_series(
-    image: sitk.Image,
-    output_dir: Path,
-    metadata: Dict[str, Any],
-    instances: List[Dict[str, Any]],
-) -> Dict[str, str]:
-    ensure_directory(output_dir)
-    writer = sitk.ImageFileWriter()
-    writer.KeepOriginalImageUIDOn()
+def build_series_tags(image: sitk.Image, metadata: Dict[str, Any]) -> Tuple[Dict[str, str], Dict[str, Any]]:
+    """Series-level tags shared by every instance, plus the series info the writers report.
 
-    size = image.GetSize()
-    depth = size[2] if len(size) > 2 else 1
+    Returns (normalized tags, info) where info holds the series/study/frame of
+    reference UIDs, window center/width and the ImageOrientationPatient string.
+    """
     row_cosines, col_cosines = extract_orientation(image)
     pixel_spacing = list(image.GetSpacing())
     if len(pixel_spacing) < 3:
@@ -266,28 +318,89 @@ def write_dicom_series(
     for tag, value in derived_meta.get("AdditionalTags", {}).items():
         shared_tags[tag] = value
 
-    depth_range = range(depth)
-    for idx in depth_range:
+    info = {
+        "seriesInstanceUID": series_uid,
+        "studyInstanceUID": study_uid,
+        "frameOfReferenceUID": frame_of_reference_uid,
+        "modality": modality,
+        "windowCenter": window_center,
+        "windowWidth": window_width,
+        "referencedSeriesInstanceUID": referenced_series_uid,
+        "imageOrientation": (
+            f"{row_cosines[0]:.12f}\\{row_cosines[1]:.12f}\\{row_cosines[2]:.12f}\\"
+            f"{col_cosines[0]:.12f}\\{col_cosines[1]:.12f}\\{col_cosines[2]:.12f}"
+        ),
+    }
+    return normalize_tags(shared_tags), info
+
+
+
+class InstanceLog:
+    """Appends one JSON line per written instance so progress is visible while writing."""
+
+    def __init__(self, path: Optional[Path]):
+        self.path = path
+        self._lock = threading.Lock()
+        self._handle = path.open("w", encoding="utf-8") if path is not None else None
+
+    def append(self, entry: Dict[str, Any]) -> None:
+        if self._handle is None:
+            return
+        with self._lock:
+            self._handle.write(json.dumps(entry) + "\n")
+            self._handle.flush()
+
+    def close(self) -> None:
+        if self._handle is not None:
+            self._handle.close()
+            self._handle = None
+
+
+def write_dicom_series(
+    image: sitk.Image,
+    output_dir: Path,
+    metadata: Dict[str, Any],
+    instances: List[Dict[str, Any]],
+    threads: Optional[int] = None,
+    instance_log: Optional[Path] = None,
+) -> Dict[str, str]:
+    """Write one single-frame instance per slice, fanned out over a thread pool.
+
+    The shared tag set is built and normalized once; each worker only adds the
+    four per-instance tags. Writers are per thread (ImageFileWriter is not
+    thread-safe), and each instance is appended to instance_log as it lands.
+    `instances` is filled in slice order.
+    """
+    ensure_directory(output_dir)
+    shared_tags, info = build_series_tags(image, metadata)
+    size = image.GetSize()
+    depth = size[2] if len(size) > 2 else 1
+    threads = max(1, min(threads or DEFAULT_WRITER_THREADS, depth))
+    log = InstanceLog(instance_log)
+    local = threading.local()
+
+    def write_slice(idx: int) -> Dict[str, Any]:
+        writer = getattr(local, "writer", None)
+        if writer is None:
+            writer = local.writer = sitk.ImageFileWriter()
+            writer.KeepOriginalImageUIDOn()
+
         slice_img = sitk.Extract(image, [size[0], size[1], 0], [0, 0, idx])
         sop_uid = dicom_uid()
         position = transform_index_to_position(image, (0, 0, idx))
-
-        instance_tags = {
-            **shared_tags,
-            "0008|0018": sop_uid,
-            "0020|0013": str(idx + 1),
-            "0020|0037": f"{row_cosines[0]:.12f}\\{row_cosines[1]:.12f}\\{row_cosines[2]:.12f}\\{col_cosines[0]:.12f}\\{col_cosines[1]:.12f}\\{col_cosines[2]:.12f}",
-            "0020|0032": f"{position[0]:.12f}\\{position[1]:.12f}\\{position[2]:.12f}",
-        }
-
-        apply_shared_tags(slice_img, instance_tags)
+        for key, value in shared_tags.items():
+            slice_img.SetMetaData(key, value)
+        slice_img.SetMetaData("0008|0018", sop_uid)
+        slice_img.SetMetaData("0020|0013", str(idx + 1))
+        slice_img.SetMetaData("0020|0037", info["imageOrientation"])
+        slice_img.SetMetaData("0020|0032", f"{position[0]:.12f}\\{position[1]:.12f}\\{position[2]:.12f}")
 
         file_name = f"slice_{idx:04d}.dcm"
         file_path = output_dir / file_name
         writer.SetFileName(str(file_path))
         writer.Execute(slice_img)
 
-        instances.append({
+        entry = {
             "index": idx,
             "sopInstanceUID": sop_uid,
             "fileName": file_name,
@@ -295,24 +408,469 @@ def write_dicom_series(
             "instanceNumber": idx + 1,
             "imagePositionPatient": position,
             "sliceLocation": position[2],
-            "windowCenter": window_center,
-            "windowWidth": window_width,
-        })
+            "windowCenter": info["windowCenter"],
+            "windowWidth": info["windowWidth"],
+        }
+        log.append(entry)
+        return entry
+
+    try:
+        if threads == 1:
+            written = [write_slice(idx) for idx in range(depth)]
+        else:
+            with ThreadPoolExecutor(max_workers=threads) as pool:
+                written = list(pool.map(write_slice, range(depth)))
+    finally:
+        log.close()
+    instances.extend(written)
 
     return {
-        "seriesInstanceUID": series_uid,
-        "studyInstanceUID": study_uid,
-        "frameOfReferenceUID": frame_of_reference_uid,
+        "seriesInstanceUID": info["seriesInstanceUID"],
+        "studyInstanceUID": info["studyInstanceUID"],
+        "frameOfReferenceUID": info["frameOfReferenceUID"],
     }
 
 
+ENHANCED_SOP_CLASSES = {
+    "CT": "1.2.840.10008.5.1.4.1.1.2.1",   # Enhanced CT Image Storage
+    "MR": "1.2.840.10008.5.1.4.1.1.4.1",   # Enhanced MR Image Storage
+    "PT": "1.2.840.10008.5.1.4.1.1.130",   # Enhanced PET Image Storage
+    "PET": "1.2.840.10008.5.1.4.1.1.130",
+}
+
+# Carried per frame in the functional groups of an Enhanced image rather than at the top level
+FUNCTIONAL_GROUP_TAGS = {"0028|0030", "0018|0050", "0018|0088", "0028|1050", "0028|1051", "0028|1052", "0028|1053"}
+
+
+def dataset_value(vr: str, value: str) -> Any:
+    """Convert a normalized tag string (backslash-separated) into a pydicom value for vr."""
+    parts = value.split("\\")
+    if vr in ("US", "UL", "SS", "SL"):
+        converted = [int(float(p)) for p in parts]
+    elif vr == "DS":
+        converted = [DSfloat(float(p), auto_format=True) for p in parts]
+    elif vr in ("FL", "FD"):
+        converted = [float(p) for p in parts]
+    else:
+        return value
+    return converted[0] if len(converted) == 1 else converted
+
+
+def write_enhanced_multiframe(
+    image: sitk.Image,
+    output_dir: Path,
+    metadata: Dict[str, Any],
+    instances: List[Dict[str, Any]],
+) -> Dict[str, str]:
+    """Write the whole volume as a single Enhanced (multi-frame) instance.
+
+    Pixel data must be integer (callers scale to UInt16 first). Geometry and
+    rescale/window live in the shared and per-frame functional groups.
+    """
+    if image.GetPixelID() != sitk.sitkUInt16:
+        raise ValueError("multi-frame output requires a UInt16 image (scaleToUInt16)")
+    ensure_directory(output_dir)
+    shared_tags, info = build_series_tags(image, metadata)
+    cols, rows, depth = image.GetSize()
+    spacing = image.GetSpacing()
+    modality = str(info["modality"] or "CT").upper()
+
+    ds = pydicom.Dataset()
+    for key, value in shared_tags.items():
+        if key in FUNCTIONAL_GROUP_TAGS:
+            continue
+        tag = Tag(int(key[:4], 16), int(key[5:], 16))
+        try:
+            vr = dictionary_VR(tag)
+        except KeyError:
+            vr = "LO"  # private/unknown tags from AdditionalTags
+        if vr == "SQ":
+            continue  # sequences are built explicitly below
+        ds.add_new(tag, vr, dataset_value(vr, value))
+
+    sop_uid = dicom_uid()
+    ds.SOPClassUID = ENHANCED_SOP_CLASSES.get(modality, ENHANCED_SOP_CLASSES["CT"])
+    ds.SOPInstanceUID = sop_uid
+    ds.InstanceNumber = 1
+    ds.Rows = rows
+    ds.Columns = cols
+    ds.NumberOfFrames = depth
+    ds.ContentDate = datetime.now().strftime("%Y%m%d")
+    ds.ContentTime = datetime.now().strftime("%H%M%S")
+
+    if info.get("referencedSeriesInstanceUID"):
+        ref = pydicom.Dataset()
+        ref.SeriesInstanceUID = info["referencedSeriesInstanceUID"]
+        ds.ReferencedSeriesSequence = pydicom.Sequence([ref])
+
+    dimension_uid = dicom_uid()
+    dimension = pydicom.Dataset()
+    dimension.DimensionOrganizationUID = dimension_uid
+    ds.DimensionOrganizationSequence = pydicom.Sequence([dimension])
+    position_index = pydicom.Dataset()
+    position_index.DimensionOrganizationUID = dimension_uid
+    position_index.DimensionIndexPointer = Tag(0x0020, 0x0032)
+    position_index.FunctionalGroupPointer = Tag(0x0020, 0x9113)
+    ds.DimensionIndexSequence = pydicom.Sequence([position_index])
+
+    shared = pydicom.Dataset()
+    measures = pydicom.Dataset()
+    measures.PixelSpacing = dataset_value("DS", shared_tags.get("0028|0030", f"{spacing[1]:g}\\{spacing[0]:g}"))
+    measures.SliceThickness = dataset_value("DS", shared_tags.get("0018|0050", f"{spacing[2]:g}"))
+    measures.SpacingBetweenSlices = dataset_value("DS", shared_tags.get("0018|0088", f"{spacing[2]:g}"))
+    shared.PixelMeasuresSequence = pydicom.Sequence([measures])
+    orientation = pydicom.Dataset()
+    orientation.ImageOrientationPatient = dataset_value("DS", info["imageOrientation"])
+    shared.PlaneOrientationSequence = pydicom.Sequence([orientation])
+    if "0028|1052" in shared_tags or "0028|1053" in shared_tags:
+        rescale = pydicom.Dataset()
+        rescale.RescaleIntercept = dataset_value("DS", shared_tags.get("0028|1052", "0"))
+        rescale.RescaleSlope = dataset_value("DS", shared_tags.get("0028|1053", "1"))
+        rescale.RescaleType = "HU" if modality == "CT" else "US"
+        shared.PixelValueTransformationSequence = pydicom.Sequence([rescale])
+    if "0028|1050" in shared_tags and "0028|1051" in shared_tags:
+        voi = pydicom.Dataset()
+        voi.WindowCenter = dataset_value("DS", shared_tags["0028|1050"])
+        voi.WindowWidth = dataset_value("DS", shared_tags["0028|1051"])
+        shared.FrameVOILUTSequence = pydicom.Sequence([voi])
+    ds.SharedFunctionalGroupsSequence = pydicom.Sequence([shared])
+
+    per_frame = []
+    for idx in range(depth):
+        position = transform_index_to_position(image, (0, 0, idx))
+        frame = pydicom.Dataset()
+        plane = pydicom.Dataset()
+        plane.ImagePositionPatient = [DSfloat(v, auto_format=True) for v in position]
+        frame.PlanePositionSequence = pydicom.Sequence([plane])
+        content = pydicom.Dataset()
+        content.DimensionIndexValues = [idx + 1]
+        content.InStackPositionNumber = idx + 1
+        frame.FrameContentSequence = pydicom.Sequence([content])
+        per_frame.append(frame)
+    ds.PerFrameFunctionalGroupsSequence = pydicom.Sequence(per_frame)
+
+    ds.PixelData = np.ascontiguousarray(sitk.GetArrayViewFromImage(image)).astype("<u2", copy=False).tobytes()
+
+    file_meta = pydicom.dataset.FileMetaDataset()
+    file_meta.MediaStorageSOPClassUID = ds.SOPClassUID
+    file_meta.MediaStorageSOPInstanceUID = sop_uid
+    file_meta.TransferSyntaxUID = ExplicitVRLittleEndian
+    ds.file_meta = file_meta
+
+    file_name = "multiframe.dcm"
+    file_path = output_dir / file_name
+    if int(pydicom.__version__.split(".")[0]) >= 3:
+        ds.save_as(str(file_path), enforce_file_format=True)
+    else:
+        ds.is_little_endian, ds.is_implicit_VR = True, False
+        ds.save_as(str(file_path), write_like_original=False)
+
+    first = transform_index_to_position(image, (0, 0, 0))
+    instances.append({
+        "index": 0,
+        "sopInstanceUID": sop_uid,
+        "fileName": file_name,
+        "filePath": str(file_path),
+        "instanceNumber": 1,
+        "numberOfFrames": depth,
+        "imagePositionPatient": first,
+        "sliceLocation": first[2],
+        "windowCenter": info["windowCenter"],
+        "windowWidth": info["windowWidth"],
+    })
+
+    return {
+        "seriesInstanceUID": info["seriesInstanceUID"],
+        "studyInstanceUID": info["studyInstanceUID"],
+        "frameOfReferenceUID": info["frameOfReferenceUID"],
+    }
+
+
+def dense_field_transform(
+    cfg: Dict[str, Any],
+    primary: sitk.Image,
+    transform: sitk.Transform,
+    shrink: int = 1,
+) -> Tuple[sitk.Transform, Dict[str, Any]]:
+    """Replace a deformable chain by one displacement field sampled on the primary grid.
+
+    ResampleImageFilter otherwise evaluates every transform of the chain for
+    every output voxel. At shrink 1 the field is exact at the primary voxel
+    centres; coarser fields are interpolated linearly in between.
+    """
+    shrink = max(1, int(shrink))
+    size = [int(math.ceil((n - 1) / shrink)) + 1 for n in primary.GetSize()]
+    spacing = [s * shrink for s in primary.GetSpacing()]
+    cache = default_field_cache()
+    key = cache.key(cfg, primary, shrink)
+
+    def build() -> sitk.Image:
+        print(f"🐟 FUSION: Composing {transform.GetName()} into a {size} displacement field", file=sys.stderr)
+        return sitk.TransformToDisplacementField(
+            transform,
+            sitk.sitkVectorFloat64,
+            size,
+            primary.GetOrigin(),
+            spacing,
+            primary.GetDirection(),
+        )
+
+    field_transform, hit = cache.transform(key, build)
+    return field_transform, {"key": key, "cacheHit": hit, "shrink": shrink, "size": size}
+
+
+def secondary_footprint(
+    primary: sitk.Image,
+    secondary: sitk.Image,
+    moving_to_fixed: sitk.Transform,
+    margin: int = 1,
+    samples: int = 5,
+) -> Optional[Tuple[Tuple[int, int, int], Tuple[int, int, int]]]:
+    """Primary index box covering the secondary volume once mapped into fixed space.
+
+    Maps a samples^3 lattice spanning the secondary's full extent (voxel edges,
+    not centres) through moving_to_fixed; for affine transforms the corners
+    alone would do, the lattice keeps deformable transforms reasonably
+    covered. Returns (start index, size) clipped to the primary grid and
+    padded by margin voxels, or None when the secondary misses the primary.
+    """
+    sec_size = secondary.GetSize()
+    axes = [np.linspace(-0.5, n - 0.5, samples) for n in sec_size]
+    indices = []
+    for i in axes[0]:
+        for j in axes[1]:
+            for k in axes[2]:
+                physical = secondary.TransformContinuousIndexToPhysicalPoint((float(i), float(j), float(k)))
+                mapped = moving_to_fixed.TransformPoint(physical)
+                indices.append(primary.TransformPhysicalPointToContinuousIndex(mapped))
+    indices = np.asarray(indices)
+    if not np.all(np.isfinite(indices)):
+        return None
+
+    pad = margin if moving_to_fixed.IsLinear() else margin + 1
+    size = np.asarray(primary.GetSize())
+    lower = np.maximum(np.floor(indices.min(axis=0)).astype(int) - pad, 0)
+    upper = np.minimum(np.ceil(indices.max(axis=0)).astype(int) + pad, size - 1)
+    if np.any(upper < lower):
+        return None
+    return tuple(int(v) for v in lower), tuple(int(v) for v in upper - lower + 1)
+
+
+def volume_statistics(
+    image: sitk.Image,
+    percentiles: Tuple[float, ...] = (1.0, 99.0),
+    bins: int = STATS_HISTOGRAM_BINS,
+    chunk_slices: int = STATS_CHUNK_SLICES,
+) -> Dict[str, float]:
+    """Finite min/max and histogram percentiles without copying the volume.
+
+    Works on a GetArrayViewFromImage view a few slices at a time (only the
+    chunk's finite values are materialized): one sweep for min/max, one for a
+    fixed-bin histogram. Percentiles are interpolated within their bin, so
+    they are accurate to (max - min) / bins. Returns min, max, count and
+    p<N> for each requested percentile (p1, p99 by default).
+    """
+    view = sitk.GetArrayViewFromImage(image)
+    if view.ndim == 2:
+        view = view[np.newaxis]
+
+    def finite_chunks():
+        for start in range(0, view.shape[0], chunk_slices):
+            chunk = view[start:start + chunk_slices]
+            yield chunk[np.isfinite(chunk)]
+
+    vmin, vmax, count = math.inf, -math.inf, 0
+    for values in finite_chunks():
+        if values.size:
+            vmin = min(vmin, float(values.min()))
+            vmax = max(vmax, float(values.max()))
+            count += int(values.size)
+
+    result: Dict[str, float] = {"count": count}
+    if not count:
+        result.update({"min": 0.0, "max": 1.0})
+        result.update({f"p{q:g}": 0.0 for q in percentiles})
+        return result
+    result.update({"min": vmin, "max": vmax})
+    if vmin == vmax:
+        result.update({f"p{q:g}": vmin for q in percentiles})
+        return result
+
+    histogram = np.zeros(bins, dtype=np.int64)
+    for values in finite_chunks():
+        if values.size:
+            histogram += np.histogram(values, bins=bins, range=(vmin, vmax))[0]
+    cumulative = np.cumsum(histogram)
+    bin_width = (vmax - vmin) / bins
+    for q in percentiles:
+        target = q / 100.0 * count
+        b = int(np.searchsorted(cumulative, target, side="left"))
+        b = min(b, bins - 1)
+        below = cumulative[b - 1] if b > 0 else 0
+        in_bin = histogram[b]
+        fraction = (target - below) / in_bin if in_bin else 0.0
+        result[f"p{q:g}"] = float(vmin + (b + min(max(fraction, 0.0), 1.0)) * bin_width)
+    return result
+
+
+class PrimaryLoader:
+    """Reads the primary series on first use and shares it between secondaries."""
+
+    def __init__(self, files: List[str]):
+        self.files = files
+        self._image: Optional[sitk.Image] = None
+        self._lock = threading.Lock()
+
+    def get(self) -> sitk.Image:
+        with self._lock:
+            if self._image is None:
+                self._image = read_series(self.files)
+            return self._image
+
+
 def run_from_config(cfg: Dict[str, Any]) -> Dict[str, Any]:
+    if cfg.get("secondaries") is not None:
+        return run_multi_from_config(cfg)
+    primary_files = sort_series_by_position([str(Path(p)) for p in cfg.get("primary", [])])
+    return resample_secondary(cfg, PrimaryLoader(primary_files))
+
+
+def run_multi_from_config(cfg: Dict[str, Any]) -> Dict[str, Any]:
+    """Fuse several secondaries onto one primary, read and sorted once.
+
+    Each entry of cfg["secondaries"] is a config overlay (secondary, transform /
+    transformFile, interpolation, outputDirectory, metadata, ...) on top of the
+    top-level keys. Entries run on a thread pool (parallelSecondaries, default
+    min(4, count)); each writes its own manifest. A failing entry reports
+    {"ok": false, "error"} without affecting the others.
+    """
+    entries = cfg.get("secondaries") or []
+    if not entries:
+        raise ValueError("secondaries must list at least one secondary")
     primary_files = sort_series_by_position([str(Path(p)) for p in cfg.get("primary", [])])
+    primary = PrimaryLoader(primary_files)
+    shared = {key: value for key, value in cfg.items() if key != "secondaries"}
+
+    def run_entry(entry: Dict[str, Any]) -> Dict[str, Any]:
+        try:
+            # Deep copy: entries without their own metadata would otherwise share one dict
+            return resample_secondary(copy.deepcopy({**shared, **entry}), primary)
+        except Exception as exc:
+            print(f"🐟 FUSION: Secondary {entry.get('outputDirectory')} failed: {exc}", file=sys.stderr)
+            return {"ok": False, "error": str(exc), "outputDirectory": entry.get("outputDirectory")}
+
+    workers = max(1, min(int(cfg.get("parallelSecondaries") or 4), len(entries)))
+    with ThreadPoolExecutor(max_workers=workers) as pool:
+        results = list(pool.map(run_entry, entries))
+    return {"ok": all(result.get("ok") for result in results), "results": results}
+
+
+def resample_dose(cfg: Dict[str, Any], primary_loader: PrimaryLoader, dose_files: List[str]) -> Dict[str, Any]:
+    """Dose grid onto the primary (or a registered series), cropped to the dose box.
+
+    The output is dose.f32 — float32, little-endian, z/y/x — with its geometry
+    in the manifest, so the viewer maps it instead of decoding DICOM slices.
+    cropOffset/cropSize place it in primary voxel indices.
+    """
+    output_root = Path(cfg.get("outputDirectory"))
+    primary = primary_loader.get()
+    dose, dose_info = read_rtdose(dose_files)
+
+    if any(cfg.get(key) for key in ("registrationFile", "transformFile", "transform")):
+        transform = load_transform(cfg)
+        try:
+            transform = pick_moving_to_fixed(primary, dose, transform)
+        except Exception:
+            pass
+    else:
+        # Dose computed on the planning CT shares its frame of reference
+        transform = sitk.AffineTransform(3)
+    try:
+        transform_for_resample = transform.GetInverse()
+        crop = secondary_footprint(primary, dose, transform, margin=1)
+    except Exception:
+        transform_for_resample, crop = transform, None
+    if crop is None:
+        print("🐟 FUSION: Dose footprint unavailable, resampling the full primary grid", file=sys.stderr)
+        crop = ((0, 0, 0), tuple(int(v) for v in primary.GetSize()))
+
+    crop_start, crop_size = crop
+    resample_filter = sitk.ResampleImageFilter()
+    resample_filter.SetReferenceImage(primary)
+    resample_filter.SetSize(list(crop_size))
+    resample_filter.SetOutputOrigin(primary.TransformIndexToPhysicalPoint(list(crop_start)))
+    resample_filter.SetTransform(transform_for_resample)
+    resample_filter.SetInterpolator(sitk.sitkLinear)
+    resample_filter.SetDefaultPixelValue(0.0)
+    resample_filter.SetOutputPixelType(sitk.sitkFloat32)
+    resampled = resample_filter.Execute(dose)
+    print(f"🐟 FUSION: Dose resampled to {list(crop_size)} at primary index {list(crop_start)} of {list(primary.GetSize())}", file=sys.stderr)
+
+    ensure_directory(output_root)
+    view = sitk.GetArrayViewFromImage(resampled)
+    volume_path = output_root / DOSE_VOLUME_NAME
+    volume = np.memmap(volume_path, dtype="<f4", mode="w+", shape=view.shape)
+    volume[:] = view
+    volume.flush()
+    del volume
+
+    depth = resampled.GetSize()[2]
+    spacing = list(resampled.GetSpacing())
+    row_cos, col_cos = extract_orientation(resampled)
+    metadata = cfg.get("metadata", {})
+    summary = {
+        "ok": True,
+        "modality": "RTDOSE",
+        "volumePath": str(volume_path),
+        "dtype": "float32",
+        "byteOrder": "little",
+        "shape": list(view.shape),
+        "maxDose": float(view.max()) if view.size else 0.0,
+        **dose_info,
+        "frameOfReferenceUID": metadata.get("primarySeries", {}).get("FrameOfReferenceUID"),
+        "doseFrameOfReferenceUID": dose_info["frameOfReferenceUID"],
+        "sliceCount": depth,
+        "rows": resampled.GetSize()[1],
+        "columns": resampled.GetSize()[0],
+        "pixelSpacing": [spacing[1], spacing[0]],
+        "sliceSpacing": spacing[2],
+        "imageOrientationPatient": row_cos + col_cos,
+        "imagePositionPatientFirst": transform_index_to_position(resampled, (0, 0, 0)),
+        "imagePositionPatientLast": transform_index_to_position(resampled, (0, 0, depth - 1)),
+        "outputDirectory": str(output_root),
+        "manifestPath": str(output_root / "manifest.json"),
+        "primarySize": list(primary.GetSize()),
+        "cropOffset": list(crop_start),
+        "cropSize": list(crop_size),
+        "instances": [],
+        "cacheKey": None,
+        "cacheHit": False,
+    }
+    with (output_root / "manifest.json").open("w", encoding="utf-8") as f:
+        json.dump(summary, f, indent=2)
+    return summary
+
+
+def resample_secondary(cfg: Dict[str, Any], primary_loader: PrimaryLoader) -> Dict[str, Any]:
+    primary_files = primary_loader.files
+    secondary_paths = [str(Path(p)) for p in cfg.get("secondary", [])]
+    if primary_files and is_rtdose(secondary_paths):
+        return resample_dose(cfg, primary_loader, secondary_paths)
     secondary_files = sort_series_by_position([str(Path(p)) for p in cfg.get("secondary", [])])
     if not primary_files or not secondary_files:
         raise ValueError("primary and secondary file lists required")
 
-    primary = read_series(primary_files)
+    output_root = Path(cfg.get("outputDirectory"))
+    cache = VolumeResultCache.from_environment() if cfg.get("useCache", True) else None
+    cache_key = None
+    if cache is not None:
+        cache_key = cache.key(cfg, primary_files, secondary_files)
+        cached = cache.lookup(cache_key)
+        if cached is not None:
+            print(f"🐟 FUSION: Reusing cached volume {cache_key}", file=sys.stderr)
+            return cache.materialize(cache_key, cached, output_root)
+
+    primary = primary_loader.get()
     secondary = read_series(secondary_files)
     transform = load_transform(cfg)
 
@@ -327,16 +885,39 @@ def run_from_config(cfg: Dict[str, Any]) -> Dict[str, Any]:
     interpolator = sitk.sitkLinear if interpolation != "nearest" else sitk.sitkNearestNeighbor
 
     # Harness parity: invert before resampling so the transform maps output→input.
+    inverted = True
     try:
         transform_for_resample = transform.GetInverse()
     except Exception:
         transform_for_resample = transform
+        inverted = False
+
+    # Optional: evaluate a deformable chain once instead of per voxel per resample
+    dense_field = None
+    if cfg.get("denseField") and not transform_for_resample.IsLinear():
+        transform_for_resample, dense_field = dense_field_transform(
+            cfg, primary, transform_for_resample, int(cfg.get("denseFieldShrink", 1))
+        )
+
+    # FIX: Load metadata BEFORE using it; the derived rescale/WL below go into a local copy
+    metadata = copy.deepcopy(cfg.get("metadata", {}))
+
+    # Optional: resample only the primary sub-grid the secondary actually covers
+    crop = None
+    if cfg.get("cropToSecondary"):
+        if inverted:
+            crop = secondary_footprint(primary, secondary, transform)
+        if crop is None:
+            print("🐟 FUSION: cropToSecondary unavailable, resampling the full primary grid", file=sys.stderr)
+        else:
+            print(f"🐟 FUSION: Cropping output to index {list(crop[0])} size {list(crop[1])} of {list(primary.GetSize())}", file=sys.stderr)
 
-    # FIX: Load metadata BEFORE using it
-    metadata = cfg.get("metadata", {})
-    
     resample_filter = sitk.ResampleImageFilter()
     resample_filter.SetReferenceImage(primary)
+    if crop is not None:
+        crop_start, crop_size = crop
+        resample_filter.SetSize(list(crop_size))
+        resample_filter.SetOutputOrigin(primary.TransformIndexToPhysicalPoint(list(crop_start)))
     resample_filter.SetTransform(transform_for_resample)
     resample_filter.SetInterpolator(interpolator)
     # Choose outside-of-FOV value by modality: CT→air(-1000), PET/MR→0
@@ -346,27 +927,25 @@ def run_from_config(cfg: Dict[str, Any]) -> Dict[str, Any]:
     resample_filter.SetOutputPixelType(sitk.sitkFloat32)
     resampled = resample_filter.Execute(secondary)
 
-    output_root = Path(cfg.get("outputDirectory"))
     dicom_dir = output_root / "dicom"
     ensure_directory(output_root)
     ensure_directory(dicom_dir)
 
-    # Optional scaling to UInt16 for export mode only
-    scale_to_uint16 = bool(cfg.get("scaleToUInt16", False))
+    # Optional scaling to UInt16 for export mode only (Enhanced multi-frame needs integer pixels)
+    multi_frame = bool(cfg.get("multiFrame", False))
+    scale_to_uint16 = bool(cfg.get("scaleToUInt16", False)) or multi_frame
     write_image = resampled
+    # One statistics pass serves both the export scaling and the WL defaults below
+    try:
+        stats = volume_statistics(resampled)
+    except Exception:
+        stats = None
     if scale_to_uint16:
-        try:
-            arr = sitk.GetArrayFromImage(resampled).astype(np.float32)
-            finite = np.isfinite(arr)
-            if finite.any():
-                valid = arr[finite]
-                vmin = float(np.min(valid))
-                vmax = float(np.max(valid))
-            else:
-                vmin, vmax = 0.0, 1.0
-            if not np.isfinite(vmin) or not np.isfinite(vmax) or vmin == vmax:
-                vmin, vmax = 0.0, 1.0
-        except Exception:
+        if stats is not None:
+            vmin, vmax = stats["min"], stats["max"]
+        else:
+            vmin, vmax = 0.0, 1.0
+        if not np.isfinite(vmin) or not np.isfinite(vmax) or vmin == vmax:
             vmin, vmax = 0.0, 1.0
 
         scale = (vmax - vmin) / 65535.0
@@ -385,7 +964,19 @@ def run_from_config(cfg: Dict[str, Any]) -> Dict[str, Any]:
         derived_meta["RescaleSlope"] = float(scale)
 
     instances: List[Dict[str, Any]] = []
-    series_info = write_dicom_series(write_image, dicom_dir, metadata, instances)
+    instance_log = output_root / "instances.jsonl"
+    if multi_frame:
+        series_info = write_enhanced_multiframe(write_image, dicom_dir, metadata, instances)
+    else:
+        writer_threads = cfg.get("writerThreads")
+        series_info = write_dicom_series(
+            write_image,
+            dicom_dir,
+            metadata,
+            instances,
+            threads=int(writer_threads) if writer_threads else None,
+            instance_log=instance_log,
+        )
 
     rows = resampled.GetSize()[1]
     cols = resampled.GetSize()[0]
@@ -400,18 +991,11 @@ def run_from_config(cfg: Dict[str, Any]) -> Dict[str, Any]:
     secondary_meta = metadata.get("secondarySeries", {})
 
     # Compute robust WL defaults from resampled image if metadata lacks them
-    try:
-        arr_stats = sitk.GetArrayFromImage(resampled).astype(np.float32)
-        finite_mask = np.isfinite(arr_stats)
-        if finite_mask.any():
-            vals = arr_stats[finite_mask]
-            p1 = float(np.percentile(vals, 1.0))
-            p99 = float(np.percentile(vals, 99.0))
-            if not np.isfinite(p1) or not np.isfinite(p99) or p1 == p99:
-                p1, p99 = float(np.min(vals)), float(np.max(vals))
-        else:
-            p1, p99 = 0.0, 1.0
-    except Exception:
+    if stats is not None and stats["count"]:
+        p1, p99 = stats["p1"], stats["p99"]
+        if not np.isfinite(p1) or not np.isfinite(p99) or p1 == p99:
+            p1, p99 = stats["min"], stats["max"]
+    else:
         p1, p99 = 0.0, 1.0
 
     wl_center_default = (p1 + p99) / 2.0
@@ -437,7 +1021,15 @@ def run_from_config(cfg: Dict[str, Any]) -> Dict[str, Any]:
         "windowWidth": wl_width_out,
         "outputDirectory": str(dicom_dir),
         "manifestPath": str(output_root / "manifest.json"),
+        "primarySize": list(primary.GetSize()),
+        "cropOffset": list(crop[0]) if crop is not None else None,
+        "cropSize": list(crop[1]) if crop is not None else None,
+        "instanceLogPath": None if multi_frame else str(instance_log),
+        "multiFrame": multi_frame,
+        "denseField": dense_field,
         "instances": instances,
+        "cacheKey": cache_key,
+        "cacheHit": False,
     }
 
     # Write per-run manifest for debugging
@@ -445,6 +1037,9 @@ def run_from_config(cfg: Dict[str, Any]) -> Dict[str, Any]:
     with manifest_path.open("w", encoding="utf-8") as f:
         json.dump(summary, f, indent=2)
 
+    if cache is not None:
+        cache.store(cache_key, summary)
+
     return summary
 
 
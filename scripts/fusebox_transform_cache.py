@@ -0,0 +1,297 @@
+#!/usr/bin/env python3
+"""On-disk cache of resolved fusebox transforms, with the decision that produced them.
+
+Every fusebox_resample call turned its transform source into the transform it
+resamples with: read the transform file (or REG / matrix), flatten
+pathological composites, invert, then probe both orientations against the
+image bounds (pick_moving_to_fixed). The result only depends on the source
+and the two series geometries, so it is written once per
+
+  - transform source: matrix values, transform file content digest and
+    inversion flag, or REG content digest and frame overrides
+  - primary and secondary geometry (size, spacing, origin, direction)
+
+and read back directly afterwards. Each entry is <key>.h5 (the transform)
+plus <key>.json, an audit record of how it was resolved: the source, whether
+a composite was flattened or the transform inverted, the orientation probe
+scores and the chosen orientation.
+
+Location: $FUSEBOX_TRANSFORM_CACHE (default <repo>/tmp/fusebox-transforms/resolved).
+FUSEBOX_TRANSFORM_CACHE=off disables the cache.
+
+DisplacementFieldCache keeps the other expensive product of a deformable
+registration: the whole transform chain composed into one dense displacement
+field on a primary grid (fusebox_resample_volume's denseField option). It is
+keyed by transform source (REG frames included) and primary geometry only, so
+every secondary registered through the same transform reuses it. Fields are
+stored as float32 .mha files, evicted least-recently-used past
+$FUSEBOX_FIELD_CACHE_MB (default 4096), in $FUSEBOX_FIELD_CACHE (default
+<repo>/tmp/fusebox-transforms/fields; off keeps them in memory only).
+"""
+from __future__ import annotations
+
+import hashlib
+import json
+import os
+import sys
+import threading
+from collections import OrderedDict
+from datetime import datetime, timezone
+from pathlib import Path
+from typing import Any, Callable, Dict, List, Optional, Tuple
+
+import SimpleITK as sitk
+
+SCRIPT_DIR = Path(__file__).resolve().parent
+if str(SCRIPT_DIR) not in sys.path:
+    sys.path.insert(0, str(SCRIPT_DIR))
+
+from dicom_reg_transform import registration_frames  # noqa: E402
+from fusebox_cache_utils import evict_lru, file_digest  # noqa: E402
+
+DEFAULT_CACHE_ROOT = SCRIPT_DIR.parent / "tmp" / "fusebox-transforms" / "resolved"
+DEFAULT_FIELD_CACHE_ROOT = SCRIPT_DIR.parent / "tmp" / "fusebox-transforms" / "fields"
+DEFAULT_FIELD_CACHE_MB = int(os.environ.get("FUSEBOX_FIELD_CACHE_MB", "4096"))
+MAX_MEMORY_FIELDS = 4
+
+# Bump when resolve_transform can pick a different transform for the same inputs
+RESOLVER_VERSION = 1
+
+def geometry_signature(image: Any) -> Dict[str, Any]:
+    """Size/spacing/origin/direction of an sitk.Image or SeriesGeometry, rounded for stable keys."""
+    return {
+        "size": [int(v) for v in image.GetSize()],
+        "spacing": [round(float(v), 6) for v in image.GetSpacing()],
+        "origin": [round(float(v), 4) for v in image.GetOrigin()],
+        "direction": [round(float(v), 6) for v in image.GetDirection()],
+    }
+
+
+def transform_source(cfg: Dict[str, Any]) -> Dict[str, Any]:
+    """The parts of a fusebox config that determine the resolved transform."""
+    source: Dict[str, Any] = {"transform": [float(v) for v in cfg.get("transform") or []]}
+    if cfg.get("transformFile"):
+        source["transformFile"] = file_digest(str(cfg["transformFile"]))
+        source["invertTransformFile"] = bool(cfg.get("invertTransformFile", True))
+    if cfg.get("registrationFile"):
+        source["registrationFile"] = file_digest(str(cfg["registrationFile"]))
+        # The resolved frames, not just the overrides: one REG can register several
+        # moving frames, and secondaries sharing it must not share an entry
+        source["frames"] = list(registration_frames(cfg))
+    return source
+
+
+class ResolvedTransformCache:
+    """Directory of <key>.h5 transforms with <key>.json decision records."""
+
+    def __init__(self, root: Path):
+        self.root = root
+        self.hits = 0
+        self.misses = 0
+
+    @classmethod
+    def from_environment(cls) -> Optional["ResolvedTransformCache"]:
+        configured = os.environ.get("FUSEBOX_TRANSFORM_CACHE")
+        if configured and configured.lower() in ("off", "none", "0"):
+            return None
+        return cls(Path(configured) if configured else DEFAULT_CACHE_ROOT)
+
+    def key(self, cfg: Dict[str, Any], primary: Any, secondary: Any) -> str:
+        parts = {
+            "version": RESOLVER_VERSION,
+            "source": transform_source(cfg),
+            "primary": geometry_signature(primary),
+            "secondary": geometry_signature(secondary),
+        }
+        encoded = json.dumps(parts, sort_keys=True).encode()
+        return hashlib.blake2b(encoded, digest_size=20).hexdigest()
+
+    def load(self, key: str) -> Optional[sitk.Transform]:
+        try:
+            record = json.loads((self.root / f"{key}.json").read_text(encoding="utf-8"))
+            xform = sitk.ReadTransform(str(self.root / f"{key}.h5"))
+        except (OSError, ValueError, RuntimeError):
+            self.misses += 1
+            return None
+        # ReadTransform hands single transforms back wrapped in a composite
+        if (
+            isinstance(xform, sitk.CompositeTransform)
+            and record.get("transformName") != "CompositeTransform"
+            and xform.GetNumberOfTransforms() == 1
+        ):
+            xform = xform.GetNthTransform(0)
+        self.hits += 1
+        return xform
+
+    def store(self, key: str, xform: sitk.Transform, decision: Dict[str, Any]) -> None:
+        """Persist a resolved transform; failures only cost the cache entry."""
+        staging = self.root / f".{key}.{os.getpid()}.{threading.get_ident()}.h5"
+        record = {
+            "key": key,
+            "version": RESOLVER_VERSION,
+            "createdAt": datetime.now(timezone.utc).isoformat(),
+            "transformName": xform.GetName(),
+            "decision": decision,
+        }
+        try:
+            self.root.mkdir(parents=True, exist_ok=True)
+            sitk.WriteTransform(xform, str(staging))
+            os.replace(staging, self.root / f"{key}.h5")
+            # The record is written last: an entry without one is never loaded
+            (self.root / f"{key}.json").write_text(json.dumps(record, indent=2, default=str), encoding="utf-8")
+        except (OSError, RuntimeError) as exc:
+            print(f"🐟 FUSION: Failed to cache resolved transform {key}: {exc}", file=sys.stderr)
+            staging.unlink(missing_ok=True)
+
+    def audit(self, key: str) -> Optional[Dict[str, Any]]:
+        """The decision record stored with an entry."""
+        try:
+            return json.loads((self.root / f"{key}.json").read_text(encoding="utf-8"))
+        except (OSError, ValueError):
+            return None
+
+    def stats(self) -> Dict[str, Any]:
+        return {"root": str(self.root), "hits": self.hits, "misses": self.misses}
+
+
+_default_cache: Optional[ResolvedTransformCache] = None
+_default_loaded = False
+_default_lock = threading.Lock()
+
+
+def default_cache() -> Optional[ResolvedTransformCache]:
+    """Process-wide cache at the configured location (None when disabled)."""
+    global _default_cache, _default_loaded
+    with _default_lock:
+        if not _default_loaded:
+            _default_cache = ResolvedTransformCache.from_environment()
+            _default_loaded = True
+        return _default_cache
+
+
+class DisplacementFieldCache:
+    """Dense displacement fields keyed by transform source, primary geometry and shrink factor."""
+
+    def __init__(self, root: Optional[Path], budget_bytes: int):
+        self.root = root
+        self.budget_bytes = budget_bytes
+        self._memory: "OrderedDict[str, sitk.DisplacementFieldTransform]" = OrderedDict()
+        self._lock = threading.Lock()
+        self._building: Dict[str, threading.Lock] = {}
+        self.hits = 0
+        self.misses = 0
+
+    @classmethod
+    def from_environment(cls) -> "DisplacementFieldCache":
+        configured = os.environ.get("FUSEBOX_FIELD_CACHE")
+        budget = DEFAULT_FIELD_CACHE_MB * 1024 * 1024
+        if configured and configured.lower() in ("off", "none", "0", "memory"):
+            return cls(None, budget)
+        return cls(Path(configured) if configured else DEFAULT_FIELD_CACHE_ROOT, budget)
+
+    def key(self, cfg: Dict[str, Any], primary: Any, shrink: int) -> str:
+        parts = {
+            "version": RESOLVER_VERSION,
+            "source": transform_source(cfg),
+            "primary": geometry_signature(primary),
+            "shrink": int(shrink),
+        }
+        encoded = json.dumps(parts, sort_keys=True).encode()
+        return hashlib.blake2b(encoded, digest_size=20).hexdigest()
+
+    def _remember(self, key: str, xform: sitk.DisplacementFieldTransform) -> None:
+        with self._lock:
+            self._memory[key] = xform
+            self._memory.move_to_end(key)
+            while len(self._memory) > MAX_MEMORY_FIELDS:
+                self._memory.popitem(last=False)
+
+    def transform(self, key: str, build: Callable[[], sitk.Image]) -> Tuple[sitk.DisplacementFieldTransform, bool]:
+        """(field transform, cache hit); build() returns the float64 vector field on a miss.
+
+        Concurrent callers with the same key wait for one build instead of
+        composing the same field twice.
+        """
+        with self._lock:
+            building = self._building.setdefault(key, threading.Lock())
+        with building:
+            with self._lock:
+                cached = self._memory.get(key)
+                if cached is not None:
+                    self._memory.move_to_end(key)
+                    self.hits += 1
+                    return cached, True
+
+            path = self.root / f"{key}.mha" if self.root is not None else None
+            if path is not None and path.exists():
+                try:
+                    field = sitk.Cast(sitk.ReadImage(str(path)), sitk.sitkVectorFloat64)
+                    os.utime(path)  # LRU clock
+                    xform = sitk.DisplacementFieldTransform(field)
+                    self._remember(key, xform)
+                    with self._lock:
+                        self.hits += 1
+                    return xform, True
+                except RuntimeError as exc:
+                    print(f"🐟 FUSION: Discarding unreadable displacement field {key}: {exc}", file=sys.stderr)
+
+            field = build()
+            with self._lock:
+                self.misses += 1
+            if path is not None:
+                self._persist(key, path, field)
+            xform = sitk.DisplacementFieldTransform(field)  # takes the field's buffer
+            self._remember(key, xform)
+            return xform, False
+
+    def _persist(self, key: str, path: Path, field: sitk.Image) -> None:
+        staging = path.with_name(f".{key}.{os.getpid()}.{threading.get_ident()}.mha")
+        try:
+            path.parent.mkdir(parents=True, exist_ok=True)
+            sitk.WriteImage(sitk.Cast(field, sitk.sitkVectorFloat32), str(staging))
+            os.replace(staging, path)
+        except (OSError, RuntimeError) as exc:
+            print(f"🐟 FUSION: Failed to cache displacement field {key}: {exc}", file=sys.stderr)
+            staging.unlink(missing_ok=True)
+            return
+        self.evict(keep=key)
+
+    def evict(self, keep: Optional[str] = None) -> List[str]:
+        """Drop least-recently-used fields until the directory fits its budget."""
+        if self.root is None or not self.root.exists():
+            return []
+        entries = []
+        for path in self.root.glob("*.mha"):
+            if path.name.startswith("."):
+                continue
+            try:
+                st = path.stat()
+            except OSError:
+                continue
+            entries.append((st.st_mtime, path, st.st_size))
+        keep_path = self.root / f"{keep}.mha" if keep else None
+        evicted, total = evict_lru(entries, self.budget_bytes, lambda path: path.unlink(missing_ok=True), keep_path)
+        if evicted:
+            print(f"🐟 FUSION: Evicted {len(evicted)} displacement field(s), {total / 2**20:.0f} MB remain", file=sys.stderr)
+        return [path.stem for path in evicted]
+
+    def stats(self) -> Dict[str, Any]:
+        return {
+            "root": str(self.root) if self.root is not None else None,
+            "memoryEntries": len(self._memory),
+            "hits": self.hits,
+            "misses": self.misses,
+            "budgetBytes": self.budget_bytes,
+        }
+
+
+_default_field_cache: Optional[DisplacementFieldCache] = None
+
+
+def default_field_cache() -> DisplacementFieldCache:
+    """Process-wide displacement-field cache at the configured location."""
+    global _default_field_cache
+    with _default_lock:
+        if _default_field_cache is None:
+            _default_field_cache = DisplacementFieldCache.from_environment()
+        return _default_field_cache
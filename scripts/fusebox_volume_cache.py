@@ -0,0 +1,193 @@
+#!/usr/bin/env python3
+"""Content-addressed cache of fusebox volume resampling results.
+
+fusebox_resample_volume.py wrote a fresh directory with new UIDs on every run,
+even when the same primary/secondary/transform/interpolation/pixel type had
+been resampled before. Runs now compute a key from those inputs:
+
+  - primary and secondary file lists (path, size, mtime of every file)
+  - transform matrix, or the transform file's content digest, and its inversion flag
+  - the REG file's content digest and frame overrides (registrationFile)
+  - interpolation, output pixel type / layout options and the metadata that
+    ends up in the written tags
+
+A hit hard-links the stored DICOM files (copying across filesystems) into the
+requested outputDirectory and returns the stored summary, UIDs included.
+Entries are evicted least-recently-used once the cache exceeds its disk budget.
+
+Location: $FUSEBOX_VOLUME_CACHE (default <repo>/tmp/fusebox-volume-cache),
+budget: $FUSEBOX_VOLUME_CACHE_MB (default 10240). FUSEBOX_VOLUME_CACHE=off
+disables the cache.
+"""
+from __future__ import annotations
+
+import hashlib
+import json
+import os
+import shutil
+import sys
+from pathlib import Path
+from typing import Any, Dict, List, Optional, Sequence
+
+SCRIPT_DIR = Path(__file__).resolve().parent
+if str(SCRIPT_DIR) not in sys.path:
+    sys.path.insert(0, str(SCRIPT_DIR))
+
+from fusebox_cache_utils import evict_lru, file_digest  # noqa: E402
+
+DEFAULT_CACHE_ROOT = SCRIPT_DIR.parent / "tmp" / "fusebox-volume-cache"
+DEFAULT_CACHE_BUDGET_MB = int(os.environ.get("FUSEBOX_VOLUME_CACHE_MB", "10240"))
+
+# Bump when the resampler's output changes for identical inputs
+CACHE_VERSION = 1
+
+# Config keys that change the written volume; everything else (outputDirectory, writerThreads) does not
+OUTPUT_KEYS = ("interpolation", "scaleToUInt16", "multiFrame", "cropToSecondary", "denseField", "denseFieldShrink")
+
+MANIFEST_NAME = "manifest.json"
+
+
+def _files_digest(files: Sequence[str]) -> str:
+    digest = hashlib.blake2b(digest_size=16)
+    for path in files:
+        st = os.stat(path)
+        digest.update(f"{os.path.abspath(path)}\0{st.st_size}\0{st.st_mtime_ns}\n".encode())
+    return digest.hexdigest()
+
+
+def link_or_copy(src: Path, dst: Path) -> None:
+    try:
+        os.link(src, dst)
+    except OSError:
+        shutil.copy2(src, dst)
+
+
+def _tree_bytes(path: Path) -> int:
+    total = 0
+    for root, _, files in os.walk(path):
+        for name in files:
+            try:
+                total += os.stat(os.path.join(root, name)).st_size
+            except OSError:
+                pass
+    return total
+
+
+class VolumeResultCache:
+    """Directory-per-key store: <root>/<key>/{dicom/, manifest.json}."""
+
+    def __init__(self, root: Path, budget_bytes: int):
+        self.root = root
+        self.budget_bytes = budget_bytes
+
+    @classmethod
+    def from_environment(cls) -> Optional["VolumeResultCache"]:
+        configured = os.environ.get("FUSEBOX_VOLUME_CACHE")
+        if configured and configured.lower() in ("off", "none", "0"):
+            return None
+        root = Path(configured) if configured else DEFAULT_CACHE_ROOT
+        return cls(root, DEFAULT_CACHE_BUDGET_MB * 1024 * 1024)
+
+    def key(self, cfg: Dict[str, Any], primary_files: Sequence[str], secondary_files: Sequence[str]) -> str:
+        transform_file = cfg.get("transformFile")
+        registration_file = cfg.get("registrationFile")
+        parts = {
+            "version": CACHE_VERSION,
+            "primary": _files_digest(primary_files),
+            "secondary": _files_digest(secondary_files),
+            "transform": [float(v) for v in cfg.get("transform") or []],
+            "transformFile": file_digest(str(transform_file)) if transform_file else None,
+            "invertTransformFile": bool(cfg.get("invertTransformFile", True)) if transform_file else None,
+            "registrationFile": file_digest(str(registration_file)) if registration_file else None,
+            "frames": [cfg.get("fixedFrameOfReferenceUID"), cfg.get("movingFrameOfReferenceUID")] if registration_file else None,
+            "output": {key: cfg.get(key) for key in OUTPUT_KEYS},
+            "metadata": cfg.get("metadata", {}),
+        }
+        encoded = json.dumps(parts, sort_keys=True, default=str).encode()
+        return hashlib.blake2b(encoded, digest_size=20).hexdigest()
+
+    def lookup(self, key: str) -> Optional[Dict[str, Any]]:
+        entry = self.root / key
+        try:
+            summary = json.loads((entry / MANIFEST_NAME).read_text(encoding="utf-8"))
+        except (OSError, ValueError):
+            return None
+        if not all((entry / "dicom" / inst["fileName"]).exists() for inst in summary.get("instances", [])):
+            return None
+        os.utime(entry)  # LRU clock
+        return summary
+
+    def materialize(self, key: str, summary: Dict[str, Any], output_root: Path) -> Dict[str, Any]:
+        """Link a cached entry into output_root and rewrite its paths to point there."""
+        entry = self.root / key
+        dicom_dir = output_root / "dicom"
+        dicom_dir.mkdir(parents=True, exist_ok=True)
+        instances: List[Dict[str, Any]] = []
+        for inst in summary.get("instances", []):
+            target = dicom_dir / inst["fileName"]
+            if target.exists():
+                target.unlink()
+            link_or_copy(entry / "dicom" / inst["fileName"], target)
+            instances.append({**inst, "filePath": str(target)})
+
+        result = {
+            **summary,
+            "outputDirectory": str(dicom_dir),
+            "manifestPath": str(output_root / MANIFEST_NAME),
+            "instances": instances,
+            "cacheKey": key,
+            "cacheHit": True,
+        }
+        if summary.get("instanceLogPath"):
+            instance_log = output_root / "instances.jsonl"
+            instance_log.write_text("".join(json.dumps(inst) + "\n" for inst in instances), encoding="utf-8")
+            result["instanceLogPath"] = str(instance_log)
+        with (output_root / MANIFEST_NAME).open("w", encoding="utf-8") as f:
+            json.dump(result, f, indent=2)
+        return result
+
+    def store(self, key: str, summary: Dict[str, Any]) -> None:
+        """Link a finished run's files into the cache; failures only cost the cache entry."""
+        entry = self.root / key
+        staging = self.root / f".staging-{key}-{os.getpid()}"
+        try:
+            (staging / "dicom").mkdir(parents=True, exist_ok=True)
+            for inst in summary.get("instances", []):
+                link_or_copy(Path(inst["filePath"]), staging / "dicom" / inst["fileName"])
+            stored = {k: v for k, v in summary.items() if k not in ("cacheHit",)}
+            (staging / MANIFEST_NAME).write_text(json.dumps(stored), encoding="utf-8")
+            if entry.exists():
+                shutil.rmtree(entry, ignore_errors=True)
+            os.rename(staging, entry)  # atomic publish; a concurrent reader sees all or nothing
+        except OSError as exc:
+            print(f"🐟 FUSION: Failed to cache volume {key}: {exc}", file=sys.stderr)
+            shutil.rmtree(staging, ignore_errors=True)
+            return
+        self.evict(keep=key)
+
+    def evict(self, keep: Optional[str] = None) -> List[str]:
+        """Drop least-recently-used entries until the cache fits its budget."""
+        if not self.root.exists():
+            return []
+        entries = []
+        for path in self.root.iterdir():
+            if not path.is_dir() or path.name.startswith(".staging-"):
+                continue
+            try:
+                entries.append((path.stat().st_mtime, path, _tree_bytes(path)))
+            except OSError:
+                continue
+        keep_path = self.root / keep if keep else None
+        evicted, total = evict_lru(entries, self.budget_bytes, lambda path: shutil.rmtree(path, ignore_errors=True), keep_path)
+        if evicted:
+            print(f"🐟 FUSION: Evicted {len(evicted)} cached volume(s), {total / 2**20:.0f} MB remain", file=sys.stderr)
+        return [path.name for path in evicted]
+
+    def stats(self) -> Dict[str, Any]:
+        entries = [p for p in self.root.iterdir() if p.is_dir() and not p.name.startswith(".staging-")] if self.root.exists() else []
+        return {
+            "root": str(self.root),
+            "entries": len(entries),
+            "bytes": sum(_tree_bytes(p) for p in entries),
+            "budgetBytes": self.budget_bytes,
+        }
@@ -9,19 +9,42 @@ Usage: python scripts/fusion_dsc_test.py --study 20 --primary 54 --secondary 53
 
 If RTSTRUCT paths are omitted, it will attempt to discover them from the database.
 Same for REG; it will try to find the REG in the study.
+
+Batch mode re-checks many pairs in one run:
+
+       python scripts/fusion_dsc_test.py --batch pairs.csv --workers 8 \
+           --csv report.csv --json report.json
+
+pairs.csv has columns study,primary,secondary and optionally reg and rtstruct
+(';'-separated); a JSON list of the same objects also works. All DB lookups go
+over one connection and each series' headers are read once; studies and their
+four variants then run across a process pool. The report has one row per
+pair and variant with DSC summary and per-study timing.
 """
 
 import argparse
+import csv
 import json
-import math
 import os
 import re
 import sys
+import time
 from collections import defaultdict
+from concurrent.futures import FIRST_COMPLETED, ProcessPoolExecutor, wait
 from typing import Dict, List, Tuple, Optional
 
 import numpy as np
 import pydicom
+from scipy import ndimage
+
+SCRIPT_DIR = os.path.dirname(os.path.abspath(__file__))
+if SCRIPT_DIR not in sys.path:
+    sys.path.insert(0, SCRIPT_DIR)
+
+from dicom_header_index import default_index  # noqa: E402
+from dicom_reg_transform import matrix_candidates, read_registration  # noqa: E402
+from rtstruct_voxelizer import PackedMask, SliceGrid, voxelize  # noqa: E402
+from structure_mapping import map_structure  # noqa: E402
 
 
 def load_db_env_from_dotenv(dotenv_path: str = ".env") -> Optional[str]:
@@ -37,14 +60,28 @@ def load_db_env_from_dotenv(dotenv_path: str = ".env") -> Optional[str]:
     return url
 
 
+_CONNECTIONS: Dict[str, object] = {}
+
+
 def pg_query(conn_url: str, sql: str) -> List[Tuple]:
+    # One connection per URL for the whole run; batch mode issues hundreds of lookups
     import psycopg
-    rows: List[Tuple] = []
-    with psycopg.connect(conn_url) as conn:
-        with conn.cursor() as cur:
-            cur.execute(sql)
-            rows = cur.fetchall()
-    return rows
+    conn = _CONNECTIONS.get(conn_url)
+    if conn is None or conn.closed:
+        conn = psycopg.connect(conn_url, autocommit=True)
+        _CONNECTIONS[conn_url] = conn
+    with conn.cursor() as cur:
+        cur.execute(sql)
+        return cur.fetchall()
+
+
+def close_connections() -> None:
+    for conn in _CONNECTIONS.values():
+        try:
+            conn.close()
+        except Exception:
+            pass
+    _CONNECTIONS.clear()
 
 
 def find_series_filepaths(db_url: str, study_id: int, series_ids: List[int]) -> Dict[int, List[Dict]]:
@@ -152,25 +189,11 @@ def parse_rt_body(rt_path: str) -> Tuple[Dict[int, List[np.ndarray]], Dict[int,
 
 def parse_registration_matrix(reg_path: str) -> Optional[np.ndarray]:
     try:
-        ds = pydicom.dcmread(reg_path)
+        ds = read_registration(reg_path)
     except Exception as e:
         print(f"Failed to read REG file {reg_path}: {e}")
         return None
-    # Try RegistrationSequence -> MatrixRegistrationSequence -> MatrixSequence -> FrameOfReferenceTransformationMatrix
-    mats: List[np.ndarray] = []
-    try:
-        if hasattr(ds, 'RegistrationSequence'):
-            for reg in ds.RegistrationSequence:
-                if hasattr(reg, 'MatrixRegistrationSequence'):
-                    for mreg in reg.MatrixRegistrationSequence:
-                        if hasattr(mreg, 'MatrixSequence'):
-                            for m in mreg.MatrixSequence:
-                                if hasattr(m, 'FrameOfReferenceTransformationMatrix'):
-                                    vals = list(m.FrameOfReferenceTransformationMatrix)
-                                    if len(vals) == 16:
-                                        mats.append(np.array(vals, dtype=float).reshape(4, 4))
-    except Exception:
-        pass
+    mats = matrix_candidates(ds)
     if not mats:
         print("No 4x4 transforms found in REG; cannot continue.")
         return None
@@ -192,137 +215,392 @@ def plane_normal_from_iop(iop: List[float]) -> np.ndarray:
     return normalize_vec(n)
 
 
-def world_to_pixel(P: np.ndarray, ipp: np.ndarray, iop: List[float], pixsp: List[float]) -> Tuple[float, float]:
-    # P is (3,), ipp is (3,)
-    r = np.array([iop[0], iop[1], iop[2]], dtype=float)
-    c = np.array([iop[3], iop[4], iop[5]], dtype=float)
-    d = P - ipp
-    i = np.dot(d, r) / float(pixsp[1] if len(pixsp) > 1 else pixsp[0])  # row spacing is typically second? DICOM PixelSpacing is [row, col]
-    j = np.dot(d, c) / float(pixsp[0])
-    # Convention: i -> rows (y), j -> cols (x)
-    return float(j), float(i)
-
-
-def rasterize_polygon(mask: np.ndarray, poly_px: np.ndarray):
-    # Simple even-odd rule ray casting fill for a single polygon ring (no holes)
-    # poly_px: (N, 2) array in pixel coords (x=j, y=i)
-    h, w = mask.shape
-    xs = poly_px[:, 0]
-    ys = poly_px[:, 1]
-    minx = max(int(np.floor(xs.min() - 1)), 0)
-    maxx = min(int(np.ceil(xs.max() + 1)), w - 1)
-    miny = max(int(np.floor(ys.min() - 1)), 0)
-    maxy = min(int(np.ceil(ys.max() + 1)), h - 1)
-    if minx >= w or miny >= h or maxx < 0 or maxy < 0:
-        return
-    n = len(poly_px)
-    for yy in range(miny, maxy + 1):
-        xints = []
-        y = yy + 0.5
-        for i in range(n):
-            x1, y1 = poly_px[i]
-            x2, y2 = poly_px[(i + 1) % n]
-            if (y1 <= y < y2) or (y2 <= y < y1):
-                # Compute intersection x coordinate
-                t = (y - y1) / (y2 - y1)
-                x = x1 + t * (x2 - x1)
-                xints.append(x)
-        xints.sort()
-        for k in range(0, len(xints), 2):
-            if k + 1 >= len(xints):
-                break
-            xa = int(max(math.floor(xints[k]), 0))
-            xb = int(min(math.ceil(xints[k + 1]), w - 1))
-            if xb >= xa:
-                mask[yy, xa:xb + 1] = True
+def compute_dsc_per_slice(mask_a: PackedMask, mask_b: PackedMask) -> Dict[int, float]:
+    """Per-slice DSC of two masks on the same grid; slices empty in both are skipped."""
+    idx, dsc = slice_dsc(mask_a, mask_b)
+    return dict(zip(idx.tolist(), dsc.tolist()))
+
+
+def slice_dsc(mask_a: PackedMask, mask_b: PackedMask) -> Tuple[np.ndarray, np.ndarray]:
+    """(slice indices, DSC) for slices non-empty in either mask, from packed popcounts."""
+    a = mask_a.slice_counts()
+    b = mask_b.slice_counts()
+    inter = mask_a.intersection_counts(mask_b)
+    idx = np.nonzero(a + b)[0]
+    return idx, 2.0 * inter[idx] / (a[idx] + b[idx])
+
+
+def grid_spacing(grid: SliceGrid) -> Tuple[float, float, float]:
+    """(slice, row, column) spacing in mm; slice gaps use the median plane step."""
+    steps = np.diff(grid.positions)
+    dz = float(np.median(steps)) if len(steps) else 1.0
+    return (dz, grid.pixel_spacing[0], grid.pixel_spacing[1])
+
+
+def joint_box(mask_a: PackedMask, mask_b: PackedMask) -> Optional[Tuple[slice, slice, slice]]:
+    """Bounding box of both masks in voxels, found on the packed bytes."""
+    bits = mask_a.bits | mask_b.bits
+    slices = np.nonzero(bits.any(axis=(1, 2)))[0]
+    if not len(slices):
+        return None
+    rows = np.nonzero(bits.any(axis=(0, 2)))[0]
+    byte_cols = np.nonzero(bits.any(axis=(0, 1)))[0]
+    col_start = int(byte_cols[0]) * 8
+    col_stop = min(int(byte_cols[-1]) * 8 + 8, mask_a.shape[2])
+    return (slice(int(slices[0]), int(slices[-1]) + 1), slice(int(rows[0]), int(rows[-1]) + 1), slice(col_start, col_stop))
 
 
-def build_body_masks_for_series(rt_contours: List[np.ndarray], img_paths: List[str]) -> Tuple[Dict[int, List[np.ndarray]], Dict[int, Dict]]:
+def _surface(mask: np.ndarray) -> np.ndarray:
+    return mask & ~ndimage.binary_erosion(mask, structure=ndimage.generate_binary_structure(3, 1))
+
+
+def surface_metrics(mask_a: PackedMask, mask_b: PackedMask, grid: SliceGrid) -> Dict[str, Optional[float]]:
+    """3D Dice, HD95, mean surface distance and volumes of two masks on grid.
+
+    Works on the joint bounding box (padded by one voxel so edge voxels count
+    as surface); distances come from one anisotropic distance_transform_edt per
+    surface. Surface metrics are None when either mask is empty.
     """
-    Group BODY contours per slice index by matching to the nearest CT slice using plane value along normal.
-    Returns a dictionary mapping sliceIndex -> list of polygons (world coords), and a metadata dict per slice.
+    spacing = grid_spacing(grid)
+    voxel_cc = float(np.prod(spacing)) / 1000.0
+    count_a = mask_a.count()
+    count_b = mask_b.count()
+    inter = int(mask_a.intersection_counts(mask_b).sum())
+    metrics: Dict[str, Optional[float]] = {
+        'dice': 2.0 * inter / (count_a + count_b) if count_a + count_b else 1.0,
+        'hd95_mm': None,
+        'msd_mm': None,
+        'volume_a_cc': count_a * voxel_cc,
+        'volume_b_cc': count_b * voxel_cc,
+        'volume_diff_cc': (count_b - count_a) * voxel_cc,
+        'volume_diff_pct': 100.0 * (count_b - count_a) / count_a if count_a else None,
+    }
+    box = joint_box(mask_a, mask_b)
+    if box is None or not count_a or not count_b:
+        return metrics
+
+    def crop(mask: PackedMask) -> np.ndarray:
+        block = mask.bits[box[0], box[1]]
+        cols = np.unpackbits(block, axis=-1, count=mask.shape[2])[:, :, box[2]]
+        return np.pad(cols.astype(bool), 1)
+
+    surf_a = _surface(crop(mask_a))
+    surf_b = _surface(crop(mask_b))
+    dist_to_a = ndimage.distance_transform_edt(~surf_a, sampling=spacing)
+    dist_to_b = ndimage.distance_transform_edt(~surf_b, sampling=spacing)
+    distances = np.concatenate([dist_to_b[surf_a], dist_to_a[surf_b]])
+    metrics['hd95_mm'] = float(np.percentile(distances, 95))
+    metrics['msd_mm'] = float(distances.mean())
+    return metrics
+
+
+BODY_NAMES = ('BODY', 'EXTERNAL', 'BODY CONTOUR', 'BODYCONTOUR')
+PASS_DSC = 0.98
+VARIANT_NAMES = ('M', 'MT', 'MINV', 'MINVT')
+REPORT_FIELDS = [
+    'study', 'primary', 'secondary', 'variant', 'status', 'error',
+    'mapping', 'slices', 'passed_slices', 'pass_fraction', 'min_dsc', 'avg_dsc',
+    'dice', 'hd95_mm', 'msd_mm', 'volume_a_cc', 'volume_b_cc', 'volume_diff_cc', 'volume_diff_pct',
+    'prepare_seconds', 'variant_seconds', 'study_seconds',
+]
+
+
+def slice_cvals(headers: List[Dict]) -> List[float]:
+    n = plane_normal_from_iop(headers[0]['iop'])
+    return sorted(float(np.dot(n, np.array(h['ipp'], dtype=float))) for h in headers)
+
+
+def assign_body_contours(rt_paths: List[str], prim_headers: List[Dict], sec_headers: List[Dict]) -> Tuple[List[np.ndarray], List[np.ndarray]]:
+    """BODY contours from the RTSTRUCTs, attached to the primary or secondary series by plane proximity."""
+    prim_body: List[np.ndarray] = []
+    sec_body: List[np.ndarray] = []
+    prim_cvals = slice_cvals(prim_headers)
+    sec_cvals = slice_cvals(sec_headers)
+    for rtp in rt_paths:
+        try:
+            contours_by_roi, roi_names, _ = parse_rt_body(rtp)
+        except Exception as e:
+            print(f'Failed to parse RTSTRUCT {rtp}: {e}', file=sys.stderr)
+            continue
+        candidates = [rn for rn, name in roi_names.items() if name and name.strip().upper() in BODY_NAMES]
+        for rn in candidates:
+            cnts = contours_by_roi.get(rn, [])
+            if not cnts:
+                continue
+            # Heuristic: compare the median contour Z against the planes of each series
+            avg = float(np.median([float(np.mean(pts[:, 2])) for pts in cnts]))
+            dprim = min((abs(v - avg) for v in prim_cvals), default=float('inf'))
+            dsec = min((abs(v - avg) for v in sec_cvals), default=float('inf'))
+            (prim_body if dprim <= dsec else sec_body).extend(cnts)
+    return prim_body, sec_body
+
+
+def registration_variants(baseM: np.ndarray) -> Dict[str, np.ndarray]:
+    Mt = baseM.T
+    try:
+        Minv = np.linalg.inv(baseM)
+    except Exception:
+        Minv = baseM
+    try:
+        MinvT = np.linalg.inv(Mt)
+    except Exception:
+        MinvT = Mt
+    return {'M': baseM, 'MT': Mt, 'MINV': Minv, 'MINVT': MinvT}
+
+
+def evaluate_variant(prim_mask: PackedMask, prim_grid: SliceGrid, sec_contours: List[np.ndarray], M: np.ndarray,
+                     sec_grid: Optional[SliceGrid] = None, threads: Optional[int] = None) -> Dict[str, float]:
+    """Map secondary BODY onto the primary grid (re-slicing oblique results) and compare.
+
+    Reports the per-slice DSC summary (pass criterion) plus 3D surface metrics.
+    """
+    mapped = map_structure(sec_contours, M, prim_grid, sec_grid, with_contours=False, threads=threads)
+    sec_mask = mapped['mask']
+    metrics = surface_metrics(prim_mask, sec_mask, prim_grid)
+    _, ds = slice_dsc(prim_mask, sec_mask)
+    if not len(ds):
+        return {'slices': 0, 'passed_slices': 0, 'pass_fraction': 0.0, 'min_dsc': 0.0, 'avg_dsc': 0.0, 'mapping': mapped['method'], **metrics}
+    passed = int(np.count_nonzero(ds >= PASS_DSC))
+    return {
+        'mapping': mapped['method'],
+        'slices': len(ds),
+        'passed_slices': passed,
+        'pass_fraction': passed / len(ds),
+        'min_dsc': float(ds.min()),
+        'avg_dsc': float(ds.mean()),
+        **metrics,
+    }
+
+
+# --- batch mode -------------------------------------------------------------
+# The parent process does every DB lookup over one connection and reads each
+# series' headers once; workers get headers and paths in their task and never
+# touch the database. Each study is prepared once (RTSTRUCT parse, primary
+# voxelization) and its four variants then run as separate pool tasks.
+
+def load_pairs(path: str) -> List[Dict]:
+    """Study/series pairs from JSON (list of objects) or CSV (study,primary,secondary[,reg][,rtstruct]).
+
+    JSON pairs written by dicom_study_indexer.py --pairs carry primaryFiles/secondaryFiles
+    and UIDs instead of database ids; those skip the database lookups.
     """
-    # Read orientation from first image to get normal
-    if not img_paths:
-        return {}, {}
-    ds0 = pydicom.dcmread(img_paths[0], stop_before_pixels=True)
-    iop = [float(x) for x in ds0.ImageOrientationPatient]
-    n = plane_normal_from_iop(iop)
-    # Build slice list with plane constants
-    slices = []
-    for idx, p in enumerate(img_paths):
-        dsi = pydicom.dcmread(p, stop_before_pixels=True)
-        ipp = np.array([float(x) for x in dsi.ImagePositionPatient])
-        pixsp = [float(dsi.PixelSpacing[0]), float(dsi.PixelSpacing[1])]
-        rows = int(dsi.Rows)
-        cols = int(dsi.Columns)
-        cval = float(np.dot(n, ipp))
-        slices.append({
-            'index': idx,
-            'path': p,
-            'ipp': ipp,
-            'iop': iop,
-            'pixsp': pixsp,
-            'rows': rows,
-            'cols': cols,
-            'cval': cval,
+    if path.lower().endswith('.json'):
+        with open(path) as f:
+            raw = json.load(f)
+    else:
+        with open(path, newline='') as f:
+            raw = list(csv.DictReader(f))
+    pairs = []
+    for entry in raw:
+        rtstruct = entry.get('rtstruct') or []
+        if isinstance(rtstruct, str):
+            rtstruct = [p for p in rtstruct.split(';') if p]
+        indexed = bool(entry.get('primaryFiles'))
+        pairs.append({
+            'study': entry['study'] if indexed else int(entry['study']),
+            'primary': entry['primary'] if indexed else int(entry['primary']),
+            'secondary': entry['secondary'] if indexed else int(entry['secondary']),
+            'reg': entry.get('reg') or None,
+            'rtstruct': rtstruct,
+            'primaryFiles': entry.get('primaryFiles') or None,
+            'secondaryFiles': entry.get('secondaryFiles') or None,
         })
-    slices.sort(key=lambda s: s['cval'])
+    return pairs
+
+
+def discover_batch(db_url: str, pairs: List[Dict]) -> List[Dict]:
+    """Resolve files and headers for every pair; pairs that cannot run carry an error."""
+    db_pairs = [p for p in pairs if not p.get('primaryFiles')]
+    series_ids = sorted({p['primary'] for p in db_pairs} | {p['secondary'] for p in db_pairs})
+    # find_series_filepaths only filters on series ids; one query covers every pair
+    series_files = find_series_filepaths(db_url, db_pairs[0]['study'], series_ids) if series_ids else {}
+    for pair in pairs:
+        for key, files in (('primary', pair.get('primaryFiles')), ('secondary', pair.get('secondaryFiles'))):
+            if files:
+                series_files[pair[key]] = [{'file_path': path} for path in files]
+    study_files: Dict[int, Tuple[List[str], Optional[str]]] = {}
+    header_cache: Dict[int, List[Dict]] = {}
+    index = default_index()
+
+    def headers_for(series_id: int) -> List[Dict]:
+        if series_id not in header_cache:
+            paths = [rec['file_path'] for rec in series_files.get(series_id, [])]
+            header_cache[series_id] = index.headers(paths) if paths else []
+        return header_cache[series_id]
+
+    tasks = []
+    for pair in pairs:
+        task = {'study': pair['study'], 'primary': pair['primary'], 'secondary': pair['secondary'], 'error': None}
+        tasks.append(task)
+        rt_paths, reg_path = pair['rtstruct'], pair['reg']
+        if (not rt_paths or not reg_path) and not pair.get('primaryFiles'):
+            if pair['study'] not in study_files:
+                study_files[pair['study']] = find_rtstruct_and_reg_paths(db_url, pair['study'])
+            rts, reg = study_files[pair['study']]
+            rt_paths = rt_paths or rts
+            reg_path = reg_path or reg
+        task['rtPaths'] = rt_paths
+        task['regPath'] = reg_path
+        if not rt_paths:
+            task['error'] = 'No RTSTRUCT files found'
+        elif any('::' in path for path in [reg_path or ''] + list(rt_paths) + list(pair.get('primaryFiles') or [])):
+            task['error'] = 'Pair references zip members; extract it with dicom_study_indexer.materialize first'
+        elif not reg_path or not os.path.exists(reg_path):
+            task['error'] = f'Registration file not found: {reg_path}'
+        else:
+            try:
+                task['primaryHeaders'] = headers_for(pair['primary'])
+                task['secondaryHeaders'] = headers_for(pair['secondary'])
+            except Exception as e:
+                task['error'] = f'Failed to read series headers: {e}'
+            else:
+                if not task['primaryHeaders'] or not task['secondaryHeaders']:
+                    task['error'] = 'Missing CT images for primary or secondary series'
+    return tasks
+
+
+def prepare_study(task: Dict) -> Dict:
+    """Worker: BODY contours, primary mask and the variant matrices for one pair."""
+    started = time.perf_counter()
+    prim_body, sec_body = assign_body_contours(task['rtPaths'], task['primaryHeaders'], task['secondaryHeaders'])
+    if not prim_body or not sec_body:
+        raise ValueError('Could not locate BODY contours for both primary and secondary series')
+    baseM = parse_registration_matrix(task['regPath'])
+    if baseM is None:
+        raise ValueError(f"No usable transform in {task['regPath']}")
+    grid = SliceGrid.from_headers(task['primaryHeaders'])
+    return {
+        'grid': grid,
+        'secondaryGrid': SliceGrid.from_headers(task['secondaryHeaders']),
+        'primaryMask': voxelize(prim_body, grid, threads=1),
+        'secondaryContours': sec_body,
+        'variants': registration_variants(baseM),
+        'seconds': time.perf_counter() - started,
+    }
 
-    # Group contours by nearest slice cval
-    world_polys_by_slice: Dict[int, List[np.ndarray]] = defaultdict(list)
-    for pts in rt_contours:
-        if pts.size == 0:
-            continue
-        cval_cont = float(np.dot(n, pts[0]))
-        best = min(slices, key=lambda s: abs(s['cval'] - cval_cont))
-        world_polys_by_slice[best['index']].append(pts)
-    meta_by_slice = {s['index']: s for s in slices}
-    return world_polys_by_slice, meta_by_slice
-
-
-def compute_dsc_per_slice(primary_world_polys: Dict[int, List[np.ndarray]],
-                          secondary_world_polys: Dict[int, List[np.ndarray]],
-                          meta_by_slice: Dict[int, Dict]) -> Dict[int, float]:
-    dsc_by_slice: Dict[int, float] = {}
-    for idx, meta in meta_by_slice.items():
-        rows = meta['rows']
-        cols = meta['cols']
-        ipp = meta['ipp']
-        iop = meta['iop']
-        pixsp = meta['pixsp']
-        maskA = np.zeros((rows, cols), dtype=bool)
-        maskB = np.zeros((rows, cols), dtype=bool)
-        for pts in primary_world_polys.get(idx, []):
-            poly_px = np.array([world_to_pixel(P, ipp, iop, pixsp) for P in pts])
-            rasterize_polygon(maskA, poly_px)
-        for pts in secondary_world_polys.get(idx, []):
-            poly_px = np.array([world_to_pixel(P, ipp, iop, pixsp) for P in pts])
-            rasterize_polygon(maskB, poly_px)
-        a = maskA.sum()
-        b = maskB.sum()
-        if a == 0 and b == 0:
-            continue
-        inter = np.logical_and(maskA, maskB).sum()
-        dsc = 2.0 * inter / (a + b) if (a + b) > 0 else 1.0
-        dsc_by_slice[idx] = dsc
-    return dsc_by_slice
+
+def run_variant(prepared: Dict, name: str) -> Dict:
+    """Worker: one variant of one prepared study."""
+    started = time.perf_counter()
+    result = evaluate_variant(prepared['primaryMask'], prepared['grid'], prepared['secondaryContours'], prepared['variants'][name],
+                              sec_grid=prepared['secondaryGrid'], threads=1)
+    result['seconds'] = time.perf_counter() - started
+    return result
+
+
+def run_batch(tasks: List[Dict], workers: int) -> List[Dict]:
+    """Prepare studies and evaluate their variants across one process pool."""
+    reports = {id(t): {'task': t, 'started': time.perf_counter(), 'variants': {}} for t in tasks}
+    runnable = [t for t in tasks if not t['error']]
+    with ProcessPoolExecutor(max_workers=max(1, workers)) as pool:
+        pending = {pool.submit(prepare_study, t): ('prepare', t, None) for t in runnable}
+        while pending:
+            done, _ = wait(list(pending), return_when=FIRST_COMPLETED)
+            for future in done:
+                stage, task, name = pending.pop(future)
+                report = reports[id(task)]
+                try:
+                    value = future.result()
+                except Exception as e:
+                    report['error'] = str(e)
+                    report['finished'] = time.perf_counter()
+                    continue
+                if stage == 'prepare':
+                    report['prepareSeconds'] = value['seconds']
+                    for variant in VARIANT_NAMES:
+                        pending[pool.submit(run_variant, value, variant)] = ('variant', task, variant)
+                else:
+                    report['variants'][name] = value
+                    report['finished'] = time.perf_counter()
+                    print(f"Study {task['study']} ({task['primary']}->{task['secondary']}) {name}: "
+                          f"avg DSC {value['avg_dsc']:.3f}", file=sys.stderr)
+
+    results = []
+    for task in tasks:
+        report = reports[id(task)]
+        error = task['error'] or report.get('error')
+        variants = [dict(report['variants'][n], variant=n) for n in VARIANT_NAMES if n in report['variants']]
+        best = max(variants, key=lambda v: v['avg_dsc'])['variant'] if variants else None
+        results.append({
+            'study': task['study'],
+            'primary': task['primary'],
+            'secondary': task['secondary'],
+            'status': 'error' if error else 'ok',
+            'error': error,
+            'bestVariant': best,
+            'prepareSeconds': report.get('prepareSeconds'),
+            'variantSeconds': sum(v['seconds'] for v in variants),
+            'studySeconds': report['finished'] - report['started'] if 'finished' in report else 0.0,
+            'variants': variants,
+        })
+    return results
+
+
+def write_reports(results: List[Dict], csv_path: Optional[str], json_path: Optional[str], total_seconds: float, workers: int) -> None:
+    rows = []
+    for r in results:
+        base = {
+            'study': r['study'], 'primary': r['primary'], 'secondary': r['secondary'],
+            'status': r['status'], 'error': r['error'] or '',
+            'prepare_seconds': r['prepareSeconds'], 'study_seconds': r['studySeconds'],
+        }
+        if not r['variants']:
+            rows.append(base)
+        for variant in r['variants']:
+            metrics = {k: value for k, value in variant.items() if k != 'seconds'}
+            rows.append({**base, **metrics, 'variant_seconds': variant['seconds']})
+    if csv_path or not json_path:
+        out = open(csv_path, 'w', newline='') if csv_path else sys.stdout
+        try:
+            writer = csv.DictWriter(out, fieldnames=REPORT_FIELDS, extrasaction='ignore')
+            writer.writeheader()
+            writer.writerows(rows)
+        finally:
+            if csv_path:
+                out.close()
+    if json_path:
+        with open(json_path, 'w') as f:
+            json.dump({'workers': workers, 'totalSeconds': total_seconds, 'studies': results}, f, indent=2)
+
+
+def main_batch(args, db_url: str) -> None:
+    started = time.perf_counter()
+    pairs = load_pairs(args.batch)
+    try:
+        tasks = discover_batch(db_url, pairs)
+    finally:
+        close_connections()
+    results = run_batch(tasks, args.workers)
+    total = time.perf_counter() - started
+    write_reports(results, args.csv, args.json, total, args.workers)
+    failed = sum(1 for r in results if r['status'] != 'ok')
+    print(f'{len(results)} pair(s) in {total:.1f}s, {failed} failed', file=sys.stderr)
 
 
 def main():
     ap = argparse.ArgumentParser()
-    ap.add_argument('--study', type=int, required=True)
-    ap.add_argument('--primary', type=int, required=True, help='Primary CT series id')
-    ap.add_argument('--secondary', type=int, required=True, help='Secondary CT series id')
+    ap.add_argument('--study', type=int)
+    ap.add_argument('--primary', type=int, help='Primary CT series id')
+    ap.add_argument('--secondary', type=int, help='Secondary CT series id')
     ap.add_argument('--rtstruct', action='append', default=[], help='RTSTRUCT DICOM path(s)')
     ap.add_argument('--reg', help='Registration DICOM path')
+    ap.add_argument('--batch', help='CSV or JSON list of study/primary/secondary pairs (optional reg, rtstruct)')
+    ap.add_argument('--workers', type=int, default=os.cpu_count() or 1, help='Batch worker processes')
+    ap.add_argument('--csv', help='Batch report CSV path (default: stdout)')
+    ap.add_argument('--json', help='Batch report JSON path')
     args = ap.parse_args()
+    if not args.batch and (args.study is None or args.primary is None or args.secondary is None):
+        ap.error('--study, --primary and --secondary are required without --batch')
 
     db_url = os.environ.get('DATABASE_URL') or load_db_env_from_dotenv()
     if not db_url:
         print('DATABASE_URL not set and .env missing')
         sys.exit(1)
 
+    if args.batch:
+        main_batch(args, db_url)
+        return
+
     # Discover RTSTRUCT and REG if not provided
     rt_paths = args.rtstruct
     reg_path = args.reg
@@ -342,6 +620,7 @@ def main():
 
     # Build mapping from series id to sorted image file paths
     series_files = find_series_filepaths(db_url, args.study, [args.primary, args.secondary])
+    close_connections()
     prim_paths = [rec['file_path'] for rec in series_files.get(args.primary, [])]
     sec_paths = [rec['file_path'] for rec in series_files.get(args.secondary, [])]
     if not prim_paths or not sec_paths:
@@ -349,111 +628,32 @@ def main():
         sys.exit(1)
 
     # Parse RTSTRUCTs and find BODY per series
-    body_by_series: Dict[int, List[np.ndarray]] = {args.primary: [], args.secondary: []}
-    for rtp in rt_paths:
-        try:
-            contours_by_roi, roi_names, _ = parse_rt_body(rtp)
-        except Exception as e:
-            print(f'Failed to parse RTSTRUCT {rtp}: {e}')
-            continue
-        # Find BODY-like ROI numbers
-        candidates = [rn for rn, name in roi_names.items() if name and name.strip().upper() in ('BODY', 'EXTERNAL', 'BODY CONTOUR', 'BODYCONTOUR')]
-        if not candidates:
-            continue
-        # Heuristic: assign to a series by checking proximity of Z to the series planes
-        # Compute cval list for each series
-        def slice_cvals(paths: List[str]) -> List[float]:
-            d0 = pydicom.dcmread(paths[0], stop_before_pixels=True)
-            iop = [float(x) for x in d0.ImageOrientationPatient]
-            n = plane_normal_from_iop(iop)
-            vals = []
-            for p in paths:
-                di = pydicom.dcmread(p, stop_before_pixels=True)
-                ipp = np.array([float(x) for x in di.ImagePositionPatient])
-                vals.append(float(np.dot(n, ipp)))
-            return sorted(vals)
-        prim_cvals = slice_cvals(prim_paths)
-        sec_cvals = slice_cvals(sec_paths)
-        # Collect all BODY contours points and average plane value to decide attachment
-        for rn in candidates:
-            cnts = contours_by_roi.get(rn, [])
-            if not cnts:
-                continue
-            cvals = []
-            for pts in cnts:
-                cvals.append(float(np.mean(pts[:, 2])))  # rough
-            if not cvals:
-                continue
-            avg = float(np.median(cvals))
-            # Compare distance to median plane of each series
-            def median_dist(vals: List[float], a: float) -> float:
-                if not vals:
-                    return float('inf')
-                return float(min(abs(v - a) for v in vals))
-            dprim = median_dist(prim_cvals, avg)
-            dsec = median_dist(sec_cvals, avg)
-            target_sid = args.primary if dprim <= dsec else args.secondary
-            body_by_series[target_sid].extend(cnts)
-
-    if not body_by_series[args.primary] or not body_by_series[args.secondary]:
+    prim_headers = default_index().headers(prim_paths)
+    sec_headers = default_index().headers(sec_paths)
+    prim_body, sec_body = assign_body_contours(rt_paths, prim_headers, sec_headers)
+    if not prim_body or not sec_body:
         print('Could not locate BODY contours for both primary and secondary series')
         sys.exit(1)
 
-    # Build per-slice grouping of BODY for primary
-    prim_world, prim_meta = build_body_masks_for_series(body_by_series[args.primary], prim_paths)
+    # Voxelize primary BODY on the primary grid
+    prim_grid = SliceGrid.from_headers(prim_headers)
+    prim_mask = voxelize(prim_body, prim_grid)
 
     # Parse registration transform
     baseM = parse_registration_matrix(reg_path)
     if baseM is None:
         sys.exit(1)
 
-    # Candidate variants
-    def flat(m: np.ndarray) -> np.ndarray:
-        return m.reshape(4, 4)
-    Mt = baseM.T
-    try:
-        Minv = np.linalg.inv(baseM)
-    except Exception:
-        Minv = baseM
-    try:
-        MinvT = np.linalg.inv(Mt)
-    except Exception:
-        MinvT = Mt
-    variants = {
-        'M': baseM,
-        'MT': Mt,
-        'MINV': Minv,
-        'MINVT': MinvT,
-    }
-
-    # For each variant, transform secondary BODY polygons into primary world, group per slice, compute DSC
-    results = []
-    for name, M in variants.items():
-        sec_transformed = []
-        for pts in body_by_series[args.secondary]:
-            ones = np.ones((pts.shape[0], 1), dtype=float)
-            hom = np.hstack([pts, ones])
-            out = hom @ M.T
-            sec_transformed.append(out[:, :3])
-        sec_world_by_slice, _ = build_body_masks_for_series(sec_transformed, prim_paths)
-        dsc_by_slice = compute_dsc_per_slice(prim_world, sec_world_by_slice, prim_meta)
-        if not dsc_by_slice:
-            passed = 0
-            frac = 0.0
-            dmin = 0.0
-            davg = 0.0
-        else:
-            ds = list(dsc_by_slice.values())
-            passed = sum(1 for d in ds if d >= 0.98)
-            frac = passed / len(ds)
-            dmin = float(np.min(ds))
-            davg = float(np.mean(ds))
-        results.append((name, passed, frac, dmin, davg))
+    # For each variant, transform secondary BODY polygons into primary world and compute DSC
+    def fmt(value: Optional[float]) -> str:
+        return 'n/a' if value is None else f'{value:.3f}'
 
-    # Report summary
-    print("Variant, passed_slices, pass_fraction, min_dsc, avg_dsc")
-    for name, passed, frac, dmin, davg in results:
-        print(f"{name}, {passed}, {frac:.3f}, {dmin:.3f}, {davg:.3f}")
+    print("Variant, passed_slices, pass_fraction, min_dsc, avg_dsc, dice_3d, hd95_mm, msd_mm, volume_diff_cc")
+    sec_grid = SliceGrid.from_headers(sec_headers)
+    for name, M in registration_variants(baseM).items():
+        r = evaluate_variant(prim_mask, prim_grid, sec_body, M, sec_grid=sec_grid)
+        print(f"{name}, {r['passed_slices']}, {r['pass_fraction']:.3f}, {r['min_dsc']:.3f}, {r['avg_dsc']:.3f}, "
+              f"{r['dice']:.3f}, {fmt(r['hd95_mm'])}, {fmt(r['msd_mm'])}, {r['volume_diff_cc']:.1f}")
 
 
 if __name__ == '__main__':
@@ -463,4 +663,3 @@ if __name__ == '__main__':
         print('Installing psycopg for database access...')
         os.system(sys.executable + ' -m pip install --quiet psycopg[binary] > /dev/null 2>&1')
     main()
-
@@ -0,0 +1,156 @@
+#!/usr/bin/env python3
+"""Map RTSTRUCT contours from a secondary series onto a fused primary grid.
+
+fusion_dsc_test.py homogenised and multiplied each contour by the registration
+matrix on its own, then assigned every polygon to a slice with a linear scan.
+Here a whole structure moves at once:
+
+  - all contour points are concatenated (with offsets) and transformed in one
+    matmul, then split back into contours
+  - contours still planar in the primary frame are grouped by slice with
+    np.searchsorted over the sorted plane positions (rtstruct_voxelizer)
+  - contours that became oblique (tilted across more than `tolerance` mm of the
+    primary normal, half a slice step by default) are re-sliced: the structure
+    is voxelized on its own secondary grid, resampled through the transform
+    onto the primary grid and, if asked, traced back into contours on every
+    primary plane with cv2.findContours
+
+    from rtstruct_voxelizer import SliceGrid
+    from structure_mapping import map_structure
+
+    mapped = map_structure(contours, M, primary_grid, secondary_grid)
+    mapped["mask"]        # PackedMask on the primary grid
+    mapped["contours"]    # {primary slice index: [(N, 3) world contours]}
+    mapped["method"]      # 'planar' | 'resliced'
+
+M is a 4x4 secondary-world -> primary-world matrix applied as x' = M[:3, :3] x + M[:3, 3].
+"""
+from __future__ import annotations
+
+import sys
+from pathlib import Path
+from typing import Any, Dict, List, Optional, Sequence
+
+import numpy as np
+import SimpleITK as sitk
+
+SCRIPT_DIR = Path(__file__).resolve().parent
+if str(SCRIPT_DIR) not in sys.path:
+    sys.path.insert(0, str(SCRIPT_DIR))
+
+from rtstruct_voxelizer import PackedMask, SliceGrid, contours_by_slice, cv2, voxelize  # noqa: E402
+
+
+def transform_contours(contours: Sequence[np.ndarray], M: np.ndarray) -> List[np.ndarray]:
+    """Apply M to every contour with a single matmul over the concatenated points."""
+    contours = [np.asarray(c, dtype=float).reshape(-1, 3) for c in contours]
+    if not contours:
+        return []
+    offsets = np.cumsum([len(c) for c in contours])[:-1]
+    M = np.asarray(M, dtype=float).reshape(4, 4)
+    moved = np.concatenate(contours) @ M[:3, :3].T + M[:3, 3]
+    return np.split(moved, offsets)
+
+
+def plane_spread(contours: Sequence[np.ndarray], grid: SliceGrid) -> np.ndarray:
+    """Per contour, how far (mm) its points spread along the grid normal."""
+    contours = [c for c in contours if len(c)]
+    if not contours:
+        return np.zeros(0)
+    starts = np.concatenate([[0], np.cumsum([len(c) for c in contours])[:-1]])
+    planes = np.concatenate(contours) @ grid.normal
+    return np.maximum.reduceat(planes, starts) - np.minimum.reduceat(planes, starts)
+
+
+def grid_image(grid: SliceGrid, array: Optional[np.ndarray] = None) -> sitk.Image:
+    """SimpleITK image with grid geometry; slice spacing is the median plane step."""
+    steps = np.diff(grid.positions)
+    image = sitk.GetImageFromArray(array if array is not None else np.zeros(grid.shape, dtype=np.uint8))
+    image.SetOrigin([float(v) for v in grid.origin])
+    image.SetSpacing([grid.pixel_spacing[1], grid.pixel_spacing[0], float(np.median(steps)) if len(steps) else 1.0])
+    image.SetDirection([float(v) for v in np.column_stack([grid.row_dir, grid.col_dir, grid.normal]).ravel()])
+    return image
+
+
+def reslice_mask(
+    contours: Sequence[np.ndarray],
+    M: np.ndarray,
+    primary_grid: SliceGrid,
+    secondary_grid: SliceGrid,
+    threads: Optional[int] = None,
+) -> PackedMask:
+    """Voxelize on the secondary grid, resample through M onto the primary grid."""
+    source = voxelize(contours, secondary_grid, threads=threads)
+    moving = grid_image(secondary_grid, source.unpack().astype(np.float32))
+    # Resample maps output (primary) points to input (secondary) points: the inverse of M
+    inverse = np.linalg.inv(np.asarray(M, dtype=float).reshape(4, 4))
+    transform = sitk.AffineTransform(3)
+    transform.SetMatrix([float(v) for v in inverse[:3, :3].ravel()])
+    transform.SetTranslation([float(v) for v in inverse[:3, 3]])
+    resampled = sitk.Resample(moving, grid_image(primary_grid), transform, sitk.sitkLinear, 0.0, sitk.sitkFloat32)
+    # Linear interpolation of the 0/1 mask, cut at 0.5, keeps the surface smooth
+    inside = sitk.GetArrayViewFromImage(resampled) >= 0.5
+    return PackedMask(np.packbits(inside, axis=-1), primary_grid.shape)
+
+
+def mask_to_contours(mask: PackedMask, grid: SliceGrid) -> Dict[int, List[np.ndarray]]:
+    """Trace every slice of mask into world-space contours (outer rings and holes)."""
+    if cv2 is None:
+        raise ImportError("tracing contours needs opencv-python (cv2)")
+    traced: Dict[int, List[np.ndarray]] = {}
+    for index in np.nonzero(mask.slice_counts())[0]:
+        found, _ = cv2.findContours(mask.slice(int(index)).astype(np.uint8), cv2.RETR_CCOMP, cv2.CHAIN_APPROX_SIMPLE)
+        rings = []
+        for ring in found:
+            points = ring.reshape(-1, 2).astype(float)
+            if len(points) < 3:
+                continue
+            pixel = np.column_stack([points, np.full(len(points), index)])
+            rings.append(grid.pixel_to_world(pixel))
+        if rings:
+            traced[int(index)] = rings
+    return traced
+
+
+def map_structure(
+    contours: Sequence[np.ndarray],
+    M: np.ndarray,
+    primary_grid: SliceGrid,
+    secondary_grid: Optional[SliceGrid] = None,
+    tolerance: Optional[float] = None,
+    with_contours: bool = True,
+    threads: Optional[int] = None,
+) -> Dict[str, Any]:
+    """Move a structure onto primary_grid; see the module docstring for the result."""
+    moved = transform_contours(contours, M)
+    if tolerance is None:
+        steps = np.diff(primary_grid.positions)
+        tolerance = 0.5 * float(np.median(steps)) if len(steps) else 0.0
+    spread = plane_spread(moved, primary_grid)
+    oblique = bool(len(spread)) and float(spread.max()) > tolerance
+
+    if oblique and secondary_grid is not None:
+        mask = reslice_mask(contours, M, primary_grid, secondary_grid, threads=threads)
+        return {
+            "method": "resliced",
+            "maxPlaneSpread": float(spread.max()),
+            "mask": mask,
+            "contours": mask_to_contours(mask, primary_grid) if with_contours else None,
+        }
+
+    if oblique:
+        print(
+            f"🐟 FUSION: Contours tilt up to {spread.max():.1f} mm across primary planes; "
+            "pass the secondary grid to re-slice them",
+            file=sys.stderr,
+        )
+    grouped = contours_by_slice(moved, primary_grid)
+    return {
+        "method": "planar",
+        "maxPlaneSpread": float(spread.max()) if len(spread) else 0.0,
+        "mask": voxelize(moved, primary_grid, threads=threads),
+        "contours": {
+            index: [primary_grid.pixel_to_world(np.column_stack([ring, np.full(len(ring), index)])) for ring in rings]
+            for index, rings in grouped.items()
+        } if with_contours else None,
+    }
@@ -1,5 +1,5 @@
 import SimpleITK as sitk
-from typing import List, Tuple
+from typing import Any, Dict, List, Optional, Tuple
 
 def has_flatten() -> bool:
     """Return True if CompositeTransform exposes FlattenTransformQueue."""
@@ -55,11 +55,13 @@ def _in_bounds(bounds: Tuple[Tuple[float, float, float], Tuple[float, float, flo
     return (xmin <= p[0] <= xmax) and (ymin <= p[1] <= ymax) and (zmin <= p[2] <= zmax)
 
 
-def pick_moving_to_fixed(fixed: sitk.Image, moving: sitk.Image, xform: sitk.Transform) -> sitk.Transform:
+def pick_moving_to_fixed(fixed: sitk.Image, moving: sitk.Image, xform: sitk.Transform,
+                         decision: Optional[Dict[str, Any]] = None) -> sitk.Transform:
     """Choose the orientation (xform or its inverse) that maps moving→fixed using a simple in-bounds probe.
 
     This mirrors the harness: prefer a transform that lands representative moving points inside the
-    fixed image bounds. If both fail, return the original transform.
+    fixed image bounds. If both fail, return the original transform. When a decision dict is given,
+    the probe scores and the chosen orientation are recorded in it.
     """
     bounds_fixed = _image_bounds(fixed)
 
@@ -89,6 +91,13 @@ def pick_moving_to_fixed(fixed: sitk.Image, moving: sitk.Image, xform: sitk.Tran
     s_fwd = score(xform)
     s_inv = score(inv) if inv is not None else -1
 
+    if decision is not None:
+        decision.update({
+            "probes": len(probes),
+            "forwardScore": s_fwd,
+            "inverseScore": s_inv if inv is not None else None,
+            "choice": "inverse" if s_inv > s_fwd else "forward",
+        })
     if s_inv > s_fwd:
         return inv
     return xform
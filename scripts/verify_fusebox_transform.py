@@ -5,6 +5,9 @@ The script resamples a slice using both the raw 4x4 affine found in the
 registration DICOM and the `.h5` produced by `dicom_reg_to_h5`. It asserts that
 both approaches yield matching voxel data and that the helper's affine matches
 Eclipse's (fixed→moving) convention within a configurable tolerance.
+
+Without --helper the transform file comes from the in-process converter
+(dicom_reg_transform), which then gets the same parity check.
 """
 from __future__ import annotations
 
@@ -25,6 +28,7 @@ import SimpleITK as sitk
 SCRIPT_DIR = Path(__file__).resolve().parent
 sys.path.insert(0, str(SCRIPT_DIR))
 from fusebox_resample import run_from_config  # type: ignore  # noqa: E402
+from dicom_reg_transform import registration_matrix, registration_transform  # type: ignore  # noqa: E402
 
 DEFAULT_PRIMARY_DIR = Path(
     "storage/patients/POSITRON_07/"
@@ -59,25 +63,8 @@ def read_frame_of_reference(dicom_path: str) -> str:
 
 
 def load_registration_matrix(reg_path: Path) -> Sequence[float]:
-    dataset = pydicom.dcmread(str(reg_path))
-    candidates: List[Sequence[float]] = []
-    if hasattr(dataset, "RegistrationSequence"):
-        for registration in dataset.RegistrationSequence:
-            matrix_seq = getattr(registration, "MatrixRegistrationSequence", [])
-            for matrix_reg in matrix_seq:
-                matrices = getattr(matrix_reg, "MatrixSequence", [])
-                for mat in matrices:
-                    raw = [float(v) for v in mat.FrameOfReferenceTransformationMatrix]
-                    candidates.append(raw)
-    if not candidates:
-        raise ValueError(f"No transformation matrices found in {reg_path}")
-
     # Prefer the last non-identity candidate to mirror server/REG parser logic.
-    for values in reversed(candidates):
-        mat = np.array(values, dtype=float).reshape(4, 4)
-        if not np.allclose(mat, np.eye(4)):
-            return values
-    return candidates[-1]
+    return [float(v) for v in registration_matrix(str(reg_path)).ravel()]
 
 
 def ensure_transform_file(helper: Path | None,
@@ -88,7 +75,11 @@ def ensure_transform_file(helper: Path | None,
     if output_path.exists():
         return
     if helper is None:
-        raise RuntimeError("dicom_reg_to_h5 binary path required to build transform")
+        transform, kind = registration_transform(str(reg_path), fixed_for, moving_for)
+        if kind != "affine":
+            raise RuntimeError("Deformable registrations have no single affine to verify")
+        sitk.WriteTransform(transform, str(output_path))
+        return
     cmd = [
         str(helper),
         "--input", str(reg_path),
@@ -223,8 +214,8 @@ def build_parser() -> argparse.ArgumentParser:
         default=str(DEFAULT_REGISTRATION),
         help=f"Path to the REG DICOM (default: {DEFAULT_REGISTRATION})",
     )
-    parser.add_argument("--transform-file", help="Existing helper output (.h5). If omitted the helper is executed")
-    parser.add_argument("--helper", default=os.environ.get("DICOM_REG_CONVERTER"), help="Path to dicom_reg_to_h5 binary")
+    parser.add_argument("--transform-file", help="Existing helper output (.h5). If omitted the helper (or the in-process converter) is executed")
+    parser.add_argument("--helper", default=os.environ.get("DICOM_REG_CONVERTER"), help="Path to dicom_reg_to_h5 binary (default: convert in-process)")
     parser.add_argument("--slice-index", type=int, default=0, help="Slice index to validate (default: 0)")
     parser.add_argument("--interpolation", default="linear", choices=["linear", "nearest"], help="Interpolation used for resampling")
     parser.add_argument("--rotation-tolerance", type=float, default=1e-3, help="Maximum allowed rotation element difference")
@@ -0,0 +1,168 @@
+#!/usr/bin/env python3
+"""
+Load benchmark for the gunicorn-served AI gateway
+
+Starts gunicorn once per worker count, hammers one endpoint with concurrent
+clients for a fixed duration and reports throughput and latency, e.g.:
+
+    python bench_load.py --workers 1,2,4 --concurrency 8 --duration 20
+    python bench_load.py --endpoint /sam/segment_2d --payload click.json --preload sam
+
+The default request is a synthetic geometric-propagation /predict (no model
+weights needed), which is enough to see how throughput scales with workers.
+Results are printed as a table and, with --output, written as JSON.
+"""
+
+import os
+import sys
+import json
+import time
+import signal
+import argparse
+import subprocess
+import urllib.request
+import urllib.error
+from concurrent.futures import ThreadPoolExecutor
+from pathlib import Path
+
+import numpy as np
+
+GATEWAY_DIR = Path(__file__).resolve().parent
+
+
+def synthetic_geometric_payload(size: int = 256) -> bytes:
+    """One reference slice with a disc, one shifted target slice"""
+    yy, xx = np.mgrid[:size, :size]
+    disc = ((yy - size / 2) ** 2 + (xx - size / 2) ** 2) < (size / 6) ** 2
+    ref = np.where(disc, 200.0, 0.0) + np.random.default_rng(0).normal(0, 5, (size, size))
+    target = np.roll(ref, (3, -2), axis=(0, 1))
+    return json.dumps({
+        'reference_slices': [{
+            'slice_data': ref.flatten().round(1).tolist(),
+            'mask': disc.astype(np.uint8).flatten().tolist(),
+            'position': 0.0
+        }],
+        'target_slice_data': target.flatten().round(1).tolist(),
+        'target_slice_position': 1.0,
+        'image_shape': [size, size]
+    }).encode()
+
+
+def wait_for_health(base_url: str, timeout: float) -> bool:
+    deadline = time.time() + timeout
+    while time.time() < deadline:
+        try:
+            with urllib.request.urlopen(f"{base_url}/health", timeout=2) as response:
+                if response.status == 200:
+                    return True
+        except (urllib.error.URLError, ConnectionError, OSError):
+            pass
+        time.sleep(0.5)
+    return False
+
+
+def post(url: str, body: bytes) -> float:
+    started = time.perf_counter()
+    request = urllib.request.Request(url, data=body, headers={'Content-Type': 'application/json'})
+    with urllib.request.urlopen(request, timeout=600) as response:
+        response.read()
+        if response.status != 200:
+            raise RuntimeError(f"HTTP {response.status}")
+    return time.perf_counter() - started
+
+
+def run_load(url: str, body: bytes, concurrency: int, duration: float, warmup: int):
+    for _ in range(warmup):
+        post(url, body)
+
+    deadline = time.time() + duration
+
+    def client():
+        latencies, errors = [], 0
+        while time.time() < deadline:
+            try:
+                latencies.append(post(url, body))
+            except Exception:
+                errors += 1
+        return latencies, errors
+
+    started = time.time()
+    with ThreadPoolExecutor(max_workers=concurrency) as pool:
+        results = list(pool.map(lambda _: client(), range(concurrency)))
+    elapsed = time.time() - started
+
+    latencies = np.array([lat for lats, _ in results for lat in lats])
+    errors = sum(err for _, err in results)
+    return {
+        'requests': int(latencies.size),
+        'errors': int(errors),
+        'seconds': round(elapsed, 2),
+        'throughput_rps': round(latencies.size / elapsed, 2) if elapsed > 0 else 0.0,
+        'p50_ms': round(float(np.percentile(latencies, 50)) * 1000, 1) if latencies.size else None,
+        'p95_ms': round(float(np.percentile(latencies, 95)) * 1000, 1) if latencies.size else None
+    }
+
+
+def main():
+    parser = argparse.ArgumentParser(description='AI gateway throughput vs. gunicorn worker count')
+    parser.add_argument('--workers', type=str, default='1,2,4', help='Comma-separated worker counts')
+    parser.add_argument('--concurrency', type=int, default=8, help='Concurrent clients')
+    parser.add_argument('--duration', type=float, default=15.0, help='Seconds of load per worker count')
+    parser.add_argument('--warmup', type=int, default=3, help='Requests before measuring (loads lazy engines)')
+    parser.add_argument('--port', type=int, default=5190, help='Port for the benchmark server')
+    parser.add_argument('--endpoint', type=str, default='/geometric/predict', help='Endpoint to POST to')
+    parser.add_argument('--payload', type=str, default=None, help='JSON request body file (default: synthetic)')
+    parser.add_argument('--preload', type=str, default='geometric', help='Engines to preload before fork')
+    parser.add_argument('--torch-threads', type=int, default=None, help='Torch threads per worker')
+    parser.add_argument('--output', type=str, default=None, help='Write results JSON here')
+    args = parser.parse_args()
+
+    body = Path(args.payload).read_bytes() if args.payload else synthetic_geometric_payload()
+    base_url = f"http://127.0.0.1:{args.port}"
+    results = []
+
+    for workers in [int(w) for w in args.workers.split(',') if w.strip()]:
+        env = dict(os.environ)
+        env.update({
+            'AI_GATEWAY_BIND': f"127.0.0.1:{args.port}",
+            'AI_GATEWAY_WORKERS': str(workers),
+            'AI_GATEWAY_PRELOAD': args.preload,
+        })
+        if args.torch_threads is not None:
+            env['AI_GATEWAY_TORCH_THREADS'] = str(args.torch_threads)
+
+        server = subprocess.Popen(
+            [sys.executable, '-m', 'gunicorn', '-c', 'gunicorn.conf.py', '--access-logfile', '/dev/null', 'wsgi:application'],
+            cwd=GATEWAY_DIR, env=env
+        )
+        try:
+            if not wait_for_health(base_url, timeout=300):
+                print(f"❌ Gateway with {workers} worker(s) did not become healthy", file=sys.stderr)
+                continue
+            result = run_load(base_url + args.endpoint, body, args.concurrency, args.duration, args.warmup)
+            result['workers'] = workers
+            results.append(result)
+            print(f"workers={workers}: {result['throughput_rps']} req/s, "
+                  f"p50 {result['p50_ms']} ms, p95 {result['p95_ms']} ms, errors {result['errors']}",
+                  file=sys.stderr)
+        finally:
+            server.send_signal(signal.SIGTERM)
+            try:
+                server.wait(timeout=90)
+            except subprocess.TimeoutExpired:
+                server.kill()
+
+    if results:
+        base = results[0]['throughput_rps'] / results[0]['workers'] if results[0]['throughput_rps'] else None
+        print(f"\n{'workers':>8} {'req/s':>9} {'p50 ms':>9} {'p95 ms':>9} {'efficiency':>10}")
+        for r in results:
+            scaling = f"{r['throughput_rps'] / (base * r['workers']):.2f}" if base else '-'
+            print(f"{r['workers']:>8} {r['throughput_rps']:>9} {r['p50_ms']!s:>9} {r['p95_ms']!s:>9} {scaling:>10}")
+
+    if args.output:
+        with open(args.output, 'w') as f:
+            json.dump({'endpoint': args.endpoint, 'concurrency': args.concurrency, 'results': results}, f, indent=2)
+
+
+if __name__ == '__main__':
+    main()
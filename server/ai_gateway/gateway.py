@@ -0,0 +1,664 @@
+#!/usr/bin/env python3
+"""
+AI Gateway - one process hosting every segmentation engine
+
+SuperSeg, SegVol, nnInteractive, MedSAM, SAM, Mem3D, Mem3D-SAM and the fast /
+geometric propagation services each used to run as their own Flask process,
+each with its own torch runtime. The gateway imports the same service modules
+into one process and mounts their existing routes under a per-engine prefix:
+
+    /sam/segment            -> server/sam/sam_service.py        /segment
+    /mem3d/predict          -> server/mem3d/mem3d_service.py    /predict
+    /geometric/predict_multi -> server/mem3d/geometric_propagation_service.py ...
+
+Engines load lazily on their first request, unload after an idle period and
+are evicted least-recently-used first to stay under a global RAM budget.
+Volumes uploaded to POST /volumes are shared by id across all engines
+(see volume_cache.py).
+
+Gateway routes:
+    GET    /health                  engines, memory budget, volume cache
+    GET    /engines                 engine states
+    POST   /engines/<name>/load     load now (optionally {"pin": true})
+    POST   /engines/<name>/unload   unload now
+    POST   /volumes                 upload a volume, returns {"volume_id": ...}
+    GET    /volumes/<id>            volume metadata
+    DELETE /volumes/<id>            drop a volume
+
+The Node side only needs its service URLs pointed at the prefixes, e.g.
+SAM_SERVICE_URL=http://127.0.0.1:5100/sam, MEM3D_SERVICE_URL=http://127.0.0.1:5100/mem3d.
+"""
+
+import os
+import sys
+import gc
+import json
+import time
+import logging
+import threading
+import importlib.util
+from pathlib import Path
+from typing import Any, Callable, Dict, List, Optional
+
+from flask import Flask, request, jsonify
+from flask_cors import CORS
+from werkzeug.wsgi import ClosingIterator
+
+GATEWAY_DIR = Path(__file__).resolve().parent
+SERVER_DIR = GATEWAY_DIR.parent
+
+# Engines import volume_cache by this name, so the gateway and every engine
+# share the same module (and the same cache)
+if str(GATEWAY_DIR) not in sys.path:
+    sys.path.insert(0, str(GATEWAY_DIR))
+
+from volume_cache import shared_volumes, parse_volume_upload  # noqa: E402
+
+logging.basicConfig(
+    level=logging.INFO,
+    format='%(asctime)s - %(name)s - %(levelname)s - %(message)s'
+)
+logger = logging.getLogger('ai_gateway')
+
+DEFAULT_IDLE_TIMEOUT = float(os.environ.get('AI_GATEWAY_IDLE_TIMEOUT', '900'))
+DEFAULT_MEMORY_BUDGET_MB = int(os.environ.get('AI_GATEWAY_MEMORY_BUDGET_MB', '8192'))
+REAPER_INTERVAL = float(os.environ.get('AI_GATEWAY_REAPER_INTERVAL', '30'))
+
+
+# ============================================================================
+# Engine loaders
+# ============================================================================
+# Each loader does what the service's own __main__ block does after import.
+
+def _load_superseg(module, options):
+    module.load_model(options.get('model_path'))
+
+
+def _load_segvol(module, options):
+    module.initialize_model(model_path=options.get('model_path'), device_name=options['device'])
+
+
+def _load_nninteractive(module, options):
+    module.device = options['device']
+    module.model = module.NNInteractiveModel(device_name=options['device'])
+    module.model.load_model()
+
+
+def _load_medsam(module, options):
+    segmenter = module.MedSAMSegmenter(device=options['device'])
+    if not segmenter.load_model():
+        raise RuntimeError("Failed to load MedSAM model")
+    module.model = segmenter
+
+
+def _load_sam(module, options):
+    module.load_sam_model(
+        options.get('model_type', 'vit_b'),
+        options.get('checkpoint'),
+        pool_size=int(options.get('pool_size', module.DEFAULT_POOL_SIZE))
+    )
+
+
+def _load_mem3d(module, options):
+    module.initialize_model(model_path=options.get('model_path'), device_name=options['device'])
+
+
+def _load_mem3d_sam(module, options):
+    if not options.get('model_path'):
+        raise RuntimeError("mem3d-sam needs options.model_path (SAM/MedSAM checkpoint)")
+    module.device = module.torch.device(options['device'])
+    module.sam_model = module.MedSAMPredictor(
+        options['model_path'],
+        options['device'],
+        pool_size=int(options.get('pool_size', module.DEFAULT_POOL_SIZE))
+    )
+
+
+def _unload_geometric(module):
+    module.spectrum_cache.clear()
+
+
+ENGINE_REGISTRY: Dict[str, Dict[str, Any]] = {
+    'superseg': {
+        'path': SERVER_DIR / 'superseg' / 'superseg_service.py',
+        'load': _load_superseg,
+        'globals': ['model'],
+        'memory_mb': 200,
+    },
+    'segvol': {
+        'path': SERVER_DIR / 'segvol' / 'segvol_service.py',
+        'load': _load_segvol,
+        'globals': ['segvol_model'],
+        'memory_mb': 2500,
+    },
+    'nninteractive': {
+        'path': SERVER_DIR / 'nninteractive' / 'nninteractive_service.py',
+        'load': _load_nninteractive,
+        'globals': ['model'],
+        'memory_mb': 1500,
+    },
+    'medsam': {
+        'path': SERVER_DIR / 'medsam' / 'medsam_service.py',
+        'load': _load_medsam,
+        'globals': ['model'],
+        'memory_mb': 800,
+    },
+    'sam': {
+        'path': SERVER_DIR / 'sam' / 'sam_service.py',
+        'load': _load_sam,
+        'globals': ['sam_model', 'sam_predictors'],
+        'memory_mb': 800,
+    },
+    'mem3d': {
+        'path': SERVER_DIR / 'mem3d' / 'mem3d_service.py',
+        'load': _load_mem3d,
+        'globals': ['predictor'],
+        'memory_mb': 600,
+    },
+    'mem3d-sam': {
+        'path': SERVER_DIR / 'mem3d' / 'sam_service.py',
+        'load': _load_mem3d_sam,
+        'globals': ['sam_model'],
+        'memory_mb': 800,
+    },
+    'fast': {
+        'path': SERVER_DIR / 'mem3d' / 'fast_propagation_service.py',
+        'memory_mb': 50,
+    },
+    'geometric': {
+        'path': SERVER_DIR / 'mem3d' / 'geometric_propagation_service.py',
+        'unload': _unload_geometric,
+        'memory_mb': 150,
+    },
+}
+
+
+class EngineUnavailable(Exception):
+    """Engine could not be loaded (load error or RAM budget exhausted)"""
+
+
+def current_rss_bytes() -> Optional[int]:
+    """Resident set size of this process, or None where /proc is unavailable"""
+    try:
+        with open('/proc/self/statm') as f:
+            return int(f.read().split()[1]) * os.sysconf('SC_PAGE_SIZE')
+    except (OSError, ValueError, IndexError):
+        return None
+
+
+def release_accelerator_memory():
+    """Return cached allocator blocks after an engine's tensors are gone"""
+    torch = sys.modules.get('torch')
+    if torch is None:
+        return
+    try:
+        if torch.cuda.is_available():
+            torch.cuda.empty_cache()
+        if hasattr(torch, 'mps') and torch.backends.mps.is_available():
+            torch.mps.empty_cache()
+    except Exception as e:
+        logger.debug(f"Accelerator cache release failed: {e}")
+
+
+# ============================================================================
+# Engine lifecycle
+# ============================================================================
+
+class Engine:
+    """One service module, loaded on demand into the gateway process"""
+
+    def __init__(self, name: str, spec: Dict[str, Any], options: Dict[str, Any],
+                 idle_timeout: float, pinned: bool = False):
+        self.name = name
+        self.path = Path(spec['path'])
+        self.loader: Optional[Callable] = spec.get('load')
+        self.unloader: Optional[Callable] = spec.get('unload')
+        self.model_globals: List[str] = spec.get('globals', [])
+        self.estimated_bytes = int(spec.get('memory_mb', 0)) * 1024 * 1024
+        self.options = options
+        self.idle_timeout = idle_timeout
+        self.pinned = pinned
+
+        self.module = None
+        self.app = None
+        self.state = 'unloaded'
+        self.error: Optional[str] = None
+        self.memory_bytes = 0
+        self.last_used = 0.0
+        self.in_flight = 0
+        self.loads = 0
+        self.requests = 0
+        self.lock = threading.RLock()
+
+    @property
+    def module_name(self) -> str:
+        return f"ai_engine_{self.name.replace('-', '_')}"
+
+    def _import(self):
+        service_dir = str(self.path.parent)
+        if service_dir not in sys.path:
+            sys.path.insert(0, service_dir)
+        spec = importlib.util.spec_from_file_location(self.module_name, self.path)
+        module = importlib.util.module_from_spec(spec)
+        # Flask resolves the app's root path through sys.modules
+        sys.modules[self.module_name] = module
+        try:
+            spec.loader.exec_module(module)
+        except Exception:
+            sys.modules.pop(self.module_name, None)
+            raise
+        return module
+
+    def load(self):
+        """Import the service module and load its model (caller holds self.lock)"""
+        if self.state == 'loaded':
+            return
+        self.state = 'loading'
+        rss_before = current_rss_bytes()
+        started = time.time()
+        logger.info(f"⏳ Loading engine '{self.name}' from {self.path}")
+        try:
+            module = self._import()
+            if self.loader is not None:
+                self.loader(module, self.options)
+        except Exception as e:
+            sys.modules.pop(self.module_name, None)
+            self.state = 'failed'
+            self.error = str(e)
+            logger.error(f"❌ Engine '{self.name}' failed to load: {e}")
+            gc.collect()
+            raise EngineUnavailable(f"Engine '{self.name}' failed to load: {e}") from e
+
+        rss_after = current_rss_bytes()
+        measured = (rss_after - rss_before) if rss_before is not None and rss_after is not None else 0
+        self.memory_bytes = max(measured, self.estimated_bytes)
+        self.module = module
+        self.app = module.app
+        self.state = 'loaded'
+        self.error = None
+        self.loads += 1
+        self.last_used = time.time()
+        logger.info(
+            f"✅ Engine '{self.name}' loaded in {time.time() - started:.1f}s "
+            f"(~{self.memory_bytes / 1e6:.0f} MB)"
+        )
+
+    def unload(self) -> bool:
+        """Drop the module and its model; False if requests are still running"""
+        with self.lock:
+            if self.state != 'loaded' or self.in_flight > 0:
+                return False
+            module = self.module
+            if self.unloader is not None:
+                try:
+                    self.unloader(module)
+                except Exception as e:
+                    logger.warning(f"⚠️ Unload hook for '{self.name}' failed: {e}")
+            for name in self.model_globals:
+                setattr(module, name, None)
+            sys.modules.pop(self.module_name, None)
+            self.module = None
+            self.app = None
+            self.state = 'unloaded'
+            freed = self.memory_bytes
+            self.memory_bytes = 0
+
+        del module
+        gc.collect()
+        release_accelerator_memory()
+        logger.info(f"💤 Engine '{self.name}' unloaded (~{freed / 1e6:.0f} MB released)")
+        return True
+
+    def release(self):
+        with self.lock:
+            self.in_flight -= 1
+            self.last_used = time.time()
+
+    def is_idle(self, now: float) -> bool:
+        return (
+            self.state == 'loaded'
+            and not self.pinned
+            and self.in_flight == 0
+            and self.idle_timeout > 0
+            and now - self.last_used > self.idle_timeout
+        )
+
+    def describe(self) -> Dict[str, Any]:
+        return {
+            'state': self.state,
+            'error': self.error,
+            'pinned': self.pinned,
+            'memory_mb': round(self.memory_bytes / (1024 * 1024), 1),
+            'in_flight': self.in_flight,
+            'idle_seconds': round(time.time() - self.last_used, 1) if self.last_used else None,
+            'idle_timeout': self.idle_timeout,
+            'loads': self.loads,
+            'requests': self.requests
+        }
+
+
+class EngineRegistry:
+    """All engines plus the RAM budget and the idle reaper"""
+
+    def __init__(self, config: Optional[Dict[str, Any]] = None):
+        config = config or {}
+        self.memory_budget_bytes = int(config.get('memory_budget_mb', DEFAULT_MEMORY_BUDGET_MB)) * 1024 * 1024
+        default_device = config.get('device', 'cpu')
+        default_idle = float(config.get('idle_timeout', DEFAULT_IDLE_TIMEOUT))
+
+        self.engines: Dict[str, Engine] = {}
+        overrides = config.get('engines', {})
+        enabled = config.get('enabled')
+        for name, spec in ENGINE_REGISTRY.items():
+            engine_config = overrides.get(name, {})
+            if enabled is not None and name not in enabled:
+                continue
+            if engine_config.get('enabled', True) is False:
+                continue
+            spec = dict(spec)
+            if 'memory_mb' in engine_config:
+                spec['memory_mb'] = engine_config['memory_mb']
+            options = {'device': default_device, **engine_config.get('options', {})}
+            self.engines[name] = Engine(
+                name, spec, options,
+                idle_timeout=float(engine_config.get('idle_timeout', default_idle)),
+                pinned=bool(engine_config.get('pinned', False))
+            )
+
+        # Loads are serialized: two models loading at once would blow the budget
+        self._load_lock = threading.Lock()
+        self._reaper: Optional[threading.Thread] = None
+        self._stop = threading.Event()
+
+    def get(self, name: str) -> Optional[Engine]:
+        return self.engines.get(name)
+
+    def used_bytes(self) -> int:
+        return sum(e.memory_bytes for e in self.engines.values() if e.state == 'loaded')
+
+    def _make_room(self, engine: Engine):
+        """Evict idle engines, least recently used first, until the engine fits"""
+        needed = engine.estimated_bytes
+        candidates = sorted(
+            (e for e in self.engines.values()
+             if e is not engine and e.state == 'loaded' and not e.pinned),
+            key=lambda e: e.last_used
+        )
+        for candidate in candidates:
+            if self.used_bytes() + needed <= self.memory_budget_bytes:
+                break
+            # Never block on another engine's lock from inside a load
+            if not candidate.lock.acquire(blocking=False):
+                continue
+            try:
+                if candidate.in_flight == 0:
+                    logger.info(f"♻️ Evicting '{candidate.name}' to make room for '{engine.name}'")
+                    candidate.unload()
+            finally:
+                candidate.lock.release()
+
+        if self.used_bytes() + needed > self.memory_budget_bytes:
+            raise EngineUnavailable(
+                f"RAM budget exhausted: '{engine.name}' needs ~{needed / 1e6:.0f} MB, "
+                f"{self.used_bytes() / 1e6:.0f} of {self.memory_budget_bytes / 1e6:.0f} MB in use by busy or pinned engines"
+            )
+
+    def acquire(self, engine: Engine):
+        """Load the engine if needed and mark one request in flight"""
+        with engine.lock:
+            if engine.state == 'loaded':
+                engine.in_flight += 1
+                engine.requests += 1
+                return engine.app
+
+        with self._load_lock:
+            with engine.lock:
+                if engine.state != 'loaded':
+                    self._make_room(engine)
+                    engine.load()
+                engine.in_flight += 1
+                engine.requests += 1
+                return engine.app
+
+    def load(self, name: str, pin: bool = False):
+        engine = self.engines[name]
+        self.acquire(engine)
+        engine.release()
+        if pin:
+            engine.pinned = True
+
+    def reap_idle(self) -> List[str]:
+        now = time.time()
+        unloaded = []
+        for engine in list(self.engines.values()):
+            if engine.is_idle(now) and engine.unload():
+                unloaded.append(engine.name)
+        return unloaded
+
+    def start_reaper(self, interval: float = REAPER_INTERVAL):
+        if self._reaper is not None:
+            return
+
+        def run():
+            while not self._stop.wait(interval):
+                try:
+                    for name in self.reap_idle():
+                        logger.info(f"⏱️ Engine '{name}' was idle, unloaded")
+                except Exception as e:
+                    logger.error(f"Idle reaper error: {e}")
+
+        self._reaper = threading.Thread(target=run, name='ai-gateway-reaper', daemon=True)
+        self._reaper.start()
+
+    def stop_reaper(self):
+        self._stop.set()
+
+    def shutdown(self, timeout: float = 30.0) -> bool:
+        """Stop the reaper and wait for in-flight requests to drain; False on timeout"""
+        self.stop_reaper()
+        deadline = time.time() + timeout
+        while any(e.in_flight > 0 for e in self.engines.values()):
+            if time.time() >= deadline:
+                busy = [e.name for e in self.engines.values() if e.in_flight > 0]
+                logger.warning(f"⚠️ Shutdown timed out with requests in flight on: {', '.join(busy)}")
+                return False
+            time.sleep(0.1)
+        return True
+
+    def describe(self) -> Dict[str, Any]:
+        rss = current_rss_bytes()
+        return {
+            'engines': {name: e.describe() for name, e in self.engines.items()},
+            'memory': {
+                'budget_mb': round(self.memory_budget_bytes / (1024 * 1024), 1),
+                'engines_mb': round(self.used_bytes() / (1024 * 1024), 1),
+                'rss_mb': round(rss / (1024 * 1024), 1) if rss is not None else None
+            }
+        }
+
+
+# ============================================================================
+# WSGI dispatch
+# ============================================================================
+
+class GatewayDispatcher:
+    """Routes /<engine>/... to the engine's own Flask app, everything else to the gateway app"""
+
+    def __init__(self, registry: EngineRegistry, gateway_app: Flask):
+        self.registry = registry
+        self.gateway_app = gateway_app
+
+    def __call__(self, environ, start_response):
+        path = environ.get('PATH_INFO', '') or '/'
+        prefix, _, rest = path.lstrip('/').partition('/')
+        engine = self.registry.get(prefix)
+        if engine is None:
+            return self.gateway_app(environ, start_response)
+
+        try:
+            engine_app = self.registry.acquire(engine)
+        except EngineUnavailable as e:
+            body = json.dumps({'error': str(e), 'engine': engine.name}).encode()
+            start_response('503 Service Unavailable', [
+                ('Content-Type', 'application/json'),
+                ('Content-Length', str(len(body))),
+                ('Retry-After', '5')
+            ])
+            return [body]
+
+        environ = dict(environ)
+        environ['SCRIPT_NAME'] = environ.get('SCRIPT_NAME', '') + '/' + prefix
+        environ['PATH_INFO'] = '/' + rest
+        try:
+            response = engine_app(environ, start_response)
+        except Exception:
+            engine.release()
+            raise
+        # Keep the request counted until the response body has been sent
+        return ClosingIterator(response, [engine.release])
+
+
+def create_gateway_app(registry: EngineRegistry) -> Flask:
+    app = Flask(__name__)
+    CORS(app)
+
+    @app.route('/health', methods=['GET'])
+    def health():
+        return jsonify({
+            'status': 'healthy',
+            **registry.describe(),
+            'volume_cache': shared_volumes.stats()
+        })
+
+    @app.route('/engines', methods=['GET'])
+    def engines():
+        return jsonify(registry.describe()['engines'])
+
+    @app.route('/engines/<name>/load', methods=['POST'])
+    def load_engine(name):
+        if registry.get(name) is None:
+            return jsonify({'error': f"Unknown engine '{name}'"}), 404
+        pin = bool((request.get_json(silent=True) or {}).get('pin', False))
+        try:
+            registry.load(name, pin=pin)
+        except EngineUnavailable as e:
+            return jsonify({'error': str(e)}), 503
+        return jsonify({'engine': name, **registry.get(name).describe()})
+
+    @app.route('/engines/<name>/unload', methods=['POST'])
+    def unload_engine(name):
+        engine = registry.get(name)
+        if engine is None:
+            return jsonify({'error': f"Unknown engine '{name}'"}), 404
+        engine.pinned = False
+        if not engine.unload() and engine.state == 'loaded':
+            return jsonify({'error': f"Engine '{name}' has requests in flight"}), 409
+        return jsonify({'engine': name, **engine.describe()})
+
+    @app.route('/volumes', methods=['POST'])
+    def upload_volume():
+        try:
+            volume = parse_volume_upload(
+                request.get_data(),
+                request.content_type,
+                request.args,
+                request.get_json(silent=True)
+            )
+            volume_id = shared_volumes.put(volume)
+        except (ValueError, TypeError) as e:
+            return jsonify({'error': str(e)}), 400
+        except MemoryError as e:
+            return jsonify({'error': str(e)}), 413
+        return jsonify(shared_volumes.describe(volume_id))
+
+    @app.route('/volumes/<volume_id>', methods=['GET'])
+    def get_volume(volume_id):
+        info = shared_volumes.describe(volume_id)
+        if info is None:
+            return jsonify({'error': f"Unknown volume '{volume_id}'"}), 404
+        return jsonify(info)
+
+    @app.route('/volumes/<volume_id>', methods=['DELETE'])
+    def delete_volume(volume_id):
+        if not shared_volumes.remove(volume_id):
+            return jsonify({'error': f"Unknown volume '{volume_id}'"}), 404
+        return jsonify({'success': True})
+
+    return app
+
+
+def load_config(path: Optional[str]) -> Dict[str, Any]:
+    """
+    Gateway config (JSON), e.g.:
+
+    {
+        "device": "cpu",
+        "memory_budget_mb": 6144,
+        "idle_timeout": 600,
+        "engines": {
+            "sam": {"options": {"model_type": "vit_b", "checkpoint": "/models/sam_vit_b.pth"}, "pinned": true},
+            "segvol": {"idle_timeout": 300, "memory_mb": 3000},
+            "nninteractive": {"enabled": false}
+        }
+    }
+    """
+    if not path:
+        return {}
+    with open(path) as f:
+        return json.load(f)
+
+
+def split_names(value: Optional[str]) -> List[str]:
+    """'sam, mem3d' -> ['sam', 'mem3d']"""
+    return [name.strip() for name in (value or '').split(',') if name.strip()]
+
+
+def create_gateway(config: Optional[Dict[str, Any]] = None):
+    """Build the registry and the WSGI callable serving the gateway"""
+    registry = EngineRegistry(config)
+    return registry, GatewayDispatcher(registry, create_gateway_app(registry))
+
+
+def preload_engines(registry: EngineRegistry, names: List[str]):
+    """Load and pin engines up front; failures are logged, not fatal"""
+    for name in names:
+        if registry.get(name) is None:
+            logger.error(f"Cannot preload unknown or disabled engine '{name}'")
+            continue
+        try:
+            registry.load(name, pin=True)
+        except EngineUnavailable as e:
+            logger.error(f"Failed to preload '{name}': {e}")
+
+
+if __name__ == '__main__':
+    import argparse
+    from werkzeug.serving import run_simple
+
+    parser = argparse.ArgumentParser(description='AI Gateway (all segmentation engines in one process)')
+    parser.add_argument('--port', type=int, default=5100, help='Port to run on')
+    parser.add_argument('--host', type=str, default='127.0.0.1', help='Host to bind to')
+    parser.add_argument('--config', type=str, default=None, help='Gateway config JSON')
+    parser.add_argument('--device', type=str, default=None, help='Default device for all engines (cpu, cuda, mps)')
+    parser.add_argument('--memory-budget-mb', type=int, default=None, help='RAM budget for loaded engines')
+    parser.add_argument('--idle-timeout', type=float, default=None, help='Seconds before an idle engine is unloaded (0 = never)')
+    parser.add_argument('--engines', type=str, default=None, help='Comma-separated engines to enable (default: all)')
+    parser.add_argument('--preload', type=str, default='', help='Comma-separated engines to load and pin at startup')
+    args = parser.parse_args()
+
+    config = load_config(args.config)
+    if args.device:
+        config['device'] = args.device
+    if args.memory_budget_mb is not None:
+        config['memory_budget_mb'] = args.memory_budget_mb
+    if args.idle_timeout is not None:
+        config['idle_timeout'] = args.idle_timeout
+    if args.engines:
+        config['enabled'] = split_names(args.engines)
+
+    registry, dispatcher = create_gateway(config)
+    preload_engines(registry, split_names(args.preload))
+    registry.start_reaper()
+
+    logger.info(f"🚀 Starting AI gateway on {args.host}:{args.port} with engines: {', '.join(registry.engines)}")
+    run_simple(args.host, args.port, dispatcher, threaded=True, use_reloader=False)
@@ -0,0 +1,71 @@
+"""
+gunicorn config for the AI gateway
+
+    gunicorn -c gunicorn.conf.py wsgi:application
+
+Tunables (environment):
+    AI_GATEWAY_BIND            host:port (default 127.0.0.1:5100)
+    AI_GATEWAY_WORKERS         worker processes (default 2)
+    AI_GATEWAY_THREADS         request threads per worker (default 1)
+    AI_GATEWAY_TORCH_THREADS   torch intra-op threads per worker
+                               (default: CPU count / workers, at least 1)
+    AI_GATEWAY_TIMEOUT         seconds before a silent worker is killed (default 300)
+    AI_GATEWAY_GRACEFUL_TIMEOUT  seconds a stopping worker may finish requests (default 60)
+"""
+
+import os
+import gc
+import sys
+
+bind = os.environ.get('AI_GATEWAY_BIND', '127.0.0.1:5100')
+workers = int(os.environ.get('AI_GATEWAY_WORKERS', '2'))
+threads = int(os.environ.get('AI_GATEWAY_THREADS', '1'))
+worker_class = 'gthread' if threads > 1 else 'sync'
+
+# Load wsgi.py (and the preloaded weights) once in the master, then fork
+preload_app = True
+
+# 3D inference on CPU can take minutes; the default 30 s would kill workers mid-request
+timeout = int(os.environ.get('AI_GATEWAY_TIMEOUT', '300'))
+graceful_timeout = int(os.environ.get('AI_GATEWAY_GRACEFUL_TIMEOUT', '60'))
+keepalive = 5
+
+accesslog = '-'
+errorlog = '-'
+loglevel = 'info'
+
+torch_threads = int(os.environ.get(
+    'AI_GATEWAY_TORCH_THREADS',
+    max(1, (os.cpu_count() or 1) // max(1, workers))
+))
+
+
+def pre_fork(server, worker):
+    # Move everything allocated so far (modules, weights) into the permanent
+    # generation so workers' collections never write to the shared pages
+    gc.freeze()
+
+
+def post_fork(server, worker):
+    gc.enable()
+
+    torch = sys.modules.get('torch')
+    if torch is not None:
+        # Without this every worker starts one thread per core and they fight
+        torch.set_num_threads(torch_threads)
+        try:
+            torch.set_num_interop_threads(1)
+        except RuntimeError:
+            pass  # Already set or parallel work already started
+
+    # Threads do not survive fork; each worker reaps its own lazily loaded engines
+    from wsgi import registry
+    registry.start_reaper()
+    server.log.info(f"Worker {worker.pid} ready (torch threads: {torch_threads})")
+
+
+def worker_exit(server, worker):
+    # SIGTERM/SIGQUIT: gunicorn stops accepting, then this drains what is in flight
+    from wsgi import registry
+    if not registry.shutdown(timeout=graceful_timeout):
+        server.log.warning(f"Worker {worker.pid} exiting with requests still in flight")
@@ -0,0 +1,102 @@
+#!/usr/bin/env python3
+"""
+Pool of stateful predictors sharing one set of model weights
+
+SamPredictor keeps the current image embedding from set_image() as instance
+state, so one global predictor behind Flask's threaded handlers either races
+(request A predicts against request B's image) or serializes every click.
+A pool holds N predictors built on the same model; each request checks one
+out for its set_image → predict sequence and returns it afterwards:
+
+    pool = PredictorPool(lambda: SamPredictor(sam_model), size=2, name='sam')
+
+    with pool.checkout() as predictor:
+        predictor.set_image(image)
+        masks, scores, _ = predictor.predict(...)
+
+The weights are shared; only the per-image embedding is per instance.
+When all predictors are busy a request waits up to max_wait seconds and then
+fails with PoolTimeout, which services answer with 503.
+"""
+
+import os
+import queue
+import threading
+import time
+from contextlib import contextmanager
+from typing import Any, Callable, Dict, Optional
+
+DEFAULT_POOL_SIZE = int(os.environ.get('PREDICTOR_POOL_SIZE', '2'))
+DEFAULT_MAX_WAIT = float(os.environ.get('PREDICTOR_POOL_MAX_WAIT', '30'))
+
+
+class PoolTimeout(Exception):
+    """No predictor became free within the pool's max wait"""
+
+
+class PredictorPool:
+    """Fixed-size checkout pool with queue-depth and wait-time metrics"""
+
+    def __init__(self, factory: Callable[[], Any], size: int = DEFAULT_POOL_SIZE,
+                 max_wait: float = DEFAULT_MAX_WAIT, name: str = 'predictor'):
+        if size < 1:
+            raise ValueError("Pool size must be at least 1")
+        self.name = name
+        self.size = size
+        self.max_wait = max_wait
+        self._available = queue.LifoQueue()  # LIFO: the warmest predictor goes out first
+        for _ in range(size):
+            self._available.put(factory())
+
+        self._lock = threading.Lock()
+        self._waiting = 0
+        self._max_waiting = 0
+        self._checkouts = 0
+        self._timeouts = 0
+        self._total_wait = 0.0
+        self._max_wait_seen = 0.0
+
+    @contextmanager
+    def checkout(self, timeout: Optional[float] = None):
+        """Borrow a predictor for the duration of the with-block"""
+        timeout = self.max_wait if timeout is None else timeout
+        with self._lock:
+            self._waiting += 1
+            self._max_waiting = max(self._max_waiting, self._waiting)
+
+        started = time.perf_counter()
+        try:
+            predictor = self._available.get(timeout=timeout)
+        except queue.Empty:
+            with self._lock:
+                self._timeouts += 1
+            raise PoolTimeout(
+                f"All {self.size} {self.name} predictors busy for {timeout:g}s; try again shortly"
+            )
+        finally:
+            with self._lock:
+                self._waiting -= 1
+
+        waited = time.perf_counter() - started
+        with self._lock:
+            self._checkouts += 1
+            self._total_wait += waited
+            self._max_wait_seen = max(self._max_wait_seen, waited)
+
+        try:
+            yield predictor
+        finally:
+            self._available.put(predictor)
+
+    def stats(self) -> Dict[str, Any]:
+        with self._lock:
+            return {
+                'size': self.size,
+                'available': self._available.qsize(),
+                'waiting': self._waiting,
+                'max_waiting': self._max_waiting,
+                'checkouts': self._checkouts,
+                'timeouts': self._timeouts,
+                'avg_wait_ms': round(self._total_wait / self._checkouts * 1000, 2) if self._checkouts else 0.0,
+                'max_wait_ms': round(self._max_wait_seen * 1000, 2)
+            }
@@ -0,0 +1,46 @@
+#!/bin/bash
+# Start the AI gateway: every segmentation engine in one process
+#
+# Engines load on first request and unload after AI_GATEWAY_IDLE_TIMEOUT seconds.
+# Point the Node side at the per-engine prefixes, e.g.:
+#   SAM_SERVICE_URL=http://127.0.0.1:5100/sam
+#   MEM3D_SERVICE_URL=http://127.0.0.1:5100/mem3d
+#   SEGVOL_SERVICE_URL=http://127.0.0.1:5100/segvol
+
+set -e
+
+cd "$(dirname "$0")"
+
+DEVICE=${1:-cpu}
+PORT=${2:-5100}
+CONFIG=${AI_GATEWAY_CONFIG:-gateway.json}
+
+echo "🚀 Starting AI gateway..."
+echo "   Device: $DEVICE"
+echo "   Port: $PORT"
+echo "   RAM budget: ${AI_GATEWAY_MEMORY_BUDGET_MB:-8192} MB"
+echo "   Idle timeout: ${AI_GATEWAY_IDLE_TIMEOUT:-900} s"
+echo ""
+
+# Production: AI_GATEWAY_WORKERS=N serves with gunicorn (weights preloaded
+# before fork and shared copy-on-write, see gunicorn.conf.py)
+if [ -n "$AI_GATEWAY_WORKERS" ]; then
+    echo "   Workers: $AI_GATEWAY_WORKERS (gunicorn)"
+    if [ -f "$CONFIG" ]; then
+        export AI_GATEWAY_CONFIG="$CONFIG"
+    fi
+    export AI_GATEWAY_DEVICE="$DEVICE"
+    export AI_GATEWAY_BIND="${AI_GATEWAY_BIND:-127.0.0.1:$PORT}"
+    exec gunicorn -c gunicorn.conf.py wsgi:application
+fi
+
+ARGS=(--port "$PORT" --device "$DEVICE")
+if [ -f "$CONFIG" ]; then
+    echo "   Config: $CONFIG"
+    ARGS+=(--config "$CONFIG")
+fi
+if [ -n "$AI_GATEWAY_PRELOAD" ]; then
+    ARGS+=(--preload "$AI_GATEWAY_PRELOAD")
+fi
+
+python gateway.py "${ARGS[@]}"
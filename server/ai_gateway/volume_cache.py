@@ -0,0 +1,183 @@
+#!/usr/bin/env python3
+"""
+Shared volume cache for the segmentation engines
+
+When the engines run inside the AI gateway they share one process, so a volume
+uploaded once (POST /volumes on the gateway) can be referenced by id from any
+engine instead of re-sending and re-parsing the same JSON array per request:
+
+{
+    "volume_id": "3f9a...",      // instead of "volume": [[[...]]]
+    "click_point": [y, x, z],
+    ...
+}
+
+Volumes are content-addressed (same pixels → same id) and kept read-only so
+one engine can never modify another engine's input. The cache is LRU under a
+byte budget (AI_GATEWAY_VOLUME_CACHE_MB, default 2048).
+
+Services started on their own still work: resolve_volume() falls back to the
+inline "volume" field, and the cache simply lives in that service's process.
+"""
+
+import os
+import hashlib
+import logging
+import threading
+import time
+from collections import OrderedDict
+from typing import Any, Dict, Optional
+
+import numpy as np
+
+logger = logging.getLogger(__name__)
+
+DEFAULT_BUDGET_MB = int(os.environ.get('AI_GATEWAY_VOLUME_CACHE_MB', '2048'))
+
+
+class VolumeCache:
+    """Thread-safe LRU of read-only numpy volumes under a byte budget"""
+
+    def __init__(self, budget_bytes: int = DEFAULT_BUDGET_MB * 1024 * 1024):
+        self.budget_bytes = budget_bytes
+        self._volumes = OrderedDict()  # volume_id -> (array, created_at)
+        self._bytes = 0
+        self._lock = threading.Lock()
+        self.hits = 0
+        self.misses = 0
+
+    @staticmethod
+    def volume_id(volume: np.ndarray) -> str:
+        """Content hash of pixels, shape and dtype"""
+        digest = hashlib.blake2b(digest_size=16)
+        digest.update(str(volume.shape).encode())
+        digest.update(str(volume.dtype).encode())
+        digest.update(np.ascontiguousarray(volume).data)
+        return digest.hexdigest()
+
+    def put(self, volume: np.ndarray) -> str:
+        """Store a volume and return its id (no copy if it is already cached)"""
+        volume = np.ascontiguousarray(volume)
+        volume_id = self.volume_id(volume)
+
+        with self._lock:
+            if volume_id in self._volumes:
+                self._volumes.move_to_end(volume_id)
+                return volume_id
+
+            if volume.nbytes > self.budget_bytes:
+                raise MemoryError(
+                    f"Volume of {volume.nbytes / 1e6:.1f} MB exceeds the volume cache budget "
+                    f"of {self.budget_bytes / 1e6:.1f} MB"
+                )
+
+            while self._volumes and self._bytes + volume.nbytes > self.budget_bytes:
+                evicted_id, (evicted, _) = self._volumes.popitem(last=False)
+                self._bytes -= evicted.nbytes
+                logger.info(f"🗑️ Evicted volume {evicted_id[:8]} ({evicted.nbytes / 1e6:.1f} MB)")
+
+            if volume.flags.writeable:
+                volume = volume.copy() if volume.base is not None else volume
+                volume.flags.writeable = False
+            self._volumes[volume_id] = (volume, time.time())
+            self._bytes += volume.nbytes
+
+        logger.info(f"📦 Cached volume {volume_id[:8]} shape={volume.shape} dtype={volume.dtype}")
+        return volume_id
+
+    def get(self, volume_id: str) -> Optional[np.ndarray]:
+        with self._lock:
+            entry = self._volumes.get(volume_id)
+            if entry is None:
+                self.misses += 1
+                return None
+            self._volumes.move_to_end(volume_id)
+            self.hits += 1
+            return entry[0]
+
+    def describe(self, volume_id: str) -> Optional[Dict[str, Any]]:
+        with self._lock:
+            entry = self._volumes.get(volume_id)
+            if entry is None:
+                return None
+            volume, created_at = entry
+            return {
+                'volume_id': volume_id,
+                'shape': list(volume.shape),
+                'dtype': str(volume.dtype),
+                'bytes': int(volume.nbytes),
+                'created_at': created_at
+            }
+
+    def remove(self, volume_id: str) -> bool:
+        with self._lock:
+            entry = self._volumes.pop(volume_id, None)
+            if entry is None:
+                return False
+            self._bytes -= entry[0].nbytes
+            return True
+
+    def clear(self):
+        with self._lock:
+            self._volumes.clear()
+            self._bytes = 0
+
+    def stats(self) -> Dict[str, Any]:
+        with self._lock:
+            return {
+                'volumes': len(self._volumes),
+                'bytes': int(self._bytes),
+                'budget_bytes': int(self.budget_bytes),
+                'hits': self.hits,
+                'misses': self.misses
+            }
+
+
+# One cache per process; every engine imports this module by the same name
+shared_volumes = VolumeCache()
+
+
+def resolve_volume(data: Dict[str, Any], key: str = 'volume', dtype=np.float32) -> np.ndarray:
+    """
+    Volume for a request, either by reference ("<key>_id") or inline ("<key>")
+
+    Volumes resolved by id are read-only. Inline volumes are also cached when
+    the request sets "cache_volume": true, so follow-up requests can use the id.
+
+    Raises:
+        KeyError: neither field is present, or the id is unknown (evicted)
+    """
+    volume_id = data.get(f'{key}_id')
+    if volume_id:
+        volume = shared_volumes.get(volume_id)
+        if volume is None:
+            raise KeyError(f"Unknown {key}_id '{volume_id}' (not uploaded or evicted); re-send the {key}")
+        return volume if volume.dtype == dtype else volume.astype(dtype)
+
+    volume = np.array(data[key], dtype=dtype)
+    if data.get('cache_volume'):
+        shared_volumes.put(volume)
+    return volume
+
+
+def parse_volume_upload(body: bytes, content_type: str, args: Dict[str, str], json_data: Optional[Dict[str, Any]]) -> np.ndarray:
+    """
+    Volume from a POST /volumes request
+
+    Accepts either JSON {"volume": [[[...]]]} or a raw
+    little-endian buffer (application/octet-stream) with ?shape=D,H,W&dtype=int16.
+    """
+    if content_type and content_type.startswith('application/octet-stream'):
+        shape = args.get('shape')
+        if not shape:
+            raise ValueError("Binary volume upload requires ?shape=D,H,W")
+        shape = tuple(int(s) for s in shape.split(','))
+        dtype = np.dtype(args.get('dtype', 'float32')).newbyteorder('<')
+        volume = np.frombuffer(body, dtype=dtype)
+        if volume.size != int(np.prod(shape)):
+            raise ValueError(f"Buffer holds {volume.size} values, shape {shape} needs {int(np.prod(shape))}")
+        return volume.reshape(shape).astype(np.float32)
+
+    if not json_data or 'volume' not in json_data:
+        raise ValueError("Expected JSON body with 'volume' or an application/octet-stream buffer")
+    return np.array(json_data['volume'], dtype=np.float32)
@@ -0,0 +1,55 @@
+#!/usr/bin/env python3
+"""
+WSGI entry point for serving the AI gateway with gunicorn
+
+    gunicorn -c gunicorn.conf.py wsgi:application
+
+With preload_app (see gunicorn.conf.py) this module is imported once in the
+gunicorn master. Engines listed in AI_GATEWAY_PRELOAD are loaded and pinned
+here, before any worker is forked, so every worker maps the same weight pages
+copy-on-write instead of holding its own copy. Engines that are not preloaded
+still load lazily, but per worker.
+
+Configuration comes from the environment (the gateway CLI flags, as env vars):
+    AI_GATEWAY_CONFIG          gateway config JSON (see gateway.load_config)
+    AI_GATEWAY_DEVICE          default device for all engines (default: cpu)
+    AI_GATEWAY_ENGINES         comma-separated engines to enable (default: all)
+    AI_GATEWAY_PRELOAD         comma-separated engines to load before fork
+    AI_GATEWAY_MEMORY_BUDGET_MB, AI_GATEWAY_IDLE_TIMEOUT  as in gateway.py
+
+CUDA cannot be initialized before fork, so preloading is skipped (engines load
+per worker instead) unless the device is cpu.
+"""
+
+import os
+import sys
+import gc
+import logging
+
+sys.path.insert(0, os.path.dirname(os.path.abspath(__file__)))
+
+from gateway import create_gateway, load_config, preload_engines, split_names  # noqa: E402
+
+logger = logging.getLogger('ai_gateway.wsgi')
+
+# Keep the collector from touching (and so un-sharing) pages while the
+# weights load; gunicorn.conf.py freezes what survives and re-enables gc in workers
+gc.disable()
+
+config = load_config(os.environ.get('AI_GATEWAY_CONFIG'))
+config['device'] = os.environ.get('AI_GATEWAY_DEVICE', config.get('device', 'cpu'))
+if os.environ.get('AI_GATEWAY_ENGINES'):
+    config['enabled'] = split_names(os.environ['AI_GATEWAY_ENGINES'])
+
+registry, application = create_gateway(config)
+
+preload = split_names(os.environ.get('AI_GATEWAY_PRELOAD'))
+if preload and config['device'] != 'cpu':
+    logger.warning(
+        f"Not preloading {', '.join(preload)} before fork on device '{config['device']}' "
+        f"(CUDA/MPS state does not survive fork); engines will load per worker"
+    )
+else:
+    preload_engines(registry, preload)
+
+gc.collect()
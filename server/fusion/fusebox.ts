@@ -1,15 +1,17 @@
 import fs from 'fs';
 import path from 'path';
-import { spawn, spawnSync } from 'child_process';
+import { spawn, spawnSync, type ChildProcessWithoutNullStreams } from 'child_process';
 import dicomParser from 'dicom-parser';
 import { storage } from '../storage.ts';
 
-export type FuseboxTransformSource = 'matrix' | 'helper-generated' | 'helper-cache' | 'helper-regenerated' | 'matrix-fallback' | 'matrix-validated';
+export type FuseboxTransformSource = 'matrix' | 'helper-generated' | 'helper-cache' | 'helper-regenerated' | 'matrix-fallback' | 'matrix-validated' | 'reg-inprocess';
 
 export type FuseboxTransformInfo = {
   matrix?: number[];
   filePath?: string;
   transformFile?: string;
+  /** REG converted inside the resample process (scripts/dicom_reg_transform.py); matrix stays as fallback */
+  registrationFile?: string;
   transformSource?: FuseboxTransformSource;
   registrationId?: string;
 };
@@ -34,6 +36,7 @@ export const fuseboxHelperMetrics = {
   conversions: 0,
   failures: 0,
   disabled: 0,
+  inProcess: 0,
 };
 
 let resolvedFuseboxPython: string | null = null;
@@ -190,6 +193,21 @@ const maybeAttachHelperOutput = async (
   }
 
   const helper = process.env.DICOM_REG_CONVERTER;
+  if (!helper && process.env.FUSEBOX_INPROCESS_REG !== '0') {
+    // No subprocess or HDF5 round trip: the resample script converts (and memoizes) the REG itself
+    fuseboxHelperMetrics.inProcess += 1;
+    logHelper(emit, 'info', 'Converting registration in-process', {
+      primarySeriesId,
+      secondarySeriesId,
+      regFile: regPath,
+      candidateId,
+    });
+    return {
+      ...info,
+      registrationFile: regPath,
+      transformSource: 'reg-inprocess',
+    };
+  }
   if (!helper) {
     fuseboxHelperMetrics.disabled += 1;
     logHelper(emit, 'warn', 'Fusebox helper not configured; using matrix transform', {
@@ -568,7 +586,7 @@ export async function resolveFuseboxTransform(
     };
     try {
       const maybe = await maybeAttachHelperOutput(info, cand.regFile, candidateId, primaryFoR, secondaryFoR, logger, primarySeriesId, secondarySeriesId);
-      if (maybe?.transformFile) return maybe;
+      if (maybe?.transformFile || maybe?.registrationFile) return maybe;
       if (!fallbackMatrix) fallbackMatrix = maybe ?? info;
       else if (maybe && maybe.transformSource === 'matrix-validated') fallbackMatrix = maybe;
     } catch (err: any) {
@@ -627,7 +645,118 @@ export async function resolveFuseboxTransform(
   });
 }
 
+/**
+ * Long-lived `fusebox_resample.py --daemon` worker (enabled with FUSEBOX_DAEMON=1).
+ * Requests and responses are JSON lines matched by id; the Python side keeps
+ * sorted series, decoded secondaries and resolved transforms cached, so
+ * scrolling costs one resample per slice instead of a process start.
+ */
+class FuseboxResampleDaemon {
+  private child: ChildProcessWithoutNullStreams | null = null;
+  private ready: Promise<void> | null = null;
+  private buffer: Buffer = Buffer.alloc(0);
+  // Response line whose binary payload (binaryLength bytes) has not fully arrived yet
+  private awaitingBinary: any = null;
+  private nextId = 1;
+  private pending = new Map<number, (response: any) => void>();
+
+  private start(emit?: FuseboxLogEmitter): Promise<void> {
+    if (this.ready) return this.ready;
+    const python = resolveFuseboxPython(emit);
+    const scriptPath = path.resolve('scripts', 'fusebox_resample.py');
+    const args = [scriptPath, '--daemon'];
+    if (process.env.FUSEBOX_CACHE_MB) args.push('--cache-mb', process.env.FUSEBOX_CACHE_MB);
+    const child = spawn(python, args, { cwd: process.cwd() });
+    this.child = child;
+
+    this.ready = new Promise((resolve, reject) => {
+      let started = false;
+      child.stdout.on('data', (chunk: Buffer) => {
+        this.buffer = this.buffer.length ? Buffer.concat([this.buffer, chunk]) : chunk;
+        while (true) {
+          let message: any;
+          if (this.awaitingBinary) {
+            // binary: true responses are followed by binaryLength raw payload bytes
+            const length = this.awaitingBinary.binaryLength;
+            if (this.buffer.length < length) break;
+            message = this.awaitingBinary;
+            message.result = { ...message.result, binary: this.buffer.subarray(0, length) };
+            this.buffer = this.buffer.subarray(length);
+            this.awaitingBinary = null;
+          } else {
+            const newline = this.buffer.indexOf(0x0a);
+            if (newline < 0) break;
+            const line = this.buffer.subarray(0, newline).toString().trim();
+            this.buffer = this.buffer.subarray(newline + 1);
+            if (!line) continue;
+            try {
+              message = JSON.parse(line);
+            } catch {
+              logHelper(emit || defaultEmit, 'warn', 'Fusebox daemon emitted non-JSON output', { line: line.slice(0, 200) });
+              continue;
+            }
+            if (message.ready) {
+              started = true;
+              resolve();
+              continue;
+            }
+            if (message.binaryLength) {
+              this.awaitingBinary = message;
+              continue;
+            }
+          }
+          const settle = this.pending.get(message.id);
+          if (!settle) continue;
+          this.pending.delete(message.id);
+          settle(message.error ? { error: message.error } : message.result);
+        }
+      });
+      // stderr carries the script's FUSION logs; drain it so the pipe never blocks
+      child.stderr.on('data', () => {});
+      child.on('error', (err) => {
+        if (!started) reject(err);
+      });
+      child.on('close', (code) => {
+        logHelper(emit || defaultEmit, 'warn', 'Fusebox daemon exited', { code });
+        for (const settle of this.pending.values()) {
+          settle({ error: `fusebox daemon exited with code ${code}` });
+        }
+        this.pending.clear();
+        this.child = null;
+        this.ready = null;
+        this.buffer = Buffer.alloc(0);
+        this.awaitingBinary = null;
+        if (!started) reject(new Error(`fusebox daemon exited with code ${code} before becoming ready`));
+      });
+    });
+    return this.ready;
+  }
+
+  async request(config: Record<string, any>, emit?: FuseboxLogEmitter): Promise<any> {
+    await this.start(emit);
+    const child = this.child;
+    if (!child) throw new Error('fusebox daemon not running');
+    const id = this.nextId++;
+    return new Promise((resolve) => {
+      this.pending.set(id, resolve);
+      child.stdin.write(`${JSON.stringify({ id, config })}\n`);
+    });
+  }
+}
+
+const fuseboxResampleDaemon = new FuseboxResampleDaemon();
+
 export async function runFuseboxResample(config: Record<string, any>, emit?: FuseboxLogEmitter): Promise<any> {
+  if (process.env.FUSEBOX_DAEMON === '1') {
+    try {
+      return await fuseboxResampleDaemon.request(config, emit);
+    } catch (err: any) {
+      logHelper(emit || defaultEmit, 'warn', 'Fusebox daemon unavailable, falling back to one-shot process', {
+        err: err?.message || err,
+      });
+    }
+  }
+
   const python = resolveFuseboxPython(emit);
   const scriptPath = path.resolve('scripts', 'fusebox_resample.py');
   const tmpBase = path.join(process.cwd(), 'tmp');
@@ -638,18 +767,25 @@ export async function runFuseboxResample(config: Record<string, any>, emit?: Fus
 
   return new Promise((resolve) => {
     const child = spawn(python, [scriptPath, '--config', configPath], { cwd: process.cwd() });
-    let stdout = '';
+    const chunks: Buffer[] = [];
     let stderr = '';
-    child.stdout.on('data', (chunk) => { stdout += chunk.toString(); });
+    child.stdout.on('data', (chunk: Buffer) => { chunks.push(chunk); });
     child.stderr.on('data', (chunk) => { stderr += chunk.toString(); });
     child.on('close', async (code) => {
       try { await fs.promises.rm(tmpDir, { recursive: true, force: true }); } catch {}
+      const output = Buffer.concat(chunks);
       if (code !== 0) {
-        resolve({ error: stderr.trim() || stdout.trim() || `fusebox exited with code ${code}` });
+        resolve({ error: stderr.trim() || output.toString().trim() || `fusebox exited with code ${code}` });
         return;
       }
       try {
-        resolve(JSON.parse(stdout.trim()));
+        // binary: true puts the JSON header on the first line and the raw payloads after it
+        const newline = output.indexOf(0x0a);
+        const header = JSON.parse((newline >= 0 ? output.subarray(0, newline) : output).toString().trim());
+        if (header.binaryLength) {
+          header.binary = output.subarray(newline + 1, newline + 1 + header.binaryLength);
+        }
+        resolve(header);
       } catch (err) {
         resolve({ error: `Failed to parse fusebox output: ${(err as Error).message}` });
       }
@@ -492,7 +492,7 @@ export class FusionManifestService {
     const secondaryMeta = loadDicomMetadata(secondaryFirstFile);
 
     const transformInfo = await resolveFuseboxTransform(primarySeriesId, secondarySeriesId, undefined, logger);
-    if (!transformInfo || (!transformInfo.matrix && !transformInfo.transformFile)) {
+    if (!transformInfo || (!transformInfo.matrix && !transformInfo.transformFile && !transformInfo.registrationFile)) {
       throw new Error('Registration transform unavailable for series pair');
     }
 
@@ -514,6 +514,7 @@ export class FusionManifestService {
       secondarySeriesFiles: secondaryFiles,
       transformMatrix: transformInfo.matrix,
       transformFilePath: transformInfo.transformFile,
+      registrationFilePath: transformInfo.registrationFile,
       invertTransformFile,
       interpolation,
       outputDirectory: pairRoot,
@@ -69,14 +69,27 @@ export interface VolumeResampleMetadata {
 
 export interface VolumeResampleRequest {
   primarySeriesFiles: string[];
+  /** Image series slices, or RTDOSE file(s): same-grid doses are summed and resampled to a float32 volume */
   secondarySeriesFiles: string[];
   transformMatrix?: FloatArray;
   transformFilePath?: string | null;
+  /** DICOM REG converted in-process by the resampler; transformMatrix/transformFilePath are the fallback */
+  registrationFilePath?: string | null;
   invertTransformFile?: boolean;
   interpolation?: InterpolationMode;
   outputDirectory: string;
   metadata: VolumeResampleMetadata;
   scaleToUInt16?: boolean;
+  /** Resample only the primary sub-grid covered by the transformed secondary (see cropOffset) */
+  cropToSecondary?: boolean;
+  /** Write one Enhanced multi-frame instance instead of one file per slice (implies scaleToUInt16) */
+  multiFrame?: boolean;
+  /** DICOM writer threads (default: FUSEBOX_WRITER_THREADS or min(8, CPUs)) */
+  writerThreads?: number;
+  /** Compose a deformable transform chain into one cached displacement field on the primary grid */
+  denseField?: boolean;
+  /** Sample the dense field every N primary voxels (default 1) */
+  denseFieldShrink?: number;
 }
 
 export interface VolumeResampleInstance {
@@ -85,6 +98,7 @@ export interface VolumeResampleInstance {
   fileName: string;
   filePath: string;
   instanceNumber: number;
+  numberOfFrames?: number;
   imagePositionPatient: number[] | null;
   sliceLocation: number | null;
   windowCenter: number[] | null;
@@ -108,31 +122,88 @@ export interface VolumeResampleResponse {
   windowWidth: number[] | null;
   outputDirectory: string;
   manifestPath: string | null;
+  instanceLogPath?: string | null;
+  primarySize?: number[];
+  /** Primary voxel index [i, j, k] of the output's first voxel when cropToSecondary was applied */
+  cropOffset?: number[] | null;
+  cropSize?: number[] | null;
+  /** Content key of the volume cache entry (see scripts/fusebox_volume_cache.py) */
+  cacheKey?: string | null;
+  cacheHit?: boolean;
+  multiFrame?: boolean;
+  /** Present when denseField replaced a deformable chain (see scripts/fusebox_transform_cache.py) */
+  denseField?: { key: string; cacheHit: boolean; shrink: number; size: number[] } | null;
+  /** RTDOSE secondaries: raw little-endian float32 dose (z/y/x, shape) cropped to the dose box; instances is empty */
+  volumePath?: string;
+  dtype?: 'float32';
+  shape?: number[];
+  sliceSpacing?: number;
+  maxDose?: number;
+  doseUnits?: string | null;
+  doseType?: string | null;
+  doseSummationType?: string | null;
+  doseGridScaling?: number;
   instances: VolumeResampleInstance[];
 }
 
+export interface MultiVolumeResampleResponse {
+  ok: boolean;
+  /** One entry per request, in order; failed entries carry ok: false and error */
+  results: Array<VolumeResampleResponse | { ok: false; error: string; outputDirectory?: string }>;
+}
+
+const toSecondaryConfig = (request: VolumeResampleRequest) => ({
+  secondary: Array.from(new Set(request.secondarySeriesFiles.map((p) => path.resolve(p)))),
+  transform: request.transformMatrix && request.transformMatrix.length ? request.transformMatrix : undefined,
+  transformFile: request.transformFilePath || undefined,
+  registrationFile: request.registrationFilePath || undefined,
+  invertTransformFile: request.invertTransformFile ?? true,
+  interpolation: request.interpolation ?? 'linear',
+  outputDirectory: request.outputDirectory,
+  metadata: request.metadata,
+  // Keep viewer rendering unchanged by default; enable scaling only for explicit export workflows
+  scaleToUInt16: Boolean(request.scaleToUInt16),
+  cropToSecondary: Boolean(request.cropToSecondary),
+  multiFrame: Boolean(request.multiFrame),
+  writerThreads: request.writerThreads,
+  denseField: Boolean(request.denseField),
+  denseFieldShrink: request.denseFieldShrink,
+});
+
 export class FuseboxVolumeResampler {
   async execute(request: VolumeResampleRequest): Promise<VolumeResampleResponse> {
     if (!request.primarySeriesFiles.length) throw new Error('primarySeriesFiles empty');
     if (!request.secondarySeriesFiles.length) throw new Error('secondarySeriesFiles empty');
 
     const uniquePrimary = Array.from(new Set(request.primarySeriesFiles.map((p) => path.resolve(p))));
-    const uniqueSecondary = Array.from(new Set(request.secondarySeriesFiles.map((p) => path.resolve(p))));
 
     const config = {
       primary: uniquePrimary,
-      secondary: uniqueSecondary,
-      transform: request.transformMatrix && request.transformMatrix.length ? request.transformMatrix : undefined,
-      transformFile: request.transformFilePath || undefined,
-      invertTransformFile: request.invertTransformFile ?? true,
-      interpolation: request.interpolation ?? 'linear',
-      outputDirectory: request.outputDirectory,
-      metadata: request.metadata,
-      // Keep viewer rendering unchanged by default; enable scaling only for explicit export workflows
-      scaleToUInt16: Boolean(request.scaleToUInt16),
+      ...toSecondaryConfig(request),
     };
 
     const response = await runFuseboxScript<VolumeResampleResponse>('fusebox_resample_volume.py', config);
     return response;
   }
+
+  /**
+   * Resample several secondaries onto the same primary in one process: the
+   * primary is read once and the secondaries run in parallel threads.
+   * primarySeriesFiles is taken from the first request.
+   */
+  async executeMany(requests: VolumeResampleRequest[], parallelSecondaries?: number): Promise<MultiVolumeResampleResponse> {
+    if (!requests.length) throw new Error('no resample requests');
+    if (!requests[0].primarySeriesFiles.length) throw new Error('primarySeriesFiles empty');
+    requests.forEach((request, idx) => {
+      if (!request.secondarySeriesFiles.length) throw new Error(`secondarySeriesFiles empty for request ${idx}`);
+    });
+
+    const config = {
+      primary: Array.from(new Set(requests[0].primarySeriesFiles.map((p) => path.resolve(p)))),
+      secondaries: requests.map(toSecondaryConfig),
+      parallelSecondaries,
+    };
+
+    return runFuseboxScript<MultiVolumeResampleResponse>('fusebox_resample_volume.py', config);
+  }
 }
@@ -13,6 +13,10 @@ from flask import Flask, request, jsonify
 from flask_cors import CORS
 from typing import List, Dict, Tuple
 
+# Shared volume cache (server/ai_gateway); lets requests send volume_id instead of volume
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), '..', 'ai_gateway'))
+from volume_cache import resolve_volume
+
 # Setup logging
 logging.basicConfig(
     level=logging.INFO,
@@ -337,7 +341,7 @@ def segment():
         data = request.json
 
         # Parse inputs
-        volume = np.array(data['volume'], dtype=np.float32)
+        volume = resolve_volume(data)
         scribbles = data.get('scribbles', [])
         spacing = tuple(data.get('spacing', [1.0, 1.0, 1.0]))
 
@@ -14,6 +14,8 @@ import cv2
 from scipy.ndimage import binary_dilation, binary_erosion, gaussian_filter
 from scipy.spatial.distance import directed_hausdorff
 
+from label_maps import parse_multi_request, references_for_label, build_target_result
+
 logging.basicConfig(
     level=logging.INFO,
     format='%(asctime)s - %(name)s - %(levelname)s - %(message)s'
@@ -382,6 +384,56 @@ def predict():
         return jsonify({'error': str(e)}), 500
 
 
+@app.route('/predict_multi', methods=['POST'])
+def predict_multi():
+    """
+    Propagate every label of a reference label map to each target slice in one pass
+
+    Request/response format: see label_maps.py. Reference and target slices are
+    decoded once and shared by all labels.
+    """
+    try:
+        references, targets, labels, image_shape = parse_multi_request(request.get_json())
+
+        if not references or not labels:
+            return jsonify({'results': [], 'labels': labels, 'method': 'no_reference'})
+
+        logger.info(f"Multi-label prediction: {len(labels)} labels, {len(targets)} targets, "
+                    f"{len(references)} references")
+
+        results = []
+        for target in targets:
+            masks, confidences, qualities = {}, {}, {}
+
+            for label in labels:
+                nearby_refs = references_for_label(references, label, target['position'])
+                if not nearby_refs:
+                    continue
+
+                predicted_mask, quality = propagate_smart(
+                    [ref['mask'] for ref in nearby_refs],
+                    [ref['slice_data'] for ref in nearby_refs],
+                    [ref['position'] for ref in nearby_refs],
+                    target['slice_data'],
+                    target['position']
+                )
+                masks[label] = predicted_mask
+                qualities[label] = quality
+                confidences[label] = quality * 0.9
+
+            results.append(build_target_result(target['position'], masks, confidences, qualities, image_shape))
+
+        return jsonify({
+            'results': results,
+            'labels': labels,
+            'method': 'fast_shape_propagation'
+        })
+
+    except Exception as e:
+        logger.error(f"Multi-label prediction failed: {e}", exc_info=True)
+        return jsonify({'error': str(e)}), 500
+
+
 if __name__ == '__main__':
     import argparse
 
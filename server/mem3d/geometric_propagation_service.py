@@ -4,21 +4,27 @@ Geometric Contour Propagation Service
 Simple but effective contour propagation using geometric transformations
 
 This uses proven medical imaging techniques:
-- Centroid tracking
-- Scale estimation from intensity changes
+- Phase-correlation / multi-scale template matching motion estimation
+- Centroid tracking (fallback)
 - Shape interpolation between slices
 """
 
 import os
 import sys
 import json
+import hashlib
 import logging
-from typing import List, Dict, Any, Tuple
+import threading
+from collections import OrderedDict
+from functools import lru_cache
+from typing import List, Dict, Any, Optional, Tuple
 import numpy as np
 from flask import Flask, request, jsonify
 from flask_cors import CORS
 import cv2
 
+from label_maps import parse_multi_request, references_for_label, build_target_result
+
 logging.basicConfig(
     level=logging.INFO,
     format='%(asctime)s - %(name)s - %(levelname)s - %(message)s'
@@ -94,23 +100,292 @@ def estimate_scale_change(ref_image: np.ndarray, target_image: np.ndarray, ref_m
     return float(scale)
 
 
+# Motion estimation tuning
+SEARCH_RADIUS = 20            # Max translation (pixels) considered by the estimator
+ROI_GRID = 16                 # ROI boxes are snapped to this grid so spectra can be reused
+MIN_PEAK_QUALITY = 0.08       # Below this the phase-correlation peak is treated as noise
+MIN_MATCH_SCORE = 0.3         # Below this the template match is treated as noise
+SCALE_STEPS = (0.85, 0.9, 0.95, 1.0, 1.05, 1.1, 1.15)
+MAX_SPECTRUM_CACHE_ENTRIES = int(os.environ.get('GEOMETRIC_SPECTRUM_CACHE_SIZE', '512'))
+
+
+@lru_cache(maxsize=64)
+def hanning_window(height: int, width: int) -> np.ndarray:
+    """2D Hanning window (cached per ROI shape)"""
+    return cv2.createHanningWindow((width, height), cv2.CV_32F)
+
+
+class SliceSpectrumCache:
+    """
+    LRU cache of per-slice preprocessing for motion estimation
+
+    Slices are keyed by content digest, so the same CT slice sent again (as a
+    target, then as the next reference, or in a repeated propagation run) reuses
+    its normalized pixels and windowed ROI spectra instead of recomputing them.
+    """
+
+    def __init__(self, max_entries: int = MAX_SPECTRUM_CACHE_ENTRIES):
+        self.max_entries = max_entries
+        self.entries = OrderedDict()
+        self.lock = threading.Lock()
+        self.hits = 0
+        self.misses = 0
+
+    @staticmethod
+    def slice_key(image: np.ndarray) -> str:
+        digest = hashlib.blake2b(np.ascontiguousarray(image, dtype=np.float32).tobytes(), digest_size=16)
+        digest.update(str(image.shape).encode('ascii'))
+        return digest.hexdigest()
+
+    def _lookup(self, key: Tuple, build):
+        with self.lock:
+            if key in self.entries:
+                self.entries.move_to_end(key)
+                self.hits += 1
+                return self.entries[key]
+            self.misses += 1
+
+        value = build()
+
+        with self.lock:
+            self.entries[key] = value
+            self.entries.move_to_end(key)
+            while len(self.entries) > self.max_entries:
+                self.entries.popitem(last=False)
+        return value
+
+    def normalized(self, slice_key: str, image: np.ndarray) -> np.ndarray:
+        """Slice min-max normalized to [0, 1] as float32"""
+        def build():
+            img = image.astype(np.float32)
+            lo, hi = float(img.min()), float(img.max())
+            return (img - lo) / (hi - lo + 1e-8)
+
+        return self._lookup(('norm', slice_key), build)
+
+    def spectrum(self, slice_key: str, image: np.ndarray, box: Tuple[int, int, int, int]) -> np.ndarray:
+        """Real FFT of the zero-mean, Hanning-windowed ROI box (y0, y1, x0, x1)"""
+        def build():
+            y0, y1, x0, x1 = box
+            roi = self.normalized(slice_key, image)[y0:y1, x0:x1]
+            roi = (roi - roi.mean()) * hanning_window(y1 - y0, x1 - x0)
+            return np.fft.rfft2(roi)
+
+        return self._lookup(('fft', slice_key, box), build)
+
+    def stats(self) -> Dict[str, int]:
+        with self.lock:
+            return {'entries': len(self.entries), 'hits': self.hits, 'misses': self.misses}
+
+    def clear(self):
+        with self.lock:
+            self.entries.clear()
+
+
+spectrum_cache = SliceSpectrumCache()
+
+
+def snapped_roi_box(ref_mask: np.ndarray, margin: int) -> Optional[Tuple[int, int, int, int]]:
+    """Mask bounding box grown by margin and snapped outward to ROI_GRID"""
+    y_coords, x_coords = np.where(ref_mask > 0)
+    if len(x_coords) == 0:
+        return None
+
+    h, w = ref_mask.shape
+    y0 = max(0, (int(y_coords.min()) - margin) // ROI_GRID * ROI_GRID)
+    x0 = max(0, (int(x_coords.min()) - margin) // ROI_GRID * ROI_GRID)
+    y1 = min(h, -(-(int(y_coords.max()) + 1 + margin) // ROI_GRID) * ROI_GRID)
+    x1 = min(w, -(-(int(x_coords.max()) + 1 + margin) // ROI_GRID) * ROI_GRID)
+
+    if y1 - y0 < 8 or x1 - x0 < 8:
+        return None
+    return y0, y1, x0, x1
+
+
+def phase_correlate(ref_spectrum: np.ndarray, target_spectrum: np.ndarray,
+                    roi_shape: Tuple[int, int], max_shift: int) -> Tuple[float, float, float]:
+    """
+    Phase correlation of two windowed ROI spectra, restricted to |shift| <= max_shift
+
+    Returns:
+        shift_x, shift_y: sub-pixel translation of target relative to reference
+        peak_quality: normalized peak energy in [0, 1] (1 = perfect translation match)
+    """
+    cross_power = target_spectrum * np.conj(ref_spectrum)
+    cross_power /= np.abs(cross_power) + 1e-12
+    surface = np.fft.irfft2(cross_power, s=roi_shape)
+
+    # Bounded search window (shifts wrap around in the correlation surface)
+    surface = np.fft.fftshift(surface)
+    rows, cols = roi_shape
+    cy, cx = rows // 2, cols // 2
+    ry, rx = min(max_shift, cy - 1), min(max_shift, cx - 1)
+    window = surface[cy - ry:cy + ry + 1, cx - rx:cx + rx + 1]
+
+    py, px = np.unravel_index(int(np.argmax(window)), window.shape)
+
+    # Sub-pixel refinement: weighted centroid of the 3x3 neighbourhood
+    y_lo, y_hi = max(0, py - 1), min(window.shape[0], py + 2)
+    x_lo, x_hi = max(0, px - 1), min(window.shape[1], px + 2)
+    patch = np.clip(window[y_lo:y_hi, x_lo:x_hi], 0, None)
+    peak_energy = float(patch.sum())
+    if peak_energy > 0:
+        yy, xx = np.mgrid[y_lo:y_hi, x_lo:x_hi]
+        sub_y = float((yy * patch).sum() / peak_energy)
+        sub_x = float((xx * patch).sum() / peak_energy)
+    else:
+        sub_y, sub_x = float(py), float(px)
+
+    return sub_x - rx, sub_y - ry, float(np.clip(peak_energy, 0.0, 1.0))
+
+
+def match_scales(ref_norm: np.ndarray, target_norm: np.ndarray, ref_mask: np.ndarray,
+                 shift_x: float, shift_y: float, max_shift: int) -> Tuple[float, float, float, float]:
+    """
+    Multi-scale template matching of the reference structure around a predicted shift
+
+    Returns:
+        shift_x, shift_y: translation of the best match relative to the reference
+        scale: best template scale from SCALE_STEPS
+        score: normalized cross-correlation of the best match
+    """
+    y_coords, x_coords = np.where(ref_mask > 0)
+    h, w = ref_mask.shape
+    pad = 4
+    ty0, ty1 = max(0, y_coords.min() - pad), min(h, y_coords.max() + 1 + pad)
+    tx0, tx1 = max(0, x_coords.min() - pad), min(w, x_coords.max() + 1 + pad)
+    template = ref_norm[ty0:ty1, tx0:tx1]
+    center_x = (tx0 + tx1 - 1) / 2.0
+    center_y = (ty0 + ty1 - 1) / 2.0
+
+    best = (shift_x, shift_y, 1.0, -1.0)
+    for scale in SCALE_STEPS:
+        th = max(4, int(round(template.shape[0] * scale)))
+        tw = max(4, int(round(template.shape[1] * scale)))
+        scaled = cv2.resize(template, (tw, th), interpolation=cv2.INTER_LINEAR)
+
+        # Search window: predicted location ± max_shift
+        pred_x = center_x + shift_x
+        pred_y = center_y + shift_y
+        sy0 = int(max(0, np.floor(pred_y - th / 2.0 - max_shift)))
+        sx0 = int(max(0, np.floor(pred_x - tw / 2.0 - max_shift)))
+        sy1 = int(min(h, np.ceil(pred_y + th / 2.0 + max_shift)))
+        sx1 = int(min(w, np.ceil(pred_x + tw / 2.0 + max_shift)))
+        search = target_norm[sy0:sy1, sx0:sx1]
+        if search.shape[0] < th or search.shape[1] < tw:
+            continue
+
+        response = cv2.matchTemplate(search, scaled, cv2.TM_CCOEFF_NORMED)
+        _, score, _, loc = cv2.minMaxLoc(response)
+        if score > best[3]:
+            match_x = sx0 + loc[0] + (tw - 1) / 2.0
+            match_y = sy0 + loc[1] + (th - 1) / 2.0
+            best = (match_x - center_x, match_y - center_y, scale, float(score))
+
+    return best
+
+
+def estimate_motion(
+    ref_image: np.ndarray,
+    target_image: np.ndarray,
+    ref_mask: np.ndarray,
+    max_shift: int = SEARCH_RADIUS,
+    ref_key: Optional[str] = None,
+    target_key: Optional[str] = None
+) -> Dict[str, Any]:
+    """
+    Estimate in-plane motion of the masked structure from reference to target slice
+
+    Translation comes from phase correlation of windowed ROI spectra (cached per
+    slice), refined together with scale by multi-scale template matching inside
+    a bounded search window. Falls back to centroid tracking and the intensity
+    scale heuristic when neither estimate produces a clear peak.
+
+    ref_key / target_key are SliceSpectrumCache.slice_key digests; pass them when
+    the same slices are reused across several structures to skip re-hashing.
+
+    Returns:
+        Dict with shift_x, shift_y, scale, peak_quality, match_score, method
+    """
+    box = snapped_roi_box(ref_mask, max_shift)
+    if box is None:
+        shift_x, shift_y = find_centroid_shift(ref_image, target_image, ref_mask)
+        return {
+            'shift_x': float(shift_x),
+            'shift_y': float(shift_y),
+            'scale': estimate_scale_change(ref_image, target_image, ref_mask),
+            'peak_quality': 0.0,
+            'match_score': 0.0,
+            'method': 'centroid'
+        }
+
+    ref_key = ref_key or SliceSpectrumCache.slice_key(ref_image)
+    target_key = target_key or SliceSpectrumCache.slice_key(target_image)
+    roi_shape = (box[1] - box[0], box[3] - box[2])
+
+    shift_x, shift_y, peak_quality = phase_correlate(
+        spectrum_cache.spectrum(ref_key, ref_image, box),
+        spectrum_cache.spectrum(target_key, target_image, box),
+        roi_shape,
+        max_shift
+    )
+    if peak_quality < MIN_PEAK_QUALITY:
+        shift_x, shift_y = 0.0, 0.0
+
+    match_x, match_y, scale, match_score = match_scales(
+        spectrum_cache.normalized(ref_key, ref_image),
+        spectrum_cache.normalized(target_key, target_image),
+        ref_mask,
+        shift_x,
+        shift_y,
+        max_shift
+    )
+
+    phase_agrees = abs(match_x - shift_x) <= 1.5 and abs(match_y - shift_y) <= 1.5
+    if peak_quality >= MIN_PEAK_QUALITY and (phase_agrees or match_score < MIN_MATCH_SCORE):
+        # Sub-pixel phase shift, unless a scale change pulled the template elsewhere
+        method = 'phase_correlation'
+    elif match_score >= MIN_MATCH_SCORE:
+        method = 'template_match'
+        shift_x, shift_y = match_x, match_y
+    else:
+        method = 'centroid'
+        shift_x, shift_y = find_centroid_shift(ref_image, target_image, ref_mask)
+        scale = estimate_scale_change(ref_image, target_image, ref_mask)
+
+    if match_score < MIN_MATCH_SCORE and method != 'centroid':
+        scale = 1.0
+
+    return {
+        'shift_x': float(np.clip(shift_x, -max_shift, max_shift)),
+        'shift_y': float(np.clip(shift_y, -max_shift, max_shift)),
+        'scale': float(np.clip(scale, 0.8, 1.2)),
+        'peak_quality': float(peak_quality),
+        'match_score': float(max(match_score, 0.0)),
+        'method': method
+    }
+
+
 def propagate_contour(
     ref_mask: np.ndarray,
     ref_image: np.ndarray,
     target_image: np.ndarray,
     slice_distance: float,
     nearby_refs: List[Dict[str, Any]] = None,
-    image_shape: Tuple[int, int] = (512, 512)
-) -> Tuple[np.ndarray, float]:
+    image_shape: Tuple[int, int] = (512, 512),
+    ref_key: Optional[str] = None,
+    target_key: Optional[str] = None
+) -> Tuple[np.ndarray, float, Dict[str, Any]]:
     """
     Propagate contour from reference to target using:
     1. Multi-reference HU learning (learn from nearby slices)
-    2. Geometric transformations (shift, scale)
+    2. Geometric transformations (shift, scale) from motion estimation
     3. Spatial HU-based thresholding (segment similar tissue near predicted location)
 
     Returns:
         predicted_mask: Binary mask
         quality: Confidence score [0, 1]
+        motion: Motion estimate (see estimate_motion)
     """
     h, w = ref_mask.shape
 
@@ -132,7 +407,7 @@ def propagate_contour(
                 all_hu_values.append(nearby_pixels)
 
     if len(all_hu_values) == 0:
-        return np.zeros_like(ref_mask, dtype=np.uint8), 0.0
+        return np.zeros_like(ref_mask, dtype=np.uint8), 0.0, {}
 
     # Combine HU values from all nearby references for better statistics
     combined_hu = np.concatenate(all_hu_values)
@@ -151,11 +426,9 @@ def propagate_contour(
     logger.info(f"Reference HU stats: mean={hu_mean:.1f}, std={hu_std:.1f}, "
                 f"range=[{hu_min:.1f}, {hu_max:.1f}], threshold=[{hu_lower:.1f}, {hu_upper:.1f}]")
 
-    # 2. Find centroid shift
-    shift_x, shift_y = find_centroid_shift(ref_image, target_image, ref_mask)
-
-    # 3. Estimate scale change
-    scale = estimate_scale_change(ref_image, target_image, ref_mask)
+    # 2-3. Estimate translation and scale change
+    motion = estimate_motion(ref_image, target_image, ref_mask, ref_key=ref_key, target_key=target_key)
+    shift_x, shift_y, scale = motion['shift_x'], motion['shift_y'], motion['scale']
 
     # 4. Apply transformation to reference mask to get search region
     M_translate = np.float32([[1, 0, shift_x], [0, 1, shift_y]])
@@ -211,7 +484,11 @@ def propagate_contour(
     num_labels, labels, stats, centroids = cv2.connectedComponentsWithStats(final_mask, connectivity=8)
     if num_labels > 1:
         # Get geometric prediction centroid for reference
-        geometric_centroid = np.array([centroid_x, centroid_y])
+        geo_y, geo_x = np.where(geometric_mask > 0.5)
+        if len(geo_x) > 0:
+            geometric_centroid = np.array([geo_x.mean(), geo_y.mean()])
+        else:
+            geometric_centroid = np.array([w / 2.0, h / 2.0])
 
         # Find component with best score (size + proximity to geometric centroid)
         best_score = -1
@@ -255,11 +532,12 @@ def propagate_contour(
     quality = np.clip(quality, 0.3, 0.95)
 
     logger.info(f"Propagation: shift=({shift_x:.1f}, {shift_y:.1f}), scale={scale:.2f}, "
+                f"motion={motion['method']} (peak={motion['peak_quality']:.2f}, match={motion['match_score']:.2f}), "
                 f"HU_overlap={hu_overlap:.2f}, size_ratio={size_ratio:.2f}, "
                 f"distance={slice_distance:.1f}, quality={quality:.2f}, "
                 f"mask_pixels={final_mask.sum()}")
 
-    return final_mask, float(quality)
+    return final_mask, float(quality), motion
 
 
 @app.route('/health', methods=['GET'])
@@ -268,7 +546,8 @@ def health():
         'status': 'healthy',
         'model_loaded': True,
         'model_type': 'geometric_propagation',
-        'device': 'cpu'
+        'device': 'cpu',
+        'spectrum_cache': spectrum_cache.stats()
     })
 
 
@@ -310,7 +589,7 @@ def predict():
         slice_distance = target_position - closest_ref['position']
 
         # Propagate contour
-        predicted_mask, quality = propagate_contour(
+        predicted_mask, quality, motion = propagate_contour(
             ref_mask,
             ref_data,
             target_slice_data,
@@ -328,7 +607,8 @@ def predict():
             'metadata': {
                 'reference_position': closest_ref['position'],
                 'distance': abs(slice_distance),
-                'mask_pixels': int(predicted_mask.sum())
+                'mask_pixels': int(predicted_mask.sum()),
+                'motion': motion
             }
         })
 
@@ -337,9 +617,64 @@ def predict():
         return jsonify({'error': str(e)}), 500
 
 
+@app.route('/predict_multi', methods=['POST'])
+def predict_multi():
+    """
+    Propagate every label of a reference label map to each target slice in one pass
+
+    Request/response format: see label_maps.py. Slice digests, normalization and
+    ROI spectra are computed once per slice and shared by all labels.
+    """
+    try:
+        references, targets, labels, image_shape = parse_multi_request(request.get_json())
+
+        if not references or not labels:
+            return jsonify({'results': [], 'labels': labels, 'method': 'no_reference'})
+
+        for ref in references:
+            ref['slice_key'] = SliceSpectrumCache.slice_key(ref['slice_data'])
+
+        results = []
+        for target in targets:
+            target_image = target['slice_data']
+            target_key = SliceSpectrumCache.slice_key(target_image)
+            masks, confidences, qualities = {}, {}, {}
+
+            for label in labels:
+                nearby_refs = references_for_label(references, label, target['position'], n=1)
+                if not nearby_refs:
+                    continue
+                closest_ref = nearby_refs[0]
+
+                predicted_mask, quality, _ = propagate_contour(
+                    closest_ref['mask'],
+                    closest_ref['slice_data'],
+                    target_image,
+                    target['position'] - closest_ref['position'],
+                    ref_key=closest_ref['slice_key'],
+                    target_key=target_key
+                )
+                masks[label] = predicted_mask
+                qualities[label] = quality
+                confidences[label] = quality * 0.9
+
+            results.append(build_target_result(target['position'], masks, confidences, qualities, image_shape))
+
+        return jsonify({
+            'results': results,
+            'labels': labels,
+            'method': 'geometric_propagation'
+        })
+
+    except Exception as e:
+        logger.error(f"Multi-label prediction error: {e}", exc_info=True)
+        return jsonify({'error': str(e)}), 500
+
+
 @app.route('/clear_memory', methods=['POST'])
 def clear_memory():
-    return jsonify({'status': 'ok', 'message': 'Geometric method is stateless'})
+    spectrum_cache.clear()
+    return jsonify({'status': 'ok', 'message': 'Geometric spectrum cache cleared'})
 
 
 if __name__ == '__main__':
@@ -0,0 +1,139 @@
+#!/usr/bin/env python3
+"""
+Label map helpers for multi-structure propagation
+
+Shared by the propagation services' /predict_multi endpoints. A request carries
+reference slices with an integer label map (0 = background) instead of a single
+binary mask, plus any number of target slices:
+
+{
+    "reference_slices": [
+        {"slice_data": [...], "label_map": [...], "position": 50.0},
+        ...
+    ],
+    "target_slices": [
+        {"slice_data": [...], "position": 51.0},
+        ...
+    ],
+    "image_shape": [512, 512],
+    "labels": [1, 2, 5]  // Optional, defaults to every label in the references
+}
+
+Each service propagates all labels per target slice in one pass and answers
+with one merged label map per target slice (see build_target_result).
+"""
+
+from typing import List, Dict, Any, Tuple
+import numpy as np
+
+MAX_REFERENCES_PER_LABEL = 3
+
+
+def parse_multi_request(data: Dict[str, Any]) -> Tuple[List[Dict[str, Any]], List[Dict[str, Any]], List[int], Tuple[int, int]]:
+    """
+    Parse a multi-label propagation request
+
+    Returns:
+        references: dicts with 'slice_data', 'label_map', 'position' (arrays reshaped)
+        targets: dicts with 'slice_data', 'position'
+        labels: sorted label values to propagate
+        image_shape: (rows, cols)
+    """
+    image_shape = tuple(data.get('image_shape', [512, 512]))
+
+    references = []
+    for ref in data.get('reference_slices', []):
+        references.append({
+            'slice_data': np.asarray(ref['slice_data'], dtype=np.float32).reshape(image_shape),
+            'label_map': np.asarray(ref['label_map'], dtype=np.int32).reshape(image_shape),
+            'position': float(ref['position'])
+        })
+
+    targets = []
+    for target in data.get('target_slices', []):
+        targets.append({
+            'slice_data': np.asarray(target['slice_data'], dtype=np.float32).reshape(image_shape),
+            'position': float(target['position'])
+        })
+
+    labels = data.get('labels')
+    if labels:
+        labels = sorted({int(label) for label in labels if int(label) != 0})
+    else:
+        present = set()
+        for ref in references:
+            present.update(np.unique(ref['label_map']).tolist())
+        present.discard(0)
+        labels = sorted(int(label) for label in present)
+
+    return references, targets, labels, image_shape
+
+
+def references_for_label(
+    references: List[Dict[str, Any]],
+    label: int,
+    target_position: float,
+    n: int = MAX_REFERENCES_PER_LABEL
+) -> List[Dict[str, Any]]:
+    """
+    Nearest references (by position) in which the label is present
+
+    Returns dicts with 'slice_data', 'mask' (uint8), 'position', matching the
+    single-mask reference format the propagation functions already take. Any
+    per-slice preprocessing a service attached to the reference is kept.
+    """
+    candidates = []
+    for ref in sorted(references, key=lambda r: abs(r['position'] - target_position)):
+        mask = (ref['label_map'] == label).astype(np.uint8)
+        if mask.any():
+            candidate = {key: value for key, value in ref.items() if key != 'label_map'}
+            candidate['mask'] = mask
+            candidates.append(candidate)
+            if len(candidates) >= n:
+                break
+    return candidates
+
+
+def merge_label_masks(
+    masks: Dict[int, np.ndarray],
+    confidences: Dict[int, float],
+    image_shape: Tuple[int, int]
+) -> np.ndarray:
+    """
+    Merge per-label binary masks into one label map
+
+    Where predictions overlap, the label with the higher confidence wins.
+    """
+    label_map = np.zeros(image_shape, dtype=np.int32)
+    best = np.full(image_shape, -1.0, dtype=np.float32)
+    for label, mask in masks.items():
+        if mask is None or not mask.any():
+            continue
+        confidence = float(confidences.get(label, 0.0))
+        take = (mask > 0) & (best < confidence)
+        label_map[take] = label
+        best[take] = confidence
+    return label_map
+
+
+def build_target_result(
+    position: float,
+    masks: Dict[int, np.ndarray],
+    confidences: Dict[int, float],
+    qualities: Dict[int, float],
+    image_shape: Tuple[int, int]
+) -> Dict[str, Any]:
+    """JSON-ready result for one target slice"""
+    label_map = merge_label_masks(masks, confidences, image_shape)
+    return {
+        'position': position,
+        'label_map': label_map.flatten().tolist(),
+        'labels': {
+            str(label): {
+                'confidence': float(confidences.get(label, 0.0)),
+                'quality_score': float(qualities.get(label, 0.0)),
+                'mask_pixels': int((label_map == label).sum())
+            }
+            for label in masks
+        }
+    }
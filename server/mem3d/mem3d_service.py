@@ -22,6 +22,8 @@ from flask import Flask, request, jsonify
 from flask_cors import CORS
 import cv2
 
+from label_maps import parse_multi_request, references_for_label, build_target_result
+
 # Configure logging
 logging.basicConfig(
     level=logging.INFO,
@@ -286,35 +288,82 @@ class Mem3DPredictor:
             logger.error(f"Memory prediction failed: {e}", exc_info=True)
             raise
 
-    def _run_mem3d_inference(
+    def predict_labels(
         self,
-        memory_slices: List[Dict],
+        references: List[Dict[str, Any]],
+        labels: List[int],
         target_slice_data: np.ndarray,
-        target_position: float
-    ) -> Tuple[np.ndarray, float]:
-        """Run actual STM model inference"""
-        try:
-            import torch
-            import torch.nn.functional as F
+        target_slice_position: float
+    ) -> Dict[int, Dict[str, Any]]:
+        """
+        Predict several structures on one target slice from reference label maps
+
+        Uses per-label memory built from the references (the shared slice memory
+        used by /predict is left untouched). The target frame is prepared once and
+        shared by every label.
+
+        Returns:
+            {label: {'predicted_mask', 'confidence', 'quality_score'}}
+        """
+        target_tensor = self._prepare_frame(target_slice_data) if self.model is not None else None
+        predictions = {}
+
+        for label in labels:
+            memory_slices = references_for_label(references, label, target_slice_position)
+            if not memory_slices:
+                continue
 
-            # Normalize and prepare target image
-            # STM expects normalized float32 tensors in range [0, 1]
-            target_h, target_w = target_slice_data.shape
+            if self.model is not None:
+                predicted_mask, quality = self._run_mem3d_inference(
+                    memory_slices,
+                    target_slice_data,
+                    target_slice_position,
+                    target_tensor=target_tensor
+                )
+            else:
+                predicted_mask, quality = self._fallback_memory_prediction(
+                    memory_slices,
+                    target_slice_data,
+                    target_slice_position
+                )
+
+            predictions[label] = {
+                'predicted_mask': predicted_mask,
+                'confidence': self._calculate_confidence(predicted_mask, memory_slices, quality),
+                'quality_score': float(quality)
+            }
 
-            # Normalize target slice to [0, 1]
-            target_normalized = (target_slice_data - target_slice_data.min()) / (target_slice_data.max() - target_slice_data.min() + 1e-8)
-            target_normalized = target_normalized.astype(np.float32)
+        return predictions
 
-            # Convert to RGB by repeating grayscale channel (STM expects 3 channels)
-            target_rgb = np.stack([target_normalized] * 3, axis=0)  # (3, H, W)
+    def _prepare_frame(self, slice_data: np.ndarray) -> torch.Tensor:
+        """Normalize a slice into the (1, 3, H, W) ImageNet-normalized tensor STM expects"""
+        # Normalize slice to [0, 1]
+        normalized = (slice_data - slice_data.min()) / (slice_data.max() - slice_data.min() + 1e-8)
+        normalized = normalized.astype(np.float32)
 
-            # Apply ImageNet normalization (STM was trained with these statistics)
-            imagenet_mean = np.array([0.485, 0.456, 0.406]).reshape(3, 1, 1)
-            imagenet_std = np.array([0.229, 0.224, 0.225]).reshape(3, 1, 1)
-            target_rgb = (target_rgb - imagenet_mean) / imagenet_std
+        # Convert to RGB by repeating grayscale channel (STM expects 3 channels)
+        rgb = np.stack([normalized] * 3, axis=0)  # (3, H, W)
 
-            # Convert to torch tensor and add batch dimension
-            target_tensor = torch.from_numpy(target_rgb.astype(np.float32)).unsqueeze(0).to(self.device)  # (1, 3, H, W)
+        # Apply ImageNet normalization (STM was trained with these statistics)
+        imagenet_mean = np.array([0.485, 0.456, 0.406]).reshape(3, 1, 1)
+        imagenet_std = np.array([0.229, 0.224, 0.225]).reshape(3, 1, 1)
+        rgb = (rgb - imagenet_mean) / imagenet_std
+
+        # Convert to torch tensor and add batch dimension
+        return torch.from_numpy(rgb.astype(np.float32)).unsqueeze(0).to(self.device)  # (1, 3, H, W)
+
+    def _run_mem3d_inference(
+        self,
+        memory_slices: List[Dict],
+        target_slice_data: np.ndarray,
+        target_position: float,
+        target_tensor: Optional[torch.Tensor] = None
+    ) -> Tuple[np.ndarray, float]:
+        """Run actual STM model inference"""
+        try:
+            # Normalize and prepare target image (unless already prepared by the caller)
+            if target_tensor is None:
+                target_tensor = self._prepare_frame(target_slice_data)
 
             # Prepare memory from reference slices
             # Use the most recent reference slice as the "first frame" with mask
@@ -326,19 +375,9 @@ class Mem3DPredictor:
             sorted_memory = sorted(memory_slices, key=lambda m: abs(m['position'] - target_position))
             reference = sorted_memory[0]  # Closest reference slice
 
-            # Prepare reference image
-            ref_slice = reference['slice_data']
+            # Prepare reference image (same normalization as target)
             ref_mask = reference['mask']
-
-            # Normalize reference slice
-            ref_normalized = (ref_slice - ref_slice.min()) / (ref_slice.max() - ref_slice.min() + 1e-8)
-            ref_normalized = ref_normalized.astype(np.float32)
-            ref_rgb = np.stack([ref_normalized] * 3, axis=0)  # (3, H, W)
-
-            # Apply ImageNet normalization (same as target)
-            ref_rgb = (ref_rgb - imagenet_mean) / imagenet_std
-
-            ref_tensor = torch.from_numpy(ref_rgb.astype(np.float32)).unsqueeze(0).to(self.device)  # (1, 3, H, W)
+            ref_tensor = self._prepare_frame(reference['slice_data'])
 
             # Prepare reference mask - STM expects shape (B, num_objects+1, H, W) with background as channel 0
             # Create a mask tensor with background and foreground channels
@@ -682,6 +721,54 @@ def predict():
         return jsonify({'error': str(e)}), 500
 
 
+@app.route('/predict_multi', methods=['POST'])
+def predict_multi():
+    """
+    Predict every label of a reference label map on each target slice in one pass
+
+    Request/response format: see label_maps.py. Unlike /predict, references are
+    not added to the shared slice memory; each label gets its own memory built
+    from the references that contain it.
+    """
+    try:
+        if predictor is None:
+            return jsonify({'error': 'Model not loaded'}), 500
+
+        references, targets, labels, image_shape = parse_multi_request(request.json)
+
+        if not references or not labels:
+            return jsonify({'results': [], 'labels': labels, 'method': 'mem3d_no_memory'})
+
+        logger.info(f"🎯 Multi-label prediction: {len(labels)} labels, {len(targets)} targets, "
+                    f"{len(references)} references")
+
+        results = []
+        for target in targets:
+            predictions = predictor.predict_labels(
+                references=references,
+                labels=labels,
+                target_slice_data=target['slice_data'],
+                target_slice_position=target['position']
+            )
+            results.append(build_target_result(
+                target['position'],
+                {label: p['predicted_mask'] for label, p in predictions.items()},
+                {label: p['confidence'] for label, p in predictions.items()},
+                {label: p['quality_score'] for label, p in predictions.items()},
+                image_shape
+            ))
+
+        return jsonify({
+            'results': results,
+            'labels': labels,
+            'method': 'mem3d_memory' if predictor.model else 'mem3d_fallback'
+        })
+
+    except Exception as e:
+        logger.error(f"Multi-label prediction error: {e}", exc_info=True)
+        return jsonify({'error': str(e)}), 500
+
+
 @app.route('/recommend_slice', methods=['POST'])
 def recommend_slice():
     """
@@ -22,6 +22,12 @@ from flask import Flask, request, jsonify
 from flask_cors import CORS
 import cv2
 
+from label_maps import parse_multi_request, references_for_label, build_target_result
+
+# Predictor pool (server/ai_gateway) for concurrent set_image/predict
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), '..', 'ai_gateway'))
+from predictor_pool import PredictorPool, PoolTimeout, DEFAULT_POOL_SIZE
+
 # Configure logging
 logging.basicConfig(
     level=logging.INFO,
@@ -42,10 +48,12 @@ class MedSAMPredictor:
     Wrapper for MedSAM/SAM model for medical image segmentation
     """
 
-    def __init__(self, model_path: str, device: str = 'cpu'):
+    def __init__(self, model_path: str, device: str = 'cpu', pool_size: int = DEFAULT_POOL_SIZE):
         self.device = torch.device(device)
         self.model = None
         self.model_type = None
+        self.pool_size = pool_size
+        self.predictors = None  # PredictorPool of SamPredictor sharing self.model
 
         if model_path:
             self._load_model(model_path)
@@ -86,8 +94,9 @@ class MedSAMPredictor:
             sam.to(device=self.device)
             sam.eval()
 
-            # Create predictor
-            self.model = SamPredictor(sam)
+            # Create predictors: one set of weights, per-request image state
+            self.model = sam
+            self.predictors = PredictorPool(lambda: SamPredictor(sam), size=self.pool_size, name=self.model_type)
 
             # Count parameters
             total_params = sum(p.numel() for p in sam.parameters()) / 1e6
@@ -95,6 +104,7 @@ class MedSAMPredictor:
             logger.info(f"✅ {self.model_type} loaded successfully!")
             logger.info(f"   Parameters: {total_params:.1f}M")
             logger.info(f"   Device: {self.device}")
+            logger.info(f"   Predictors: {self.pool_size}")
 
         except ImportError as e:
             logger.error(f"Failed to import segment_anything: {e}")
@@ -126,81 +136,125 @@ class MedSAMPredictor:
             raise ValueError("Model not loaded")
 
         try:
-            # Prepare image for SAM (needs RGB, uint8)
-            # Normalize grayscale CT to 0-255
-            image_norm = ((image - image.min()) / (image.max() - image.min() + 1e-8) * 255).astype(np.uint8)
-
-            # Convert to RGB by repeating channels
-            image_rgb = np.stack([image_norm] * 3, axis=-1)  # (H, W, 3)
-
-            # Set the image for SAM
-            self.model.set_image(image_rgb)
-
-            # Strategy: Use reference mask as a low-resolution mask prompt
-            # SAM can take a mask prompt which guides the segmentation
-            # This is the closest to "memory" that SAM supports
-
-            # Extract positive points from reference mask for fallback
-            y_coords, x_coords = np.where(reference_mask > 0)
-
-            if len(x_coords) == 0:
-                logger.warning("No positive pixels in reference mask")
-                return np.zeros_like(reference_mask, dtype=np.uint8), 0.0
-
-            # Get bounding box from reference mask
-            y_min, y_max = y_coords.min(), y_coords.max()
-            x_min, x_max = x_coords.min(), x_coords.max()
-            bbox = np.array([x_min, y_min, x_max, y_max])
-
-            # Get centroid as a point prompt
-            center_x, center_y = int(x_coords.mean()), int(y_coords.mean())
-            point_coords = np.array([[center_x, center_y]])
-            point_labels = np.array([1])  # Positive point
-
-            # Use reference mask as a mask prompt
-            # SAM expects mask prompts as (1, 256, 256) float32
-            # We need to resize the reference mask to SAM's mask size
-            h, w = reference_mask.shape
-
-            # Resize reference mask to 256x256 (SAM's mask input size)
-            import cv2
-            ref_mask_256 = cv2.resize(reference_mask.astype(np.float32), (256, 256), interpolation=cv2.INTER_LINEAR)
-
-            # Add batch dimension and convert to SAM format
-            mask_input = ref_mask_256[None, :, :].astype(np.float32)  # (1, 256, 256)
-
-            # Predict with both point and mask prompts for better results
-            masks, scores, logits = self.model.predict(
-                point_coords=point_coords,
-                point_labels=point_labels,
-                box=bbox[None, :],  # Add batch dimension
-                mask_input=mask_input,
-                multimask_output=True,  # Get multiple proposals
-                return_logits=return_logits
-            )
-
-            # Choose best mask based on IoU with reference
-            best_idx = 0
-            best_iou = 0.0
-            for i, mask in enumerate(masks):
-                intersection = np.logical_and(mask, reference_mask).sum()
-                union = np.logical_or(mask, reference_mask).sum()
-                iou = intersection / (union + 1e-8)
-                if iou > best_iou:
-                    best_iou = iou
-                    best_idx = i
-
-            predicted_mask = masks[best_idx].astype(np.uint8)
-            quality_score = float(scores[best_idx])
-
-            logger.info(f"SAM prediction: quality={quality_score:.3f}, IoU with reference={best_iou:.3f}, mask sum={predicted_mask.sum()}")
-
-            return predicted_mask, quality_score
+            with self.predictors.checkout() as predictor:
+                self._set_target_image(predictor, image)
+                return self._predict_with_reference(predictor, reference_mask, return_logits)
 
+        except PoolTimeout:
+            raise
         except Exception as e:
             logger.error(f"Prediction failed: {e}", exc_info=True)
             return np.zeros_like(reference_mask, dtype=np.uint8), 0.0
 
+    def predict_labels(
+        self,
+        image: np.ndarray,
+        reference_masks: Dict[int, np.ndarray]
+    ) -> Dict[int, Tuple[np.ndarray, float]]:
+        """
+        Predict several structures on one target slice
+
+        The image embedding (set_image) is computed once and shared by every
+        label; only the prompt encoder / mask decoder run per label.
+
+        Returns:
+            {label: (predicted_mask, quality_score)}
+        """
+        if self.model is None:
+            raise ValueError("Model not loaded")
+
+        predictions = {}
+        with self.predictors.checkout() as predictor:
+            self._set_target_image(predictor, image)
+
+            for label, reference_mask in reference_masks.items():
+                try:
+                    predictions[label] = self._predict_with_reference(predictor, reference_mask)
+                except Exception as e:
+                    logger.error(f"Prediction failed for label {label}: {e}", exc_info=True)
+                    predictions[label] = (np.zeros_like(reference_mask, dtype=np.uint8), 0.0)
+        return predictions
+
+    def _set_target_image(self, predictor, image: np.ndarray):
+        """Compute the SAM image embedding for a grayscale slice"""
+        # Prepare image for SAM (needs RGB, uint8)
+        # Normalize grayscale CT to 0-255
+        image_norm = ((image - image.min()) / (image.max() - image.min() + 1e-8) * 255).astype(np.uint8)
+
+        # Convert to RGB by repeating channels
+        image_rgb = np.stack([image_norm] * 3, axis=-1)  # (H, W, 3)
+
+        # Set the image for SAM
+        predictor.set_image(image_rgb)
+
+    def _predict_with_reference(
+        self,
+        predictor,
+        reference_mask: np.ndarray,
+        return_logits: bool = False
+    ) -> Tuple[np.ndarray, float]:
+        """Prompt SAM with a reference mask against the image set by _set_target_image"""
+        # Strategy: Use reference mask as a low-resolution mask prompt
+        # SAM can take a mask prompt which guides the segmentation
+        # This is the closest to "memory" that SAM supports
+
+        # Extract positive points from reference mask for fallback
+        y_coords, x_coords = np.where(reference_mask > 0)
+
+        if len(x_coords) == 0:
+            logger.warning("No positive pixels in reference mask")
+            return np.zeros_like(reference_mask, dtype=np.uint8), 0.0
+
+        # Get bounding box from reference mask
+        y_min, y_max = y_coords.min(), y_coords.max()
+        x_min, x_max = x_coords.min(), x_coords.max()
+        bbox = np.array([x_min, y_min, x_max, y_max])
+
+        # Get centroid as a point prompt
+        center_x, center_y = int(x_coords.mean()), int(y_coords.mean())
+        point_coords = np.array([[center_x, center_y]])
+        point_labels = np.array([1])  # Positive point
+
+        # Use reference mask as a mask prompt
+        # SAM expects mask prompts as (1, 256, 256) float32
+        # We need to resize the reference mask to SAM's mask size
+        h, w = reference_mask.shape
+
+        # Resize reference mask to 256x256 (SAM's mask input size)
+        import cv2
+        ref_mask_256 = cv2.resize(reference_mask.astype(np.float32), (256, 256), interpolation=cv2.INTER_LINEAR)
+
+        # Add batch dimension and convert to SAM format
+        mask_input = ref_mask_256[None, :, :].astype(np.float32)  # (1, 256, 256)
+
+        # Predict with both point and mask prompts for better results
+        masks, scores, logits = predictor.predict(
+            point_coords=point_coords,
+            point_labels=point_labels,
+            box=bbox[None, :],  # Add batch dimension
+            mask_input=mask_input,
+            multimask_output=True,  # Get multiple proposals
+            return_logits=return_logits
+        )
+
+        # Choose best mask based on IoU with reference
+        best_idx = 0
+        best_iou = 0.0
+        for i, mask in enumerate(masks):
+            intersection = np.logical_and(mask, reference_mask).sum()
+            union = np.logical_or(mask, reference_mask).sum()
+            iou = intersection / (union + 1e-8)
+            if iou > best_iou:
+                best_iou = iou
+                best_idx = i
+
+        predicted_mask = masks[best_idx].astype(np.uint8)
+        quality_score = float(scores[best_idx])
+
+        logger.info(f"SAM prediction: quality={quality_score:.3f}, IoU with reference={best_iou:.3f}, mask sum={predicted_mask.sum()}")
+
+        return predicted_mask, quality_score
+
 
 @app.route('/health', methods=['GET'])
 def health():
@@ -209,7 +263,8 @@ def health():
         'status': 'healthy',
         'model_loaded': sam_model is not None and sam_model.model is not None,
         'model_type': sam_model.model_type if sam_model and sam_model.model else None,
-        'device': str(device)
+        'device': str(device),
+        'predictor_pool': sam_model.predictors.stats() if sam_model and sam_model.predictors else None
     })
 
 
@@ -281,11 +336,63 @@ def predict():
             }
         })
 
+    except PoolTimeout as e:
+        logger.warning(str(e))
+        return jsonify({'error': str(e)}), 503
+
     except Exception as e:
         logger.error(f"Prediction error: {e}", exc_info=True)
         return jsonify({'error': str(e)}), 500
 
 
+@app.route('/predict_multi', methods=['POST'])
+def predict_multi():
+    """
+    Predict every label of a reference label map on each target slice in one pass
+
+    Request/response format: see label_maps.py. The SAM image embedding is
+    computed once per target slice and shared by all labels.
+    """
+    try:
+        references, targets, labels, image_shape = parse_multi_request(request.get_json())
+
+        if not references or not labels:
+            return jsonify({'results': [], 'labels': labels, 'method': 'no_reference'})
+
+        results = []
+        for target in targets:
+            reference_masks = {}
+            for label in labels:
+                nearby_refs = references_for_label(references, label, target['position'], n=1)
+                if nearby_refs:
+                    reference_masks[label] = nearby_refs[0]['mask']
+
+            predictions = sam_model.predict_labels(target['slice_data'], reference_masks)
+
+            masks, confidences, qualities = {}, {}, {}
+            for label, (predicted_mask, quality) in predictions.items():
+                mask_ratio = predicted_mask.sum() / predicted_mask.size
+                masks[label] = predicted_mask
+                qualities[label] = quality
+                confidences[label] = quality * (0.7 + 0.3 * min(mask_ratio / 0.1, 1.0))
+
+            results.append(build_target_result(target['position'], masks, confidences, qualities, image_shape))
+
+        return jsonify({
+            'results': results,
+            'labels': labels,
+            'method': sam_model.model_type
+        })
+
+    except PoolTimeout as e:
+        logger.warning(str(e))
+        return jsonify({'error': str(e)}), 503
+
+    except Exception as e:
+        logger.error(f"Multi-label prediction error: {e}", exc_info=True)
+        return jsonify({'error': str(e)}), 500
+
+
 @app.route('/clear_memory', methods=['POST'])
 def clear_memory():
     """Clear all stored memory"""
@@ -301,6 +408,8 @@ if __name__ == '__main__':
     parser.add_argument('--model-path', type=str, required=True, help='Path to SAM/MedSAM checkpoint')
     parser.add_argument('--device', type=str, default='cpu', help='Device (cpu or cuda)')
     parser.add_argument('--host', type=str, default='127.0.0.1', help='Host to bind to')
+    parser.add_argument('--pool-size', type=int, default=DEFAULT_POOL_SIZE,
+                        help='SAM predictors sharing the weights (parallel requests)')
 
     args = parser.parse_args()
 
@@ -308,7 +417,7 @@ if __name__ == '__main__':
     logger.info(f"Initializing SAM service on {args.device}")
 
     # Load model
-    sam_model = MedSAMPredictor(args.model_path, args.device)
+    sam_model = MedSAMPredictor(args.model_path, args.device, pool_size=args.pool_size)
 
     logger.info(f"Starting SAM service on {args.host}:{args.port}")
     app.run(host=args.host, port=args.port, debug=False)
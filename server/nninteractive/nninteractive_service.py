@@ -28,6 +28,10 @@ except (ImportError, AttributeError):
         """Compatibility shim when huggingface_hub does not expose the exception."""
         pass
 
+# Shared volume cache (server/ai_gateway); lets requests send volume_id instead of volume
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), '..', 'ai_gateway'))
+from volume_cache import resolve_volume
+
 # Configure logging
 logging.basicConfig(
     level=logging.INFO,
@@ -550,7 +554,7 @@ def segment():
         data = request.get_json()
 
         # Parse volume
-        volume = np.array(data['volume'], dtype=np.float32)
+        volume = resolve_volume(data)
 
         # Parse inputs
         scribbles = data.get('scribbles', [])
@@ -3446,7 +3446,7 @@ export async function registerRoutes(app: Express): Promise<Server> {
       }
 
       const transformInfo = await resolveFuseboxTransform(primarySeriesId, secondarySeriesId, requestedRegistrationId, fuseboxEmit);
-      if (!transformInfo || (!transformInfo.matrix && !transformInfo.transformFile)) {
+      if (!transformInfo || (!transformInfo.matrix && !transformInfo.transformFile && !transformInfo.registrationFile)) {
         return res.status(404).json({ error: 'Registration transform unavailable for series pair' });
       }
 
@@ -3456,6 +3456,7 @@ export async function registerRoutes(app: Express): Promise<Server> {
         secondary: secondaryFiles,
         transform: transformInfo.matrix,
         transformFile: transformInfo.transformFile,
+        registrationFile: transformInfo.registrationFile,
         invertTransformFile,
         sliceIndex,
         interpolation,
@@ -3554,25 +3555,40 @@ export async function registerRoutes(app: Express): Promise<Server> {
         blend: any;
       }>;
 
-      for (const sliceIndex of sliceIndices) {
-        const result = await runFuseboxResample({ ...baseConfig, sliceIndex }, fuseboxEmit);
-        if (!result || result.error) {
-          return res.status(500).json({
-            error: 'Fusebox resample failed',
-            details: result?.error || 'Unknown error',
-            sliceIndex,
-          });
-        }
+      // One stacked call for every requested slice; split back into per-slice payloads
+      const result = await runFuseboxResample({ ...baseConfig, sliceIndices, includeBlend: true }, fuseboxEmit);
+      if (!result || result.error) {
+        return res.status(500).json({
+          error: 'Fusebox resample failed',
+          details: result?.error || 'Unknown error',
+          sliceIndices,
+        });
+      }
+      const decoded = new Map<any, Buffer>();
+      const unstack = (stack: any, position: number) => {
+        const frameBytes = stack.width * stack.height * 4;
+        if (!decoded.has(stack)) decoded.set(stack, Buffer.from(stack.data, 'base64'));
+        const bytes = decoded.get(stack)!;
+        const { min, max } = stack.slices[position];
+        return {
+          width: stack.width,
+          height: stack.height,
+          min,
+          max,
+          data: bytes.subarray(position * frameBytes, (position + 1) * frameBytes).toString('base64'),
+        };
+      };
+      (result.sliceIndices as number[]).forEach((sliceIndex, position) => {
         slices.push({
           sliceIndex,
-          primary: result.primary,
+          primary: unstack(result.primary, position),
           secondary: {
-            ...(result.secondary || {}),
+            ...unstack(result.secondary, position),
             modality: secondarySeries.modality || null,
           },
-          blend: result.blend,
+          blend: unstack(result.blend, position),
         });
-      }
+      });
 
       // Extract Frame of Reference UIDs from DICOM files
       const extractFrameOfReferenceUID = (filePath: string): string | null => {
@@ -3863,7 +3879,7 @@ export async function registerRoutes(app: Express): Promise<Server> {
       }
 
       const transformInfo = await resolveFuseboxTransform(primarySeriesId, secondarySeriesId, requestedRegistrationId);
-      if (!transformInfo || (!transformInfo.matrix && !transformInfo.transformFile)) {
+      if (!transformInfo || (!transformInfo.matrix && !transformInfo.transformFile && !transformInfo.registrationFile)) {
         return res.status(404).json({ error: 'Registration transform unavailable for series pair' });
       }
 
@@ -3885,6 +3901,7 @@ export async function registerRoutes(app: Express): Promise<Server> {
           secondary: secondaryFiles,
           transform: transformInfo.matrix,
           transformFile: transformInfo.transformFile,
+          registrationFile: transformInfo.registrationFile,
           sliceIndex,
           interpolation: 'linear',
         }, fuseboxEmit);
@@ -15,6 +15,12 @@ from pathlib import Path
 import cv2
 from scipy.ndimage import label as scipy_label
 
+# Shared helpers (server/ai_gateway): volume cache (volume_id instead of volume)
+# and the predictor pool for concurrent set_image/predict
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), '..', 'ai_gateway'))
+from volume_cache import resolve_volume
+from predictor_pool import PredictorPool, PoolTimeout, DEFAULT_POOL_SIZE
+
 # Setup logging
 logging.basicConfig(
     level=logging.INFO,
@@ -41,18 +47,19 @@ CORS(app)
 
 # Global model references
 sam_model = None
-sam_predictor = None
+sam_predictors = None  # PredictorPool of SamPredictor, all sharing sam_model
 
 
-def load_sam_model(model_type="vit_b", checkpoint_path=None):
+def load_sam_model(model_type="vit_b", checkpoint_path=None, pool_size=DEFAULT_POOL_SIZE):
     """
     Load SAM model.
     
     Args:
         model_type: "vit_h" (huge), "vit_l" (large), "vit_b" (base)
         checkpoint_path: Path to model weights
+        pool_size: Predictors sharing the weights (concurrent requests served in parallel)
     """
-    global sam_model, sam_predictor
+    global sam_model, sam_predictors
     
     try:
         from segment_anything import sam_model_registry, SamPredictor
@@ -82,9 +89,9 @@ def load_sam_model(model_type="vit_b", checkpoint_path=None):
     sam_model.to(device=device)
     sam_model.eval()
     
-    sam_predictor = SamPredictor(sam_model)
+    sam_predictors = PredictorPool(lambda: SamPredictor(sam_model), size=pool_size, name='SAM')
     
-    logger.info("✅ SAM model loaded successfully")
+    logger.info(f"✅ SAM model loaded successfully ({pool_size} predictors)")
 
 
 def normalize_medical_image(image_slice, window_center=None, window_width=None):
@@ -139,9 +146,7 @@ def segment_with_sam(image_slice, click_point=None, window_center=None, window_w
     Returns:
         Binary mask (H, W) as numpy array, confidence score
     """
-    global sam_predictor
-    
-    if sam_predictor is None:
+    if sam_predictors is None:
         raise RuntimeError("SAM model not loaded")
     
     H, W = image_slice.shape
@@ -176,15 +181,16 @@ def segment_with_sam(image_slice, click_point=None, window_center=None, window_w
     # SAM expects RGB, so convert grayscale to 3-channel
     img_rgb = cv2.cvtColor(img_normalized, cv2.COLOR_GRAY2RGB)
     
-    # Set image
-    sam_predictor.set_image(img_rgb)
-    
-    # Run prediction with all points
-    masks, scores, logits = sam_predictor.predict(
-        point_coords=input_points,
-        point_labels=input_labels,
-        multimask_output=True,  # Get multiple masks
-    )
+    # set_image state is per predictor, so hold one for set_image + predict
+    with sam_predictors.checkout() as predictor:
+        predictor.set_image(img_rgb)
+        
+        # Run prediction with all points
+        masks, scores, logits = predictor.predict(
+            point_coords=input_points,
+            point_labels=input_labels,
+            multimask_output=True,  # Get multiple masks
+        )
     
     # Pick the best mask (highest confidence)
     best_idx = np.argmax(scores)
@@ -330,7 +336,7 @@ def segment_3d_with_propagation(volume, start_slice, start_point, window_center=
 @app.route('/health', methods=['GET'])
 def health():
     """Health check endpoint."""
-    if sam_predictor is None:
+    if sam_predictors is None:
         return jsonify({
             'status': 'error',
             'message': 'SAM model not loaded',
@@ -341,7 +347,8 @@ def health():
         'status': 'ready',
         'message': 'SAM service is ready',
         'device': str(device),
-        'model': 'SAM (Segment Anything Model)'
+        'model': 'SAM (Segment Anything Model)',
+        'predictor_pool': sam_predictors.stats()
     })
 
 
@@ -370,13 +377,13 @@ def segment():
     }
     """
     try:
-        if sam_predictor is None:
+        if sam_predictors is None:
             return jsonify({'error': 'SAM model not loaded'}), 503
         
         data = request.json
         
         # Parse input
-        volume = np.array(data['volume'], dtype=np.float32)
+        volume = resolve_volume(data)
         click_point = data['click_point']  # [y, x, z]
         slice_axis = data.get('slice_axis', 'last')
         window_center = data.get('window_center')
@@ -440,6 +447,10 @@ def segment():
         
         return jsonify(result)
     
+    except PoolTimeout as e:
+        logger.warning(f"🔬 ⏳ {e}")
+        return jsonify({'error': str(e)}), 503
+    
     except Exception as e:
         logger.error(f"🔬 ❌ SAM segmentation failed: {e}", exc_info=True)
         return jsonify({'error': str(e)}), 500
@@ -468,7 +479,7 @@ def segment_2d():
     }
     """
     try:
-        if sam_predictor is None:
+        if sam_predictors is None:
             return jsonify({'error': 'SAM model not loaded'}), 503
         
         data = request.json
@@ -526,6 +537,10 @@ def segment_2d():
         
         return jsonify(result)
     
+    except PoolTimeout as e:
+        logger.warning(f"🔬 ⏳ {e}")
+        return jsonify({'error': str(e)}), 503
+    
     except Exception as e:
         logger.error(f"🔬 ❌ 2D SAM segmentation failed: {e}", exc_info=True)
         return jsonify({'error': str(e)}), 500
@@ -545,11 +560,13 @@ if __name__ == '__main__':
                         choices=['vit_h', 'vit_l', 'vit_b'],
                         help='SAM model size')
     parser.add_argument('--checkpoint', type=str, default=None, help='Path to model checkpoint')
+    parser.add_argument('--pool-size', type=int, default=DEFAULT_POOL_SIZE,
+                        help='SAM predictors sharing the weights (parallel requests)')
     args = parser.parse_args()
     
     # Load model
     try:
-        load_sam_model(args.model, args.checkpoint)
+        load_sam_model(args.model, args.checkpoint, pool_size=args.pool_size)
     except Exception as e:
         logger.error(f"Failed to load SAM model: {e}")
         sys.exit(1)
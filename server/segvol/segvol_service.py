@@ -30,6 +30,10 @@ except (ImportError, AttributeError):
         """Compatibility shim when huggingface_hub does not expose the exception."""
         pass
 
+# Shared volume cache (server/ai_gateway); lets requests send volume_id instead of volume
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), '..', 'ai_gateway'))
+from volume_cache import resolve_volume
+
 # Configure logging
 logging.basicConfig(
     level=logging.INFO,
@@ -811,7 +815,7 @@ def segment_from_scribbles():
         data = request.json
 
         # Parse inputs
-        volume = np.array(data['volume'], dtype=np.float32)
+        volume = resolve_volume(data)
         scribbles = data.get('scribbles', [])
         spacing = tuple(data.get('spacing', [1.0, 1.0, 1.0]))
 
@@ -14,6 +14,10 @@ from flask import Flask, request, jsonify
 from pathlib import Path
 from scipy.ndimage import label as scipy_label
 
+# Shared volume cache (server/ai_gateway); lets requests send volume_id instead of volume
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), '..', 'ai_gateway'))
+from volume_cache import resolve_volume
+
 # Setup logging
 logging.basicConfig(
     level=logging.DEBUG,  # Changed to DEBUG for more detailed output
@@ -593,7 +597,7 @@ def segment():
         data = request.json
         
         # Parse input
-        volume = np.array(data['volume'], dtype=np.float32)
+        volume = resolve_volume(data)
         click_point = data['click_point']  # [y, x, z]
         slice_axis = data.get('slice_axis', 'last')
         